@@ -116,5 +116,9 @@ setup(
     [console_scripts]
     update_locale = collective.volto.formsupport.locales.update:update_locale
     formsupport_data_cleansing = collective.volto.formsupport.scripts.cleansing:main
+    formsupport_mail_queue = collective.volto.formsupport.scripts.mail_queue:main
+    formsupport_data_split = collective.volto.formsupport.scripts.split_soups:main
+    formsupport_data_merge = collective.volto.formsupport.scripts.merge_pending:main
+    formsupport_data_to_sqlite = collective.volto.formsupport.scripts.to_sqlite:main
     """,
 )
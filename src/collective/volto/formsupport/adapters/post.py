@@ -1,15 +1,20 @@
 from collective.volto.formsupport import _
+from collective.volto.formsupport import logger
 from collective.volto.formsupport.interfaces import ICaptchaSupport
 from collective.volto.formsupport.interfaces import IPostAdapter
 from collective.volto.formsupport.restapi.services.submit_form.field import (
     construct_field,
     construct_fields,
 )
-from collective.volto.formsupport.utils import get_blocks
+from collective.volto.formsupport.submission import get_submission_context
+from collective.volto.formsupport.submission import (  # noqa: F401
+    GLOBAL_FORM_REGISTRY_RECORD_ID,
+)
+from collective.volto.formsupport.utils import has_markup
 from collective.volto.otp.utils import validate_email_token
 from copy import deepcopy
 from plone import api
-from plone.restapi.deserializer import json_body
+from plone.memoize.instance import memoize
 from zExceptions import BadRequest
 from zope.component import adapter
 from zope.component import getMultiAdapter
@@ -22,15 +27,9 @@ import os
 from datetime import datetime
 from urllib.parse import urlparse
 
-from plone.restapi.deserializer import json_body
 from plone.restapi.serializer.converters import json_compatible
 
 
-GLOBAL_FORM_REGISTRY_RECORD_ID = (
-    "collective.volto.formsupport.interfaces.IGlobalFormStore.global_forms_config"
-)
-
-
 @implementer(IPostAdapter)
 @adapter(Interface, Interface)
 class PostAdapter:
@@ -40,9 +39,10 @@ class PostAdapter:
     def __init__(self, context, request):
         self.context = context
         self.request = request
+        self.submission = get_submission_context(context, request)
         self.form_data = self.extract_data_from_request()
         self.block_id = self.form_data.get("block_id", "")
-        self.global_form_id = self.extract_data_from_request().get("global_form_id", "")
+        self.global_form_id = self.form_data.get("global_form_id", "")
         if self.block_id:
             self.block = self.get_block_data(
                 block_id=self.block_id,
@@ -62,29 +62,14 @@ class PostAdapter:
         filtered_fields = self.filter_parameters()
 
         errors = {}
+        hidden_fields = self.schema.hidden_fields(filtered_fields)
         for field in filtered_fields:
-            show_when = field.show_when_when
-            should_show = True
-            if show_when and show_when != "always":
-                target_field = [
-                    val for val in filtered_fields if val.id == field.show_when_when
-                ]
-                # We're an array at this point
-                if target_field:
-                    target_field = target_field[0]
-                    should_show = (
-                        target_field.should_show(
-                            show_when_is=field.show_when_is, target_value=field.show_when_to
-                        )
-                        if target_field
-                        else True
-                    )
-
-            if should_show:
-                field_errors = field.validate(self.request)
+            if field.id in hidden_fields:
+                continue
+            field_errors = field.validate(self.request)
 
-                if field_errors:
-                    errors[field.field_id] = field_errors
+            if field_errors:
+                errors[field.field_id] = field_errors
 
         if errors:
             self.request.response.setStatus(400)
@@ -103,60 +88,63 @@ class PostAdapter:
         return self.form_data
 
     def extract_data_from_request(self):
-        form_data = json_body(self.request)
+        # the parsed body is shared with the other consumers of this request
+        form_data = dict(self.submission.data)
 
         fixed_fields = []
-        transforms = api.portal.get_tool(name="portal_transforms")
 
         block = self.get_block_data(
             block_id=form_data.get("block_id", ""),
             global_form_id=form_data.get("global_form_id"),
         )
-        block_fields = [x.get("field_id", "") for x in block.get("subblocks", [])]
-        custom_block_fields = [
-            block.get(field_id) for field_id in block_fields if block.get(field_id)
-        ]
+        schema = self.submission.schema(block)
 
         for form_field in form_data.get("data", []):
             field_id = form_field.get("custom_field_id", form_field.get("field_id", ""))
-            if field_id not in block_fields and field_id not in custom_block_fields:
+            if not schema.accepts(field_id):
                 # unknown field, skip it
                 continue
-            new_field = deepcopy(form_field)
-            value = new_field.get("value", "")
-            if isinstance(value, str):
-                stream = transforms.convertTo("text/plain", value, mimetype="text/html")
-                new_field["value"] = stream.getData().strip()
-            fixed_fields.append(new_field)
+            fixed_fields.append(deepcopy(form_field))
+
+        string_fields = [
+            field for field in fixed_fields if isinstance(field.get("value", ""), str)
+        ]
+        values = self.sanitize_values(
+            [field.get("value", "") for field in string_fields]
+        )
+        for field, value in zip(string_fields, values):
+            field["value"] = value
 
         form_data["data"] = fixed_fields
 
         return form_data
 
+    def sanitize_values(self, values):
+        """
+        Convert a list of html strings to plain text.
+
+        Values without tags or entities are not changed by the transform, so
+        only the others are sent to portal_transforms.
+        """
+        result = [value.strip() for value in values]
+        to_convert = [i for i, value in enumerate(values) if has_markup(value)]
+        if not to_convert:
+            return result
+        transforms = api.portal.get_tool(name="portal_transforms")
+        for i in to_convert:
+            stream = transforms.convertTo("text/plain", values[i], mimetype="text/html")
+            result[i] = stream.getData().strip()
+        return result
+
     def get_block_data(self, block_id, global_form_id):
-        blocks = get_blocks(self.context)
-        global_form_id = global_form_id
-        if global_form_id:
-            global_forms = api.portal.get_registry_record(
-                GLOBAL_FORM_REGISTRY_RECORD_ID
-            )
-            if global_forms:
-                blocks = {**blocks, **global_forms}
-        if not blocks:
-            return {}
-        for id, block in blocks.items():
-            # Prefer local forms it they're available, fall back to global form
-            if (
-                id != block_id
-                and id != global_form_id
-                and block.get("global_form_id") != global_form_id
-            ):
-                continue
-            block_type = block.get("@type", "")
-            if block_type != "form":
-                continue
-            return block
-        return {}
+        return self.submission.resolve_block(
+            block_id=block_id, global_form_id=global_form_id
+        )
+
+    @property
+    def schema(self):
+        """The compiled FormSchema of the block"""
+        return self.submission.schema(self.block)
 
     def validate_form(self):
         """
@@ -220,14 +208,9 @@ class PostAdapter:
         """
         If otp validation is enabled, check if is valid
         """
-        bcc_fields = []
+        bcc_fields = self.schema.bcc_fields
         email_otp_verification = self.block.get("email_otp_verification", False)
         block_id = self.form_data.get("block_id", "")
-        for field in self.block.get("subblocks", []):
-            if field.get("use_as_bcc", False):
-                field_id = field.get("field_id", "")
-                if field_id not in bcc_fields:
-                    bcc_fields.append(field_id)
         if not bcc_fields:
             return
         if not email_otp_verification:
@@ -292,7 +275,14 @@ class PostAdapter:
     def filter_parameters(self):
         """
         do not send attachments fields.
+
+        Fields are built once per submission and shared by the validation,
+        the email and the store.
         """
+        return list(self._filter_parameters())
+
+    @memoize
+    def _filter_parameters(self):
         fields = [field for field in self.format_fields() if field.send_in_email]
 
         additionalInfo = self.block.get('sendAdditionalInfo', [])
@@ -300,7 +290,6 @@ class PostAdapter:
         # Using the referer rather than self.context as the context doesn't always match up to the current page depending on the form setup.
         pageUrl = self.request.get("HTTP_REFERER")
         parsedUrl = urlparse(pageUrl)
-        content_object_for_path = api.content.get(parsedUrl.path)
 
         if "date" in additionalInfo:
             fields.append(construct_field({'field_id': 'date', 'label': 'Date', 'field_type': 'date', 'value': datetime.now()}))
@@ -309,57 +298,43 @@ class PostAdapter:
         if "currentUrl" in additionalInfo:
             fields.append(construct_field({'field_id': 'url', 'label': 'URL', 'value': parsedUrl.path}))
         if "title" in additionalInfo:
+            # traversing the referer path is expensive: only when needed
+            content_object_for_path = api.content.get(parsedUrl.path)
             if content_object_for_path:
                 fields.append(construct_field({'field_id': 'current_page_title', 'label': 'Page title', 'value': content_object_for_path.title}))
             else:
-                print("FAILED TO GET CONTENT OBJECT")
+                logger.warning(
+                    "Page title not added to the submission, no content at "
+                    f"{parsedUrl.path}"
+                )
 
         return fields
 
     def format_fields(self):
+        return list(self._format_fields())
+
+    @memoize
+    def _format_fields(self):
+        schema = self.schema
         fields_data = []
         for submitted_field in self.form_data.get("data", []):
             # TODO: Review if fields submitted without a field_id should be included. Is breaking change if we remove it
-            if submitted_field.get("field_id") is None:
+            field_id = submitted_field.get("field_id")
+            if field_id is None:
                 fields_data.append(submitted_field)
                 continue
-            # for field in self.block.get("subblocks", []):
-            #     if field.get("id", field.get("field_id")) == submitted_field.get(
-            #         "field_id"
-            #     ):
-            #         fields_data.append(
-            #             {
-            #                 **field,
-            #                 **submitted_field,
-            #                 "display_value_mapping": field.get("display_values"),
-            #                 "custom_field_id": self.block.get(field["field_id"]),
-            #             }
-            #         )
-            validations_for_field = {}
-            for field in self.block.get("subblocks", []):
-                validation_ids_to_apply = field.get("validations", [])
-                for validation_and_setting_id, setting_value in field.get(
-                    "validationSettings", {}
-                ).items():
-                    split_validation_and_setting_ids = validation_and_setting_id.split("-")
-                    if len(split_validation_and_setting_ids) < 2:
-                        continue
-                    validation_id, setting_id = split_validation_and_setting_ids
-                    if validation_id not in validation_ids_to_apply:
-                        continue
-                    if validation_id not in validations_for_field:
-                        validations_for_field[validation_id] = {}
-                    validations_for_field[validation_id][setting_id] = setting_value
+            field = schema.get(field_id, {})
             fields_data.append(
                 {
                     **field,
                     **submitted_field,
-                    "id": submitted_field["field_id"],  # Ensure we always use the submitted field id
+                    "id": field_id,  # Ensure we always use the submitted field id
                     "display_value_mapping": field.get("display_values"),
-                    "custom_field_id": self.block.get(submitted_field["field_id"]),
+                    "custom_field_id": schema.custom_field_ids.get(field_id),
                     # We're straying from how validations are serialized and deserialized here to make our lives easier.
                     #   Let's use a dictionary of {'validation_id': {'setting_id': 'setting_value'}} when working inside fields for simplicity.
-                    "validations": validations_for_field,
+                    "validations": schema.validations.get(field_id, {}),
+                    "validators": schema.validators.get(field_id),
                 }
             )
         return construct_fields(fields_data)
@@ -2,7 +2,7 @@ from . import CaptchaSupport
 from collective.honeypot.config import HONEYPOT_FIELD
 from collective.honeypot.utils import found_honeypot
 from collective.volto.formsupport import _
-from plone.restapi.deserializer import json_body
+from collective.volto.formsupport.submission import get_submission_context
 from zExceptions import BadRequest
 from zope.i18n import translate
 
@@ -32,7 +32,8 @@ class HoneypotSupport(CaptchaSupport):
         # (because by default it does not insert the honeypot field into the submitted form)
         if not data:
             # @submit-form has been called not from volto-form-block so do the standard validation.
-            form_data = json_body(self.request).get("data", [])
+            submission = get_submission_context(self.context, self.request)
+            form_data = submission.data.get("data", [])
             form = {x["label"]: x["value"] for x in form_data}
             if found_honeypot(form, required=True):
                 raise BadRequest(msg)
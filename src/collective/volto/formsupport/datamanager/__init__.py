@@ -0,0 +1,23 @@
+from collective.volto.formsupport.datamanager.catalog import FormDataStore
+from collective.volto.formsupport.datamanager.spool import get_spool_directory
+from collective.volto.formsupport.datamanager.spool import SpoolFormDataStore
+from collective.volto.formsupport.datamanager.sqlite import get_sqlite_path
+from collective.volto.formsupport.datamanager.sqlite import SQLiteFormDataStore
+from collective.volto.formsupport.interfaces import IFormDataStore
+from plone.dexterity.interfaces import IDexterityContent
+from zope.component import adapter
+from zope.interface import implementer
+from zope.interface import Interface
+
+
+@implementer(IFormDataStore)
+@adapter(IDexterityContent, Interface)
+def form_data_store_factory(context, request):
+    """The SQLite store if FORM_DATA_SQLITE_PATH is set, the spool files if
+    FORM_DATA_SPOOL_DIRECTORY is set, or the soups
+    """
+    if get_sqlite_path():
+        return SQLiteFormDataStore(context, request)
+    if get_spool_directory():
+        return SpoolFormDataStore(context, request)
+    return FormDataStore(context, request)
@@ -0,0 +1,201 @@
+from collective.volto.formsupport import logger
+from collective.volto.formsupport.submission import get_submission_context
+from datetime import date
+from datetime import datetime
+from datetime import time
+from DateTime import DateTime
+from decimal import Decimal
+
+import base64
+import json
+
+
+# record attributes with the schema version and the values of the fields
+SCHEMA_ATTR = "_schema"
+VALUES_ATTR = "_values"
+# record attributes that aren't form fields
+RECORD_ATTRS = ("date", "url", "block_id")
+LEGACY_ATTRS = ("fields_labels", "fields_order")
+# key of the JSON objects encoding the values that JSON doesn't keep
+TYPE_KEY = "__type__"
+VALUE_DECODERS = {
+    "tuple": tuple,
+    "set": set,
+    "dict": lambda items: {key: value for key, value in items},
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "DateTime": DateTime,
+    "bytes": base64.b64decode,
+    "Decimal": Decimal,
+}
+
+
+def merge_schemas(schemas):
+    """The union of the (field_id, label) tuples of the schemas, in order"""
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            fields.setdefault(tuple(field), None)
+    return list(fields)
+
+
+def encode_value(value):
+    """A JSON compatible version of a field value, that keeps the types the
+    soups store and JSON doesn't: tuples, sets, dicts with other keys than
+    strings, dates, times, DateTime, bytes and Decimal.
+
+    @raise TypeError: for the values of other types
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        if TYPE_KEY not in value and all(isinstance(key, str) for key in value):
+            return {key: encode_value(item) for key, item in value.items()}
+        items = [[encode_value(key), encode_value(item)] for key, item in value.items()]
+        return {TYPE_KEY: "dict", "value": items}
+    if isinstance(value, tuple):
+        return {TYPE_KEY: "tuple", "value": [encode_value(item) for item in value]}
+    if isinstance(value, (set, frozenset)):
+        return {TYPE_KEY: "set", "value": [encode_value(item) for item in value]}
+    # datetime is a subclass of date
+    for type_ in (datetime, date, time):
+        if isinstance(value, type_):
+            return {TYPE_KEY: type_.__name__, "value": value.isoformat()}
+    if isinstance(value, DateTime):
+        # the string keeps the microseconds, unlike ISO8601()
+        return {TYPE_KEY: "DateTime", "value": str(value)}
+    if isinstance(value, bytes):
+        return {TYPE_KEY: "bytes", "value": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, Decimal):
+        return {TYPE_KEY: "Decimal", "value": str(value)}
+    raise TypeError(f"Unsupported value in the form data: {type(value).__name__}")
+
+
+def decode_value(obj):
+    """The object_hook of json.loads for the values encoded by encode_value"""
+    if TYPE_KEY in obj:
+        return VALUE_DECODERS[obj[TYPE_KEY]](obj["value"])
+    return obj
+
+
+def dump_values(values):
+    """The JSON of the values of a record (see encode_value)"""
+    return json.dumps([encode_value(value) for value in values])
+
+
+def load_values(data):
+    """The values of a record dumped by dump_values"""
+    return tuple(json.loads(data, object_hook=decode_value))
+
+
+class FormDataRecord:
+    """A submission stored outside the soups, with the same attrs of the
+    soup records
+    """
+
+    def __init__(self, intid, attrs):
+        self.intid = intid
+        self.attrs = attrs
+
+
+class BaseFormDataStore:
+    """The parts of the IFormDataStore adapters that don't depend on the
+    storage: the submitted form and the compact encoding of the records.
+
+    Subclasses implement get_record_schema.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        self._schemas = {}
+
+    @property
+    def submission(self):
+        return get_submission_context(self.context, self.request)
+
+    @property
+    def block_id(self):
+        data = self.submission.data
+        if not data:
+            data = self.request.form
+        return data.get("block_id", "")
+
+    def get_block(self):
+        return self.submission.form_block(self.block_id)
+
+    def get_schema(self):
+        return self.submission.schema(self.get_block())
+
+    def get_form_fields(self):
+        # with the 'custom_field_id' field, as this isn't stored with each subblock
+        return self.get_schema().form_fields()
+
+    def get_submitted_fields(self, data):
+        """The schema ((field_id, label) tuples) and the values of the
+        submitted fields that are in the form, or None if the form block
+        doesn't exist.
+        """
+        labels = self.get_schema().labels
+        if not labels:
+            logger.error(
+                'Block with id {} and type "form" not found in context: {}.'.format(
+                    self.block_id, self.context.absolute_url()
+                )
+            )
+            return None
+        schema = []
+        values = []
+        for field_data in data:
+            field_id = field_data.field_id
+            # TODO: not nice using the protected member to access the real internal value, but easiest way.
+            value = field_data.internal_value
+            if field_id in labels:
+                schema.append((field_id, labels[field_id]))
+                values.append(value)
+        return tuple(schema), tuple(values)
+
+    def get_record_schema(self, block_id, version):
+        """The (field_id, label) tuples of a schema version"""
+        raise NotImplementedError
+
+    def stored_fields(self, block_id=None):
+        """The union of the (field_id, label) of the schemas of the stored
+        records, from the newest schema. Records stored before the schemas
+        (see compact_records) may have other fields.
+        """
+        raise NotImplementedError
+
+    def record_fields(self, record, order=()):
+        """The (field_id, label, value) of the form fields stored in a
+        record, in the submission order.
+
+        @param order: field ids to list first for old records that don't
+            keep the submission order
+        """
+        attrs = record.attrs
+        version = attrs.get(SCHEMA_ATTR)
+        if version is not None:
+            schema = self.get_record_schema(attrs.get("block_id", ""), version)
+            return [
+                (field_id, label, value)
+                for (field_id, label), value in zip(schema, attrs[VALUES_ATTR])
+            ]
+        # records stored before the compact encoding
+        labels = attrs.get("fields_labels", {})
+        field_ids = attrs.get("fields_order") or [
+            field_id for field_id in order if field_id in attrs
+        ] + [
+            field_id
+            for field_id in attrs.keys()
+            if field_id not in order
+            and field_id not in RECORD_ATTRS
+            and field_id not in LEGACY_ATTRS
+        ]
+        return [
+            (field_id, labels.get(field_id, field_id), attrs.get(field_id))
+            for field_id in field_ids
+        ]
@@ -1,127 +1,856 @@
+from BTrees.IIBTree import IITreeSet
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from collective.volto.formsupport import logger
+from collective.volto.formsupport.datamanager.base import BaseFormDataStore
+from collective.volto.formsupport.datamanager.base import merge_schemas
+from collective.volto.formsupport.datamanager.base import RECORD_ATTRS
+from collective.volto.formsupport.datamanager.base import SCHEMA_ATTR
+from collective.volto.formsupport.datamanager.base import VALUES_ATTR
 from collective.volto.formsupport.interfaces import IFormDataStore
-from collective.volto.formsupport.utils import get_blocks
-from copy import deepcopy
 from datetime import datetime
+from functools import partial
+from itertools import islice
+from persistent.list import PersistentList
+from persistent.mapping import PersistentMapping
 from plone.dexterity.interfaces import IDexterityContent
-from plone.restapi.deserializer import json_body
 from repoze.catalog.catalog import Catalog
 from repoze.catalog.indexes.field import CatalogFieldIndex
+from repoze.catalog.query import And
+from repoze.catalog.query import Eq
+from repoze.catalog.query import Ge
+from repoze.catalog.query import InRange
+from repoze.catalog.query import Lt
 from souper.interfaces import ICatalogFactory
-from souper.soup import get_soup
+from souper.plone.locator import SOUPKEY
 from souper.soup import NodeAttributeIndexer
 from souper.soup import Record
+from souper.soup import Soup
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
+from zope.component import getUtility
 from zope.interface import implementer
 from zope.interface import Interface
+from ZTUtils.Lazy import LazyMap
+
+import heapq
+import os
+import transaction
+
+
+SOUP_NAME = "form_data"
+COUNTERS_KEY = "collective.volto.formsupport.form_data_counters"
+# ids of the blocks with their own soup, for contents with a soup per block
+BLOCKS_KEY = "collective.volto.formsupport.form_data_blocks"
+SOUP_PER_BLOCK_ENV = "FORM_DATA_SOUP_PER_BLOCK"
+# keys of the time partitions of each block, for contents with partitions
+PARTITIONS_KEY = "collective.volto.formsupport.form_data_partitions"
+PARTITION_MONTHS_KEY = "collective.volto.formsupport.form_data_partition_months"
+PARTITION_MONTHS_ENV = "FORM_DATA_PARTITION_MONTHS"
+# ids of the appended records waiting to be indexed, for each soup
+PENDING_KEY = "collective.volto.formsupport.form_data_pending"
+DEFERRED_INDEXING_ENV = "FORM_DATA_DEFERRED_INDEXING"
+# ordered field ids and labels of the stored records, interned for each block
+SCHEMAS_KEY = "collective.volto.formsupport.form_data_schemas"
+# slot of each soup (soup name -> slot), for contents with a soup per block:
+# the ids of a soup are those equal to its slot modulo SLOT_COUNT
+SLOTS_KEY = "collective.volto.formsupport.form_data_slots"
+SLOT_COUNT = 1024
+# ids used by soups without a slot (kept by split_soup, or after all the slots
+# are assigned), that the soups with a slot can't use
+RESERVED_IDS_KEY = "collective.volto.formsupport.form_data_reserved_ids"
+
+
+def soup_per_block_enabled():
+    return os.environ.get(SOUP_PER_BLOCK_ENV, "0") not in ("", "0", "false", "False")
+
+
+def get_partition_months():
+    try:
+        return max(int(os.environ.get(PARTITION_MONTHS_ENV) or 0), 0)
+    except ValueError:
+        logger.warning(f"Invalid {PARTITION_MONTHS_ENV} value, partitions disabled")
+        return 0
+
+
+def get_partition_key(date, months):
+    """The key (first month, as YYYY-MM) of the partition with the date"""
+    index = (date.year * 12 + date.month - 1) // months * months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def get_partition_range(key, months):
+    """The first date of the partition and the first date after it"""
+    year, month = (int(part) for part in key.split("-"))
+    index = year * 12 + month - 1 + months
+    return datetime(year, month, 1), datetime(index // 12, index % 12 + 1, 1)
+
+
+def deferred_indexing_enabled():
+    return os.environ.get(DEFERRED_INDEXING_ENV, "0") not in ("", "0", "false", "False")
 
 
 @implementer(ICatalogFactory)
 class FormDataSoupCatalogFactory:
     def __call__(self, context):
-        #  do not set any index here..maybe on each form
+        #  do not set any index here..maybe on each form
         catalog = Catalog()
         block_id_indexer = NodeAttributeIndexer("block_id")
         catalog["block_id"] = CatalogFieldIndex(block_id_indexer)
+        date_indexer = NodeAttributeIndexer("date")
+        catalog["date"] = CatalogFieldIndex(date_indexer)
         return catalog
 
 
+class FormDataSoup(Soup):
+    """A soup with the form_data catalog, whatever its name.
+
+    The record ids are unique between the soups of the same content, so
+    that records can be found by id: a soup with a ``slot`` only uses the ids
+    of its slot, the others check the ids of their ``siblings``.
+
+    Records added with ``append`` are not indexed right away: their ids are
+    kept in a ``pending`` TreeSet until ``merge_pending`` indexes them.
+    """
+
+    def __init__(
+        self,
+        soup_name,
+        context,
+        siblings=(),
+        block_id=None,
+        partition=None,
+        slot=None,
+    ):
+        super().__init__(soup_name, context)
+        self.siblings = siblings
+        # the block of the records and the date range of the partition, if any
+        self.block_id = block_id
+        self.partition = partition
+        self.slot = slot
+
+    @property
+    def catalog(self):
+        storage = self.storage
+        if not storage.catalog:
+            storage.catalog = getUtility(ICatalogFactory, name=SOUP_NAME)(self.context)
+        return storage.catalog
+
+    def rebuild(self):
+        self.storage.catalog = getUtility(ICatalogFactory, name=SOUP_NAME)(self.context)
+        self.reindex()
+
+    def _generateid(self):
+        # a random id for each record (souper uses consecutive ids after the
+        # first one): concurrent submissions write in different buckets
+        reserved = IAnnotations(self.context).get(RESERVED_IDS_KEY)
+        while True:
+            if self.slot is None:
+                intid = self._randrange(0, 2**31)
+            else:
+                intid = self._randrange(0, 2**31 // SLOT_COUNT) * SLOT_COUNT
+                intid += self.slot
+            if intid in self.data:
+                continue
+            if self.slot is not None:
+                # no other soup uses the ids of the slot
+                if reserved is None or intid not in reserved:
+                    return intid
+            elif not any(intid in sibling.data for sibling in self.siblings):
+                if reserved is not None:
+                    reserved.insert(intid)
+                return intid
+
+    @property
+    def pending(self):
+        """The ids of the records waiting to be indexed, or None"""
+        return IAnnotations(self.context).get(f"{PENDING_KEY}:{self.soup_name}")
+
+    def append(self, record):
+        """Add a record deferring its indexing to merge_pending.
+
+        All the objects changed here resolve the conflicts between
+        concurrent appends: the data and pending BTrees (random keys) and the
+        Length of the soup.
+        """
+        pending = self.pending
+        if pending is None:
+            key = f"{PENDING_KEY}:{self.soup_name}"
+            pending = IAnnotations(self.context)[key] = IITreeSet()
+        record.intid = self._generateid()
+        self.data[record.intid] = record
+        self.storage.length.change(1)
+        pending.insert(record.intid)
+        return record.intid
+
+    def merge_pending(self):
+        """Index the appended records
+
+        @return: the number of indexed records
+        """
+        pending = self.pending
+        if not pending:
+            return 0
+        catalog = self.catalog
+        merged = 0
+        for intid in list(pending):
+            record = self.data.get(intid)
+            if record is not None:
+                catalog.index_doc(intid, record)
+                merged += 1
+            # not clear(): appends committed meanwhile don't conflict
+            pending.remove(intid)
+        return merged
+
+    def __delitem__(self, record):
+        super().__delitem__(record)
+        pending = self.pending
+        if pending and record.intid in pending:
+            pending.remove(record.intid)
+
+    def clear(self):
+        super().clear()
+        IAnnotations(self.context).pop(f"{PENDING_KEY}:{self.soup_name}", None)
+
+    def drop(self):
+        """Remove the soup storage, with all its records"""
+        annotations = IAnnotations(self.context)
+        annotations.pop(SOUPKEY % self.soup_name, None)
+        annotations.pop(f"{PENDING_KEY}:{self.soup_name}", None)
+
+
+class MergedResults:
+    """The records of several soups, merged in the sort order while they are
+    read: only one record of each soup is loaded at a time.
+
+    Items are read going forward from the last one accessed, so a batch
+    reads its records once.
+    """
+
+    def __init__(self, searches, sort_on, reverse, offset, limit):
+        # (soup, function returning the number and the sorted ids of its
+        # matching records)
+        self.searches = searches
+        self.sort_on = sort_on
+        self.reverse = reverse
+        self.offset = offset
+        self.limit = limit
+        # the errors of the queries are raised by search
+        results = [search() for soup, search in searches]
+        self._size = sum(size for size, docids in results)
+        self._docids = [docids for size, docids in results]
+        self._cursor = None
+
+    def _get_docids(self):
+        docids, self._docids = self._docids, None
+        return docids or [search()[1] for soup, search in self.searches]
+
+    def __iter__(self):
+        sort_on = self.sort_on
+        records = heapq.merge(
+            *(
+                map(soup.data.__getitem__, docids)
+                for (soup, search), docids in zip(self.searches, self._get_docids())
+            ),
+            key=lambda record: record.attrs.get(sort_on),
+            reverse=self.reverse,
+        )
+        return islice(records, self.offset, self.limit)
+
+    def __len__(self):
+        # from the sizes of the soup results, without reading the ids
+        total = self._size
+        if self.limit is not None:
+            total = min(total, self.limit)
+        return max(total - self.offset, 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(islice(self, index.start, index.stop, index.step))
+        if index < 0:
+            index += len(self)
+        position, records = self._cursor or (0, None)
+        if records is None or index < position:
+            position, records = 0, iter(self)
+        for record in islice(records, index - position, None):
+            self._cursor = (index + 1, records)
+            return record
+        self._cursor = None
+        raise IndexError(index)
+
+
 @implementer(IFormDataStore)
 @adapter(IDexterityContent, Interface)
-class FormDataStore:
-    def __init__(self, context, request):
-        self.context = context
-        self.request = request
-
+class FormDataStore(BaseFormDataStore):
     @property
     def soup(self):
-        return get_soup("form_data", self.context)
+        """The soup where the records of the current block are stored"""
+        return self.get_soup(self.block_id)
+
+    def get_soup(self, block_id, date=None):
+        """The soup where the records of the block submitted at date (default
+        now) are stored
+        """
+        if self.blocks is None:
+            return FormDataSoup(SOUP_NAME, self.context)
+        name = self._get_soup_name(block_id, date)
+        slot = (self.slots or {}).get(name)
+        if slot is not None:
+            return FormDataSoup(name, self.context, (), block_id, slot=slot)
+        siblings = [
+            FormDataSoup(other, self.context)
+            for other, *info in self._get_layout()
+            if other != name
+        ]
+        return FormDataSoup(name, self.context, siblings, block_id)
+
+    def _get_soup_name(self, block_id, date=None):
+        if self.partitions is None:
+            return f"{SOUP_NAME}:{block_id}"
+        key = get_partition_key(date or datetime.now(), self.partition_months)
+        return f"{SOUP_NAME}:{block_id}:{key}"
+
+    def get_target_soup(self, block_id, date=None):
+        """As get_soup, adding the block and the partition to the layout"""
+        blocks = self.blocks
+        if blocks is not None and block_id not in blocks:
+            blocks.add(block_id)
+        partitions = self.partitions
+        if partitions is not None:
+            keys = partitions.get(block_id)
+            if keys is None:
+                keys = partitions[block_id] = OOTreeSet()
+            key = get_partition_key(date or datetime.now(), self.partition_months)
+            if key not in keys:
+                keys.add(key)
+        slots = self.slots
+        if slots is not None:
+            name = self._get_soup_name(block_id, date)
+            # slots are never reused, a dropped partition keeps its own
+            if name not in slots and len(slots) < SLOT_COUNT:
+                slots[name] = len(slots)
+        return self.get_soup(block_id, date)
+
+    def get_soups(self, block_id=None, date_from=None, date_to=None):
+        """The soups with the records of the block, or of all the blocks.
+
+        With time partitions, only the partitions with records in the date
+        range are returned.
+        """
+        return [
+            FormDataSoup(name, self.context, (), *info)
+            for name, *info in self._get_layout(block_id, date_from, date_to)
+        ]
+
+    def _get_layout(self, block_id=None, date_from=None, date_to=None):
+        """(soup name, block_id, partition range) of the soups"""
+        blocks = self.blocks
+        if blocks is None:
+            return [(SOUP_NAME, None, None)]
+        if block_id:
+            block_ids = [block_id] if block_id in blocks else []
+        else:
+            block_ids = list(blocks)
+        partitions = self.partitions
+        if partitions is None:
+            return [
+                (f"{SOUP_NAME}:{block_id}", block_id, None) for block_id in block_ids
+            ]
+        months = self.partition_months
+        layout = []
+        for block_id in block_ids:
+            for key in partitions.get(block_id, ()):
+                start, end = get_partition_range(key, months)
+                if (date_from and end <= date_from) or (date_to and start >= date_to):
+                    continue
+                layout.append((f"{SOUP_NAME}:{block_id}:{key}", block_id, (start, end)))
+        return layout
 
     @property
-    def block_id(self):
-        data = json_body(self.request)
-        if not data:
-            data = self.request.form
-        return data.get("block_id", "")
-
-    def get_block(self):
-        blocks = get_blocks(self.context)
-
-        if not blocks:
-            return {}
-        form_block = {}
-        for id, block in blocks.items():
-            if id != self.block_id:
-                continue
-            block_type = block.get("@type", "")
-            if block_type == "form":
-                form_block = deepcopy(block)
-        if not form_block:
-            return {}
+    def blocks(self):
+        """The ids of the blocks that have their own soups, or None if all
+        the records are in the same soup.
+        """
+        return IAnnotations(self.context).get(BLOCKS_KEY)
 
-        return form_block
+    @property
+    def partitions(self):
+        """The keys of the time partitions of each block (block_id ->
+        OOTreeSet), or None if the blocks aren't partitioned.
+        """
+        return IAnnotations(self.context).get(PARTITIONS_KEY)
 
-    def get_form_fields(self):
-        form_block = self.get_block()
+    @property
+    def slots(self):
+        """The slots of the soups (see SLOTS_KEY), or None for the contents
+        whose soups were created without them.
 
-        subblocks = form_block.get("subblocks", [])
+        A PersistentMapping: concurrent transactions assigning slots conflict
+        instead of assigning the same one.
+        """
+        return IAnnotations(self.context).get(SLOTS_KEY)
 
-        # Add the 'custom_field_id' field back in as this isn't stored with each subblock
-        for index, field in enumerate(subblocks):
-            if form_block.get(field["field_id"]):
-                subblocks[index]["custom_field_id"] = form_block.get(field["field_id"])
+    @property
+    def partition_months(self):
+        return IAnnotations(self.context).get(PARTITION_MONTHS_KEY)
 
-        return subblocks
+    def _use_soup_per_block(self):
+        annotations = IAnnotations(self.context)
+        if BLOCKS_KEY in annotations:
+            return True
+        months = get_partition_months()
+        if not soup_per_block_enabled() and not months:
+            return False
+        shared = annotations.get(SOUPKEY % SOUP_NAME)
+        if shared is not None and len(shared):
+            # existing records must be moved first (see split_soup)
+            return False
+        annotations[BLOCKS_KEY] = OOTreeSet()
+        annotations[SLOTS_KEY] = PersistentMapping()
+        if months:
+            annotations[PARTITIONS_KEY] = OOBTree()
+            annotations[PARTITION_MONTHS_KEY] = months
+        return True
 
-    def add(self, data):
-        form_fields = self.get_form_fields()
-        if not form_fields:
-            logger.error(
-                'Block with id {} and type "form" not found in context: {}.'.format(
-                    self.block_id, self.context.absolute_url()
-                )
+    def split_soup(self):
+        """Move the records of the shared soup in a soup for each block, or
+        in time partitions with FORM_DATA_PARTITION_MONTHS, keeping their ids.
+
+        @return: the number of moved records
+        """
+        annotations = IAnnotations(self.context)
+        months = get_partition_months()
+        if PARTITIONS_KEY in annotations or (BLOCKS_KEY in annotations and not months):
+            return 0
+        records = []
+        for soup in self.get_soups():
+            records.extend(soup.data.values())
+            soup.drop()
+        annotations.pop(COUNTERS_KEY, None)
+        annotations[BLOCKS_KEY] = OOTreeSet()
+        annotations[SLOTS_KEY] = PersistentMapping()
+        # the kept ids aren't in the slots of their soups
+        annotations[RESERVED_IDS_KEY] = IITreeSet(record.intid for record in records)
+        if months:
+            annotations[PARTITIONS_KEY] = OOBTree()
+            annotations[PARTITION_MONTHS_KEY] = months
+        for record in records:
+            soup = self.get_target_soup(
+                record.attrs.get("block_id", ""), record.attrs.get("date")
             )
+            soup.data[record.intid] = record
+            soup.storage.length.change(1)
+            soup.catalog.index_doc(record.intid, record)
+        return len(records)
+
+    def add(self, data):
+        fields = self.get_submitted_fields(data)
+        if fields is None:
             return None
-        fields = {}
-        for field in form_fields:
-            custom_field_id = field.get("custom_field_id")
-            field_id = custom_field_id if custom_field_id else field["field_id"]
-            fields[field_id] = field.get("label", field_id)
+        schema, values = fields
 
         record = Record()
-        fields_labels = {}
-        fields_order = []
-        for field_data in data:
-            field_id = field_data.field_id
-            # TODO: not nice using the protected member to access the real internal value, but easiest way.
-            value = field_data.internal_value
-            if field_id in fields:
-                record.attrs[field_id] = value
-                fields_labels[field_id] = fields[field_id]
-                fields_order.append(field_id)
-        record.attrs["fields_labels"] = fields_labels
-        record.attrs["fields_order"] = fields_order
+        record.attrs[SCHEMA_ATTR] = self._intern_schema(self.block_id, schema)
+        record.attrs[VALUES_ATTR] = values
         record.attrs["date"] = datetime.now()
-        if self.get_block().get('sendAdditionalInfo'):
+        if self.get_block().get("sendAdditionalInfo"):
             record.attrs["url"] = self.context.absolute_url_path()
         record.attrs["block_id"] = self.block_id
-        return self.soup.add(record)
+        if not self._use_soup_per_block():
+            self._change_counter(self.block_id, 1)
+        soup = self.get_target_soup(self.block_id, record.attrs["date"])
+        if deferred_indexing_enabled():
+            return soup.append(record)
+        return soup.add(record)
+
+    @property
+    def schemas(self):
+        """The schemas of the stored records (block_id -> list of tuples of
+        (field_id, label)), or None. A record refers to its schema by the
+        position in the list of its block.
+        """
+        return IAnnotations(self.context).get(SCHEMAS_KEY)
+
+    def _intern_schema(self, block_id, schema):
+        """Return the version of the schema, adding it if it's new"""
+        annotations = IAnnotations(self.context)
+        schemas = annotations.get(SCHEMAS_KEY)
+        if schemas is None:
+            schemas = annotations[SCHEMAS_KEY] = OOBTree()
+        versions = schemas.get(block_id)
+        if versions is None:
+            versions = schemas[block_id] = PersistentList()
+        try:
+            return versions.index(schema)
+        except ValueError:
+            versions.append(schema)
+            return len(versions) - 1
+
+    def get_record_schema(self, block_id, version):
+        """The (field_id, label) tuples of a schema version"""
+        key = (block_id, version)
+        if key not in self._schemas:
+            self._schemas[key] = self.schemas[block_id][version]
+        return self._schemas[key]
+
+    def stored_fields(self, block_id=None):
+        schemas = self.schemas or {}
+        block_ids = [block_id] if block_id else list(schemas.keys())
+        return merge_schemas(
+            schema
+            for block_id in block_ids
+            for schema in reversed(schemas.get(block_id, ()))
+        )
 
-    def length(self):
-        return len([x for x in self.soup.data.values()])
+    def compact_records(self, batch_size=None):
+        """Convert the records stored with their own labels to the compact
+        encoding, keeping their ids.
 
-    def search(self, query=None):
-        if not query:
-            records = sorted(
-                self.soup.data.values(),
-                key=lambda k: k.attrs.get("date", ""),
-                reverse=True,
+        @param batch_size: commit the transaction every batch_size converted
+            records, so that large soups aren't converted in one transaction
+        @return: the number of converted records
+        """
+        compacted = 0
+        for soup in self.get_soups():
+            for record in soup.data.values():
+                attrs = record.attrs
+                if SCHEMA_ATTR in attrs:
+                    continue
+                fields = self.record_fields(record)
+                schema = tuple((field_id, label) for field_id, label, value in fields)
+                for key in list(attrs.keys()):
+                    if key not in RECORD_ATTRS:
+                        del attrs[key]
+                attrs[SCHEMA_ATTR] = self._intern_schema(
+                    attrs.get("block_id", ""), schema
+                )
+                attrs[VALUES_ATTR] = tuple(value for field_id, label, value in fields)
+                compacted += 1
+                if batch_size and not compacted % batch_size:
+                    transaction.commit()
+        return compacted
+
+    def merge_pending(self):
+        """Index the records appended with FORM_DATA_DEFERRED_INDEXING
+
+        @return: the number of indexed records
+        """
+        return sum(soup.merge_pending() for soup in self.get_soups())
+
+    @property
+    def counters(self):
+        """The number of records of each block (block_id -> BTrees.Length),
+        kept on add and delete. Length resolves the conflicts between
+        concurrent submissions.
+
+        Not used with a soup per block, that has its own Length.
+        """
+        return IAnnotations(self.context).get(COUNTERS_KEY)
+
+    def _change_counter(self, block_id, delta):
+        annotations = IAnnotations(self.context)
+        counters = annotations.get(COUNTERS_KEY)
+        if counters is None:
+            counters = annotations[COUNTERS_KEY] = OOBTree()
+        counter = counters.get(block_id)
+        if counter is None:
+            # records stored before the counters were added
+            counter = counters[block_id] = Length(self.count(block_id=block_id))
+        counter.change(delta)
+
+    def length(self, block_id=None):
+        """The number of records, without loading them"""
+        if block_id is None or self.blocks is not None:
+            return sum(soup.storage.length() for soup in self.get_soups(block_id))
+        counter = (self.counters or {}).get(block_id)
+        if counter is None:
+            return self.count(block_id=block_id)
+        return counter()
+
+    def count(self, block_id=None, date_from=None, date_to=None):
+        """The number of records matching the criteria, from the indexes"""
+        if not (block_id or date_from or date_to):
+            return self.length()
+        return sum(
+            self._count(soup, block_id, date_from, date_to)
+            for soup in self.get_soups(block_id, date_from, date_to)
+        )
+
+    def _count(self, soup, block_id, date_from, date_to):
+        if self._in_range(soup, date_from, date_to):
+            return soup.storage.length()
+        catalog = soup.catalog
+        if "date" not in catalog:
+            return len(
+                self._search_unindexed(
+                    soup, None, block_id, date_from, date_to, "date", True, None
+                )
             )
-        return records
+        size, docids = catalog.query(self._get_query(block_id, date_from, date_to))
+        return int(size) + len(
+            self._pending_records(soup, block_id, date_from, date_to)
+        )
+
+    def search(
+        self,
+        query=None,
+        block_id=None,
+        date_from=None,
+        date_to=None,
+        sort_on="date",
+        reverse=True,
+        limit=None,
+        offset=0,
+        lazy=False,
+    ):
+        """Return the records matching the given criteria, resolved through
+        the soup catalog.
+
+        @param query: an additional repoze.catalog query
+        @param block_id: only the records of this form block
+        @param date_from: only the records submitted from this date
+        @param date_to: only the records submitted before this date
+        @param sort_on: the index to sort on (``date`` or ``block_id``)
+        @param reverse: sort in descending order (latest records first)
+        @param limit: max number of records, for batching
+        @param offset: number of records to skip, for batching
+        @param lazy: return a lazy sequence, that loads each record only
+            when it's accessed
+        """
+        if limit is not None:
+            if limit <= 0:
+                return []
+            limit += offset
+        soups = self.get_soups(block_id, date_from, date_to)
+        if len(soups) == 1:
+            soup = soups[0]
+            size, docids = self._search_soup(
+                soup, query, block_id, date_from, date_to, sort_on, reverse, limit
+            )
+            docids = list(islice(docids, offset, limit))
+            if lazy:
+                return LazyMap(soup.data.__getitem__, docids)
+            return [soup.data[docid] for docid in docids]
+        # merge the sorted records of each soup
+        records = MergedResults(
+            [
+                (
+                    soup,
+                    partial(
+                        self._search_soup,
+                        soup,
+                        query,
+                        block_id,
+                        date_from,
+                        date_to,
+                        sort_on,
+                        reverse,
+                        limit,
+                    ),
+                )
+                for soup in soups
+            ],
+            sort_on,
+            reverse,
+            offset,
+            limit,
+        )
+        if lazy:
+            return records
+        return list(records)
+
+    def _search_soup(
+        self, soup, query, block_id, date_from, date_to, sort_on, reverse, limit
+    ):
+        """The number of the matching records of a soup (at least up to limit)
+        and their sorted ids, up to limit
+        """
+        catalog = soup.catalog
+        if "date" not in catalog:
+            # soup created before the date index was added (see upgrade 1303)
+            records = self._search_unindexed(
+                soup, query, block_id, date_from, date_to, sort_on, reverse, limit
+            )
+            return len(records), [record.intid for record in records]
+        if sort_on not in catalog:
+            raise ValueError(f"Unknown sort index: {sort_on}")
+        pending = self._pending_records(soup, block_id, date_from, date_to)
+        query = self._get_query(block_id, date_from, date_to, query)
+        if query is not None:
+            size, docids = catalog.query(
+                query, sort_index=sort_on, reverse=reverse, limit=limit
+            )
+            size += len(pending)
+        elif soup.data:
+            # all the records (the pending ones too): just sort the keys of
+            # the soup
+            size = soup.storage.length()
+            docids = catalog[sort_on].sort(soup.data, reverse=reverse, limit=limit)
+        else:
+            return 0, []
+        if not pending:
+            return size, docids
+
+        # merge the records that are not indexed yet
+        def sort_key(docid):
+            return soup.data[docid].attrs.get(sort_on)
+
+        pending = sorted(
+            (record.intid for record in pending), key=sort_key, reverse=reverse
+        )
+        return size, islice(
+            heapq.merge(docids, pending, key=sort_key, reverse=reverse), limit
+        )
+
+    @staticmethod
+    def _in_range(soup, date_from, date_to):
+        """True if all the records of a block soup are in the date range"""
+        if soup.block_id is None:
+            return False
+        if soup.partition is None:
+            return not (date_from or date_to)
+        start, end = soup.partition
+        return (not date_from or date_from <= start) and (not date_to or end <= date_to)
+
+    @staticmethod
+    def _pending_records(soup, block_id, date_from, date_to):
+        """The appended records not indexed yet, that match the criteria.
+
+        Additional repoze.catalog queries can't be applied to them.
+        """
+        pending = soup.pending
+        if not pending:
+            return []
+        records = (soup.data[intid] for intid in pending if intid in soup.data)
+        return [
+            record
+            for record in records
+            if (not block_id or record.attrs.get("block_id") == block_id)
+            and (not date_from or record.attrs.get("date", date_from) >= date_from)
+            and (not date_to or record.attrs.get("date", date_to) < date_to)
+        ]
+
+    @staticmethod
+    def _get_query(block_id=None, date_from=None, date_to=None, query=None):
+        criteria = []
+        if block_id:
+            criteria.append(Eq("block_id", block_id))
+        if date_from and date_to:
+            criteria.append(InRange("date", date_from, date_to, end_exclusive=True))
+        elif date_from:
+            criteria.append(Ge("date", date_from))
+        elif date_to:
+            criteria.append(Lt("date", date_to))
+        if query is not None:
+            criteria.append(query)
+        if not criteria:
+            return None
+        return criteria[0] if len(criteria) == 1 else And(*criteria)
+
+    @staticmethod
+    def _search_unindexed(
+        soup, query, block_id, date_from, date_to, sort_on, reverse, limit
+    ):
+        if query is not None:
+            raise ValueError("The soup catalog needs to be rebuilt to run queries")
+        records = soup.data.values()
+        if block_id:
+            records = [r for r in records if r.attrs.get("block_id") == block_id]
+        if date_from or date_to:
+            records = [r for r in records if "date" in r.attrs]
+        if date_from:
+            records = [r for r in records if r.attrs["date"] >= date_from]
+        if date_to:
+            records = [r for r in records if r.attrs["date"] < date_to]
+        records = sorted(
+            records, key=lambda k: k.attrs.get(sort_on, ""), reverse=reverse
+        )
+        return records[:limit]
+
+    def _find_soup(self, id):
+        for soup in self.get_soups():
+            if id in soup.data:
+                return soup
+        raise KeyError(id)
 
     def delete(self, id):
-        record = self.soup.get(id)
-        del self.soup[record]
+        soup = self._find_soup(id)
+        record = soup.get(id)
+        if self.blocks is None:
+            self._change_counter(record.attrs.get("block_id", ""), -1)
+        del soup[record]
+
+    def delete_many(self, ids):
+        """Delete the records with the given ids in one pass: the counters
+        are updated from the block_id index, without loading the records.
+
+        @return: the number of deleted records
+        """
+        ids = list(ids)
+        return sum(self._delete_many(soup, ids) for soup in self.get_soups())
+
+    def _delete_many(self, soup, ids):
+        # the counters are updated from the indexes
+        soup.merge_pending()
+        catalog = soup.catalog
+        IF = catalog.family.IF
+        ids = IF.Set([docid for docid in ids if docid in soup.data])
+        if not ids:
+            return 0
+        if self.blocks is None:
+            for block_id, counter in (self.counters or {}).items():
+                size, block_ids = catalog.query(Eq("block_id", block_id))
+                deleted = len(IF.intersection(ids, block_ids))
+                if deleted:
+                    counter.change(-deleted)
+        for docid in ids:
+            del soup.data[docid]
+            catalog.unindex_doc(docid)
+        soup.storage.length.change(-len(ids))
+        return len(ids)
+
+    def delete_query(self, block_id=None, date_from=None, date_to=None):
+        """Delete the records matching the criteria (see search)
+
+        @return: the number of deleted records
+        """
+        if not (block_id or date_from or date_to):
+            deleted = self.length()
+            self.clear()
+            return deleted
+        deleted = 0
+        for soup in self.get_soups(block_id, date_from, date_to):
+            if self._in_range(soup, date_from, date_to):
+                # the whole soup of the block, or the whole partition
+                deleted += soup.storage.length()
+                self._drop_soup(soup)
+                continue
+            soup.merge_pending()
+            if "date" not in soup.catalog:
+                records = self._search_unindexed(
+                    soup, None, block_id, date_from, date_to, "date", True, None
+                )
+                ids = [record.intid for record in records]
+            else:
+                size, ids = soup.catalog.query(
+                    self._get_query(block_id, date_from, date_to)
+                )
+            deleted += self._delete_many(soup, ids)
+        return deleted
+
+    def _drop_soup(self, soup):
+        if soup.partition is None:
+            soup.clear()
+            return
+        soup.drop()
+        key = soup.soup_name.rsplit(":", 1)[-1]
+        self.partitions[soup.block_id].remove(key)
 
     def clear(self):
-        self.soup.clear()
+        for soup in self.get_soups():
+            self._drop_soup(soup)
+        annotations = IAnnotations(self.context)
+        annotations.pop(COUNTERS_KEY, None)
+        annotations.pop(SCHEMAS_KEY, None)
+        annotations.pop(RESERVED_IDS_KEY, None)
@@ -0,0 +1,683 @@
+"""
+IFormDataStore that appends the submissions to JSONL files, outside the
+ZODB, enabled with FORM_DATA_SPOOL_DIRECTORY::
+
+    <directory>/<content uid>/block-<block id>.jsonl    a record for each line
+    <directory>/<content uid>/block-<block id>.idx      offset, timestamp and id
+                                                        of each line
+    <directory>/<content uid>/block-<block id>.deleted  ids of the deleted lines
+    <directory>/<content uid>/block-<block id>.schemas  the (field_id, label) lists,
+                                                        referred to by the lines
+                                                        with their position
+    <directory>/<content uid>/block-<block id>.count    the number of lines not
+                                                        deleted
+
+The changes are written when the Zope transaction is voted, so that a write
+error aborts it. Readers memory-map the files and only parse the lines they
+return.
+"""
+
+from collective.volto.formsupport import logger
+from collective.volto.formsupport.datamanager.base import BaseFormDataStore
+from collective.volto.formsupport.datamanager.base import decode_value
+from collective.volto.formsupport.datamanager.base import encode_value
+from collective.volto.formsupport.datamanager.base import FormDataRecord
+from collective.volto.formsupport.datamanager.base import merge_schemas
+from collective.volto.formsupport.datamanager.base import SCHEMA_ATTR
+from collective.volto.formsupport.datamanager.base import VALUES_ATTR
+from collective.volto.formsupport.interfaces import IFormDataStore
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from plone.dexterity.interfaces import IDexterityContent
+from plone.uuid.interfaces import IUUID
+from transaction.interfaces import IDataManager
+from urllib.parse import quote
+from urllib.parse import unquote
+from zope.component import adapter
+from zope.interface import implementer
+from zope.interface import Interface
+from ZTUtils.Lazy import LazyMap
+
+import fcntl
+import heapq
+import json
+import mmap
+import os
+import random
+import shutil
+import struct
+import threading
+import transaction
+
+
+SPOOL_DIRECTORY_ENV = "FORM_DATA_SPOOL_DIRECTORY"
+# offset of the line, timestamp of the submission, record id
+INDEX = struct.Struct("<QdQ")
+DELETED = struct.Struct("<Q")
+# sizes of the index and deleted files when the count was written, count
+COUNT = struct.Struct("<QQQ")
+PREFIX = "block-"
+
+
+def get_spool_directory():
+    return os.environ.get(SPOOL_DIRECTORY_ENV) or None
+
+
+def map_file(path):
+    """A read only memory map of the file, or an empty bytes if it is empty"""
+    try:
+        with open(path, "rb") as fd:
+            if not os.fstat(fd.fileno()).st_size:
+                return b""
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return b""
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class SpoolFile:
+    """The files of a block: appends are serialized with an exclusive lock
+    (also between processes) and synced with one fsync for the lines
+    committed meanwhile by other threads.
+    """
+
+    def __init__(self, path, block_id):
+        self.path = path
+        self.block_id = block_id
+        self.data_path = f"{path}.jsonl"
+        self.index_path = f"{path}.idx"
+        self.deleted_path = f"{path}.deleted"
+        self.schemas_path = f"{path}.schemas"
+        self.count_path = f"{path}.count"
+        self._thread_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+        # the stat of the schemas file and its schemas read so far
+        self._schemas = (None, [])
+
+    @contextmanager
+    def lock(self, operation=fcntl.LOCK_EX):
+        with open(f"{self.path}.lock", "a") as fd:
+            fcntl.flock(fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def append(self, records):
+        """Append the lines of the records (id, timestamp, entry, schema) and
+        their index entries, and the schemas that aren't known yet. Each line
+        refers to its schema by its position in the schemas file.
+        """
+        with self._thread_lock, self.lock():
+            count = self._count()
+            versions = {
+                schema: version for version, schema in enumerate(self.read_schemas())
+            }
+            new_schemas = []
+            lines = []
+            for intid, timestamp, entry, schema in records:
+                version = versions.get(schema)
+                if version is None:
+                    version = versions[schema] = len(versions)
+                    new_schemas.append(schema)
+                line = json.dumps(dict(entry, schema=version)).encode("utf-8")
+                lines.append((intid, timestamp, line + b"\n"))
+            if new_schemas:
+                with open(self.schemas_path, "ab") as fd:
+                    fd.write(
+                        b"".join(
+                            json.dumps(schema).encode("utf-8") + b"\n"
+                            for schema in new_schemas
+                        )
+                    )
+            with open(self.data_path, "ab") as data, open(
+                self.index_path, "ab"
+            ) as index:
+                offset = data.seek(0, os.SEEK_END)
+                entries = []
+                for intid, timestamp, line in lines:
+                    entries.append(INDEX.pack(offset, timestamp, intid))
+                    offset += len(line)
+                data.write(b"".join(line for intid, timestamp, line in lines))
+                index.write(b"".join(entries))
+                data.flush()
+                index.flush()
+                self._save_count(count + len(lines))
+                self._written += 1
+                ticket = self._written
+                data_fd = os.dup(data.fileno())
+                index_fd = os.dup(index.fileno())
+        try:
+            self._sync(ticket, data_fd, index_fd)
+        finally:
+            os.close(data_fd)
+            os.close(index_fd)
+
+    def read_schemas(self):
+        """The schemas ((field_id, label) tuples) of the lines, oldest first"""
+        try:
+            with open(self.schemas_path, "rb") as fd:
+                return [
+                    tuple((field_id, label) for field_id, label in json.loads(line))
+                    for line in fd
+                ]
+        except FileNotFoundError:
+            return []
+
+    def get_schema(self, version):
+        """The schema of the lines with the given version"""
+        stat, schemas = self._schemas
+        if version >= len(schemas):
+            schemas = self.read_schemas()
+            self._schemas = (stat, schemas)
+        return schemas[version]
+
+    def _check_schemas(self):
+        # the schemas file is appended to, or replaced by remove (also by
+        # another process): then the schemas read so far may be stale
+        try:
+            stat = os.stat(self.schemas_path)
+            stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stat = None
+        if stat != self._schemas[0]:
+            self._schemas = (stat, [])
+
+    def _sync(self, ticket, data_fd, index_fd):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                # synced by another thread after our write
+                return
+            target = self._written
+            os.fsync(data_fd)
+            os.fsync(index_fd)
+            self._synced = target
+
+    def delete(self, ids):
+        """Mark the lines with the given ids as deleted
+
+        @return: the number of deleted lines, without those already deleted
+            by concurrent transactions
+        """
+        with self._thread_lock, self.lock():
+            data, entries, deleted = self._read()
+            existing = {intid for start, timestamp, intid in entries}
+            ids = [
+                intid
+                for intid in dict.fromkeys(ids)
+                if intid in existing and intid not in deleted
+            ]
+            if not ids:
+                return 0
+            with open(self.deleted_path, "ab") as fd:
+                fd.write(b"".join(DELETED.pack(intid) for intid in ids))
+                fd.flush()
+                os.fsync(fd.fileno())
+            self._save_count(len(existing - deleted) - len(ids))
+            return len(ids)
+
+    def remove(self):
+        with self._thread_lock, self.lock():
+            for path in (
+                self.data_path,
+                self.index_path,
+                self.deleted_path,
+                self.schemas_path,
+                self.count_path,
+            ):
+                if os.path.exists(path):
+                    os.unlink(path)
+            self._schemas = (None, [])
+
+    def rewrite(self, keep):
+        """Rewrite the files with the lines of the index entries for which
+        keep(timestamp) is true, dropping the deleted ones. The lines are
+        copied as they are.
+        """
+        with self._thread_lock, self.lock():
+            data, entries, deleted = self._read()
+            with open(f"{self.data_path}.tmp", "wb") as new_data, open(
+                f"{self.index_path}.tmp", "wb"
+            ) as new_index:
+                offset = 0
+                count = 0
+                for start, timestamp, intid in entries:
+                    if intid in deleted or not keep(timestamp):
+                        continue
+                    line = data[start : data.find(b"\n", start) + 1]
+                    new_data.write(line)
+                    new_index.write(INDEX.pack(offset, timestamp, intid))
+                    offset += len(line)
+                    count += 1
+                new_data.flush()
+                os.fsync(new_data.fileno())
+                new_index.flush()
+                os.fsync(new_index.fileno())
+            os.replace(f"{self.data_path}.tmp", self.data_path)
+            os.replace(f"{self.index_path}.tmp", self.index_path)
+            if os.path.exists(self.deleted_path):
+                os.unlink(self.deleted_path)
+            self._save_count(count)
+
+    def _read(self):
+        # the index first: the data file has at least the lines it refers to
+        index = map_file(self.index_path)
+        entries = list(
+            INDEX.iter_unpack(index[: len(index) // INDEX.size * INDEX.size])
+        )
+        deleted = map_file(self.deleted_path)
+        deleted = {intid for (intid,) in DELETED.iter_unpack(deleted)}
+        return map_file(self.data_path), entries, deleted
+
+    def read(self):
+        """A consistent view of the files: the memory map of the data, the
+        index entries (offset, timestamp, id) and the deleted ids
+        """
+        with self.lock(fcntl.LOCK_SH):
+            self._check_schemas()
+            return self._read()
+
+    def _count(self):
+        """The number of lines not deleted, from the count file if it was
+        written for the current index and deleted files
+        """
+        try:
+            with open(self.count_path, "rb") as fd:
+                saved = fd.read()
+        except FileNotFoundError:
+            saved = b""
+        if len(saved) == COUNT.size:
+            index_size, deleted_size, count = COUNT.unpack(saved)
+            if index_size == file_size(self.index_path) and deleted_size == file_size(
+                self.deleted_path
+            ):
+                return count
+        # files written before the count, or a change interrupted by a crash
+        data, entries, deleted = self._read()
+        return len({intid for start, timestamp, intid in entries} - deleted)
+
+    def _save_count(self, count):
+        # not synced: a count that doesn't match the files is computed again
+        with open(self.count_path, "wb") as fd:
+            fd.write(
+                COUNT.pack(
+                    file_size(self.index_path), file_size(self.deleted_path), count
+                )
+            )
+
+    def __len__(self):
+        with self.lock(fcntl.LOCK_SH):
+            return self._count()
+
+
+@implementer(IDataManager)
+class SpoolChanges:
+    """The changes of a transaction, joined to it as a data manager.
+
+    The files are written and synced in tpc_vote, so that an error aborts
+    the transaction. If a later data manager fails, the appended lines are
+    marked as deleted; deleted and rewritten lines can't be restored (see
+    SQLiteDataManager).
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        self.transaction_manager = transaction.manager
+        self.appends = {}  # SpoolFile -> [(id, timestamp, entry, schema)]
+        self.deletes = {}  # SpoolFile -> [id]
+        self.rewrites = {}  # SpoolFile -> [(date_from, date_to)]
+        self.removes = set()
+        self.appended = []  # (SpoolFile, ids) written in tpc_vote
+
+    def abort(self, txn):
+        pass
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        for spool_file in self.removes:
+            spool_file.remove()
+        for spool_file, ranges in self.rewrites.items():
+            spool_file.rewrite(
+                lambda timestamp: not any(
+                    (date_from is None or timestamp >= date_from)
+                    and (date_to is None or timestamp < date_to)
+                    for date_from, date_to in ranges
+                )
+            )
+        for spool_file, ids in self.deletes.items():
+            spool_file.delete(ids)
+        for spool_file, records in self.appends.items():
+            # rolled back even if the write fails halfway
+            self.appended.append((spool_file, [record[0] for record in records]))
+            spool_file.append(records)
+
+    def tpc_finish(self, txn):
+        self.appended = []
+
+    def tpc_abort(self, txn):
+        appended, self.appended = self.appended, []
+        for spool_file, ids in appended:
+            try:
+                spool_file.delete(ids)
+            except Exception:
+                logger.exception("Unable to roll back the form data spool")
+
+    def sortKey(self):
+        # after the ZODB, that is more likely to fail with a conflict
+        return f"~collective.volto.formsupport.spool:{self.spool.directory}"
+
+
+class FormDataSpool:
+    """A spool directory, with the files of each content"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._lock = threading.Lock()
+        # the schemas of the read lines, shared by the stores of the process
+        self._schema_ids = {}
+        self.schemas = {}
+
+    def get_file(self, uid, block_id):
+        path = os.path.join(
+            self.directory, quote(uid, safe=""), PREFIX + quote(block_id, safe="")
+        )
+        with self._lock:
+            spool_file = self._files.get(path)
+            if spool_file is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                spool_file = self._files[path] = SpoolFile(path, block_id)
+            return spool_file
+
+    def get_files(self, uid):
+        try:
+            names = os.listdir(os.path.join(self.directory, quote(uid, safe="")))
+        except FileNotFoundError:
+            return []
+        block_ids = sorted(
+            unquote(name[len(PREFIX) : -len(".idx")])
+            for name in names
+            if name.startswith(PREFIX) and name.endswith(".idx")
+        )
+        return [self.get_file(uid, block_id) for block_id in block_ids]
+
+    def intern_schema(self, schema):
+        """The version of the schema ((field_id, label) tuple) in this process"""
+        version = self._schema_ids.get(schema)
+        if version is None:
+            with self._lock:
+                version = self._schema_ids.setdefault(schema, len(self._schema_ids))
+                self.schemas[version] = schema
+        return version
+
+    def remove(self, uid):
+        shutil.rmtree(os.path.join(self.directory, quote(uid, safe="")), True)
+
+    def changes(self):
+        """The changes of the current transaction"""
+        txn = transaction.get()
+        try:
+            return txn.data(self)
+        except KeyError:
+            changes = SpoolChanges(self)
+            txn.set_data(self, changes)
+            txn.join(changes)
+            return changes
+
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(directory):
+    with _spools_lock:
+        spool = _spools.get(directory)
+        if spool is None:
+            spool = _spools[directory] = FormDataSpool(directory)
+        return spool
+
+
+def timestamp(date):
+    return date.timestamp() if date else None
+
+
+@implementer(IFormDataStore)
+@adapter(IDexterityContent, Interface)
+class SpoolFormDataStore(BaseFormDataStore):
+    """Append-only store for forms with many submissions and few reads.
+
+    Changes are visible after the commit of the transaction.
+    """
+
+    def __init__(self, context, request, directory=None):
+        super().__init__(context, request)
+        self.spool = get_spool(directory or get_spool_directory())
+
+    @property
+    def uid(self):
+        return IUUID(self.context, None) or "/".join(self.context.getPhysicalPath())
+
+    def get_files(self, block_id=None):
+        files = self.spool.get_files(self.uid)
+        if block_id:
+            return [
+                spool_file for spool_file in files if spool_file.block_id == block_id
+            ]
+        return files
+
+    def add(self, data):
+        fields = self.get_submitted_fields(data)
+        if fields is None:
+            return None
+        schema, values = fields
+        url = None
+        if self.get_block().get("sendAdditionalInfo"):
+            url = self.context.absolute_url_path()
+        return self._append(
+            random.randrange(1, 2**53),
+            self.block_id,
+            datetime.now(),
+            url,
+            schema,
+            values,
+        )
+
+    def _append(self, intid, block_id, date, url, schema, values):
+        entry = {
+            "id": intid,
+            "block_id": block_id,
+            "date": date.isoformat(),
+            "values": [encode_value(value) for value in values],
+        }
+        if url is not None:
+            entry["url"] = url
+        spool_file = self.spool.get_file(self.uid, block_id)
+        changes = self.spool.changes()
+        changes.appends.setdefault(spool_file, []).append(
+            (
+                intid,
+                date.timestamp(),
+                entry,
+                tuple((field_id, label) for field_id, label in schema),
+            )
+        )
+        return intid
+
+    def get_record_schema(self, block_id, version):
+        return self.spool.schemas[version]
+
+    def stored_fields(self, block_id=None):
+        return merge_schemas(
+            schema
+            for spool_file in self.get_files(block_id)
+            for schema in reversed(spool_file.read_schemas())
+        )
+
+    def _record(self, line, spool_file):
+        entry = json.loads(line, object_hook=decode_value)
+        if "fields" in entry:
+            # written with the whole schema in each line
+            schema = tuple((field_id, label) for field_id, label in entry["fields"])
+        else:
+            schema = spool_file.get_schema(entry["schema"])
+        attrs = {
+            "block_id": entry["block_id"],
+            "date": datetime.fromisoformat(entry["date"]),
+            SCHEMA_ATTR: self.spool.intern_schema(schema),
+            VALUES_ATTR: tuple(entry["values"]),
+        }
+        if "url" in entry:
+            attrs["url"] = entry["url"]
+        return FormDataRecord(entry["id"], attrs)
+
+    @staticmethod
+    def _entries(entries, deleted, date_from, date_to):
+        return [
+            entry
+            for entry in entries
+            if entry[2] not in deleted
+            and (date_from is None or entry[1] >= date_from)
+            and (date_to is None or entry[1] < date_to)
+        ]
+
+    def length(self, block_id=None):
+        return sum(len(spool_file) for spool_file in self.get_files(block_id))
+
+    def count(self, block_id=None, date_from=None, date_to=None):
+        if not (date_from or date_to):
+            return self.length(block_id=block_id)
+        count = 0
+        for spool_file in self.get_files(block_id):
+            data, entries, deleted = spool_file.read()
+            count += len(
+                self._entries(
+                    entries, deleted, timestamp(date_from), timestamp(date_to)
+                )
+            )
+        return count
+
+    def search(
+        self,
+        query=None,
+        block_id=None,
+        date_from=None,
+        date_to=None,
+        sort_on="date",
+        reverse=True,
+        limit=None,
+        offset=0,
+        lazy=False,
+    ):
+        """See FormDataStore.search. Only the lines of the returned records
+        are parsed (when accessed, if lazy). Catalog queries are not
+        supported.
+        """
+        if query is not None:
+            raise ValueError("The spool store doesn't support catalog queries")
+        if sort_on not in ("date", "block_id"):
+            raise ValueError(f"Unknown sort index: {sort_on}")
+        if limit is not None and limit <= 0:
+            return []
+        results = []
+        for spool_file in self.get_files(block_id):
+            data, entries, deleted = spool_file.read()
+            entries = self._entries(
+                entries, deleted, timestamp(date_from), timestamp(date_to)
+            )
+            # entries are appended in (almost) chronological order
+            entries.sort(key=lambda entry: entry[1], reverse=reverse)
+            results.append([(spool_file, entry, data) for entry in entries])
+        if sort_on == "block_id":
+            results.sort(
+                key=lambda block: block[0][0].block_id if block else "",
+                reverse=reverse,
+            )
+            merged = (item for block in results for item in block)
+        else:
+            merged = heapq.merge(*results, key=lambda item: item[1][1], reverse=reverse)
+        end = None if limit is None else offset + limit
+        lines = [
+            (entry[0], data, spool_file)
+            for spool_file, entry, data in islice(merged, offset, end)
+        ]
+        if lazy:
+            return LazyMap(self._load, lines)
+        return [self._load(line) for line in lines]
+
+    def _load(self, line):
+        start, data, spool_file = line
+        return self._record(data[start : data.find(b"\n", start)], spool_file)
+
+    def _find(self, ids):
+        """SpoolFile -> the ids in its lines"""
+        ids = set(ids)
+        found = {}
+        for spool_file in self.get_files():
+            data, entries, deleted = spool_file.read()
+            matches = [
+                entry[2]
+                for entry in entries
+                if entry[2] in ids and entry[2] not in deleted
+            ]
+            if matches:
+                found[spool_file] = matches
+        return found
+
+    def delete(self, id):
+        if not self.delete_many([id]):
+            raise KeyError(id)
+
+    def delete_many(self, ids):
+        changes = self.spool.changes()
+        deleted = 0
+        for spool_file, found in self._find(ids).items():
+            changes.deletes.setdefault(spool_file, []).extend(found)
+            deleted += len(found)
+        return deleted
+
+    def delete_query(self, block_id=None, date_from=None, date_to=None):
+        """Remove the records in the date range, rewriting the files of the
+        blocks (or removing them, without a date range)
+        """
+        changes = self.spool.changes()
+        deleted = 0
+        for spool_file in self.get_files(block_id):
+            if not (date_from or date_to):
+                deleted += len(spool_file)
+                changes.removes.add(spool_file)
+                continue
+            count = self.count(spool_file.block_id, date_from, date_to)
+            if count:
+                changes.rewrites.setdefault(spool_file, []).append(
+                    (timestamp(date_from), timestamp(date_to))
+                )
+                deleted += count
+        return deleted
+
+    def clear(self):
+        self.delete_query()
+
+    # maintenance of the soups, nothing to do here
+
+    def merge_pending(self):
+        return 0
+
+    def compact_records(self, batch_size=None):
+        return 0
+
+    def split_soup(self):
+        return 0
@@ -0,0 +1,494 @@
+"""
+IFormDataStore that keeps the submissions in a SQLite database, outside the
+ZODB, enabled with FORM_DATA_SQLITE_PATH.
+
+The writes of a request join its Zope transaction: they are buffered,
+inserted in batches and committed with it (or rolled back on abort and
+conflict retries).
+"""
+
+from collective.volto.formsupport.datamanager.base import BaseFormDataStore
+from collective.volto.formsupport.datamanager.base import dump_values
+from collective.volto.formsupport.datamanager.base import FormDataRecord
+from collective.volto.formsupport.datamanager.base import load_values
+from collective.volto.formsupport.datamanager.base import merge_schemas
+from collective.volto.formsupport.datamanager.base import SCHEMA_ATTR
+from collective.volto.formsupport.datamanager.base import VALUES_ATTR
+from collective.volto.formsupport.interfaces import IFormDataStore
+from datetime import datetime
+from itertools import islice
+from plone.dexterity.interfaces import IDexterityContent
+from plone.uuid.interfaces import IUUID
+from transaction.interfaces import IDataManager
+from zope.component import adapter
+from zope.interface import implementer
+from zope.interface import Interface
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import transaction
+
+
+SQLITE_PATH_ENV = "FORM_DATA_SQLITE_PATH"
+# rows inserted with each executemany
+BATCH_SIZE = 500
+BUSY_TIMEOUT = 10000  # milliseconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS form_schema (
+    id INTEGER PRIMARY KEY,
+    fields TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS form_data (
+    uid TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    block_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    url TEXT,
+    schema_id INTEGER NOT NULL REFERENCES form_schema (id),
+    data TEXT NOT NULL,
+    PRIMARY KEY (uid, id)
+);
+CREATE TABLE IF NOT EXISTS form_block_schema (
+    uid TEXT NOT NULL,
+    block_id TEXT NOT NULL,
+    schema_id INTEGER NOT NULL REFERENCES form_schema (id),
+    PRIMARY KEY (uid, block_id, schema_id)
+);
+CREATE INDEX IF NOT EXISTS form_data_block_date ON form_data (uid, block_id, date);
+CREATE INDEX IF NOT EXISTS form_data_date ON form_data (uid, date);
+"""
+INSERT = (
+    "INSERT OR IGNORE INTO form_data"
+    " (uid, id, block_id, date, url, schema_id, data) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+INSERT_BLOCK_SCHEMA = "INSERT OR IGNORE INTO form_block_schema (uid, block_id, schema_id) VALUES (?, ?, ?)"
+SORT_COLUMNS = {"date": "date", "block_id": "block_id, date"}
+
+
+def get_sqlite_path():
+    return os.environ.get(SQLITE_PATH_ENV) or None
+
+
+def format_date(date):
+    # ISO dates with a fixed precision sort as strings
+    return date.isoformat(timespec="microseconds")
+
+
+@implementer(IDataManager)
+class SQLiteDataManager:
+    """Join the SQLite transaction of a thread to the Zope transaction.
+
+    Inserts are buffered until a read, BATCH_SIZE rows or the commit, so
+    the database is locked for writing only for a short time. SQLite commits
+    in tpc_vote: a failure in a later data manager can't roll it back.
+    """
+
+    def __init__(self, database, connection, txn):
+        self.database = database
+        self.connection = connection
+        self.transaction = txn
+        self.transaction_manager = transaction.manager
+        self.rows = []
+
+    def begin(self):
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+
+    def insert(self, row):
+        """Add a row (uid, id, block_id, date, url, schema fields, data)"""
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        self.begin()
+        schema_ids = {}
+        for row in rows:
+            fields = row[5]
+            if fields not in schema_ids:
+                schema_ids[fields] = self.database.intern_schema(
+                    self.connection, fields
+                )
+        rows = [row[:5] + (schema_ids[row[5]], row[6]) for row in rows]
+        self.connection.executemany(INSERT, rows)
+        # the schemas of each block, for the columns of the exports
+        self.connection.executemany(
+            INSERT_BLOCK_SCHEMA, {(row[0], row[2], row[5]) for row in rows}
+        )
+
+    def execute(self, sql, params=()):
+        self.flush()
+        self.begin()
+        return self.connection.execute(sql, params)
+
+    def _close(self):
+        self.rows = []
+        if self.connection.in_transaction:
+            self.connection.rollback()
+        self.database.forget(self)
+
+    def abort(self, txn):
+        self._close()
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        self.flush()
+
+    def tpc_vote(self, txn):
+        if self.connection.in_transaction:
+            self.connection.commit()
+
+    def tpc_finish(self, txn):
+        self.database.forget(self)
+
+    def tpc_abort(self, txn):
+        self._close()
+
+    def sortKey(self):
+        # after the ZODB, that is more likely to fail with a conflict
+        return f"~collective.volto.formsupport.sqlite:{self.database.path}"
+
+
+class FormDataDatabase:
+    """A SQLite database file, with a connection for each thread"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # transactions are handled by SQLiteDataManager
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close the connection of the current thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            self._local.connection = None
+            self._local.data_manager = None
+            connection.close()
+
+    def data_manager(self):
+        """The data manager of the current transaction, joined on first use"""
+        txn = transaction.get()
+        data_manager = getattr(self._local, "data_manager", None)
+        if data_manager is None or data_manager.transaction is not txn:
+            data_manager = SQLiteDataManager(self, self.connection(), txn)
+            txn.join(data_manager)
+            self._local.data_manager = data_manager
+        return data_manager
+
+    def forget(self, data_manager):
+        if getattr(self._local, "data_manager", None) is data_manager:
+            self._local.data_manager = None
+
+    def read(self, sql, params=()):
+        """Run a query, seeing the writes of the current transaction"""
+        data_manager = getattr(self._local, "data_manager", None)
+        if data_manager is not None and data_manager.transaction is transaction.get():
+            data_manager.flush()
+        return self.connection().execute(sql, params)
+
+    def write(self, sql, params=()):
+        return self.data_manager().execute(sql, params)
+
+    @staticmethod
+    def intern_schema(connection, fields):
+        """The id of the schema (JSON of the (field_id, label) list)"""
+        connection.execute(
+            "INSERT OR IGNORE INTO form_schema (fields) VALUES (?)", (fields,)
+        )
+        return connection.execute(
+            "SELECT id FROM form_schema WHERE fields = ?", (fields,)
+        ).fetchone()[0]
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path):
+    with _databases_lock:
+        database = _databases.get(path)
+        if database is None:
+            database = _databases[path] = FormDataDatabase(path)
+        return database
+
+
+class LazyResults:
+    """The records of a query, as a sequence that runs the query again for
+    each iteration, length or item access.
+
+    Items and slices are read with LIMIT and OFFSET: a batch only reads its
+    own rows.
+    """
+
+    def __init__(self, store, sql, params, limit=None, offset=0):
+        self.store = store
+        self.sql = sql
+        self.params = params
+        self.limit = limit
+        self.offset = offset
+
+    def _read(self, start=0, stop=None):
+        """The records from start to stop (None for the end)"""
+        limit = self.limit
+        if stop is not None:
+            limit = stop - start if limit is None else min(limit, stop) - start
+        elif limit is not None:
+            limit -= start
+        if limit is not None and limit <= 0:
+            return
+        rows = self.store.database.read(
+            f"{self.sql} LIMIT ? OFFSET ?",
+            [*self.params, -1 if limit is None else limit, self.offset + start],
+        )
+        for row in rows:
+            yield self.store._record(row)
+
+    def __iter__(self):
+        return self._read()
+
+    def __len__(self):
+        return self.store.database.read(
+            f"SELECT COUNT(*) FROM ({self.sql} LIMIT ? OFFSET ?)",
+            [*self.params, -1 if self.limit is None else self.limit, self.offset],
+        ).fetchone()[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.start or 0, index.stop, index.step
+            if start < 0 or (stop is not None and stop < 0) or step not in (None, 1):
+                start, stop, step = index.indices(len(self))
+                if step != 1:
+                    return list(islice(self._read(), start, stop, step))
+            return list(self._read(start, stop))
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for record in self._read(index, index + 1):
+                return record
+        raise IndexError(index)
+
+
+@implementer(IFormDataStore)
+@adapter(IDexterityContent, Interface)
+class SQLiteFormDataStore(BaseFormDataStore):
+    def __init__(self, context, request, path=None):
+        super().__init__(context, request)
+        self.database = get_database(path or get_sqlite_path())
+
+    @property
+    def uid(self):
+        return IUUID(self.context, None) or "/".join(self.context.getPhysicalPath())
+
+    def add(self, data):
+        fields = self.get_submitted_fields(data)
+        if fields is None:
+            return None
+        schema, values = fields
+        url = None
+        if self.get_block().get("sendAdditionalInfo"):
+            url = self.context.absolute_url_path()
+        return self._insert(
+            random.randrange(1, 2**53),
+            self.block_id,
+            datetime.now(),
+            url,
+            schema,
+            values,
+        )
+
+    def _insert(self, intid, block_id, date, url, schema, values):
+        self.database.data_manager().insert(
+            (
+                self.uid,
+                intid,
+                block_id,
+                format_date(date),
+                url,
+                json.dumps(schema),
+                dump_values(values),
+            )
+        )
+        return intid
+
+    def get_record_schema(self, block_id, version):
+        if version not in self._schemas:
+            (fields,) = self.database.read(
+                "SELECT fields FROM form_schema WHERE id = ?", (version,)
+            ).fetchone()
+            self._schemas[version] = tuple(
+                (field_id, label) for field_id, label in json.loads(fields)
+            )
+        return self._schemas[version]
+
+    def stored_fields(self, block_id=None):
+        sql = "SELECT schema_id, block_id FROM form_block_schema WHERE uid = ?"
+        params = [self.uid]
+        if block_id:
+            sql += " AND block_id = ?"
+            params.append(block_id)
+        rows = self.database.read(f"{sql} ORDER BY schema_id DESC", params).fetchall()
+        return merge_schemas(
+            self.get_record_schema(block_id, schema_id) for schema_id, block_id in rows
+        )
+
+    def _where(self, block_id=None, date_from=None, date_to=None):
+        criteria = ["uid = ?"]
+        params = [self.uid]
+        if block_id:
+            criteria.append("block_id = ?")
+            params.append(block_id)
+        if date_from:
+            criteria.append("date >= ?")
+            params.append(format_date(date_from))
+        if date_to:
+            criteria.append("date < ?")
+            params.append(format_date(date_to))
+        return " AND ".join(criteria), params
+
+    def length(self, block_id=None):
+        return self.count(block_id=block_id)
+
+    def count(self, block_id=None, date_from=None, date_to=None):
+        where, params = self._where(block_id, date_from, date_to)
+        return self.database.read(
+            f"SELECT COUNT(*) FROM form_data WHERE {where}", params
+        ).fetchone()[0]
+
+    def search(
+        self,
+        query=None,
+        block_id=None,
+        date_from=None,
+        date_to=None,
+        sort_on="date",
+        reverse=True,
+        limit=None,
+        offset=0,
+        lazy=False,
+    ):
+        """See FormDataStore.search, paged by SQLite.
+
+        With lazy, the records are read from the cursor while iterating,
+        without loading all the rows. Catalog queries are not supported.
+        """
+        if query is not None:
+            raise ValueError("The SQLite store doesn't support catalog queries")
+        if sort_on not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort index: {sort_on}")
+        if limit is not None and limit <= 0:
+            return []
+        where, params = self._where(block_id, date_from, date_to)
+        order = " DESC" if reverse else ""
+        columns = ", ".join(
+            f"{column}{order}" for column in SORT_COLUMNS[sort_on].split(", ")
+        )
+        sql = (
+            "SELECT id, block_id, date, url, schema_id, data FROM form_data"
+            f" WHERE {where} ORDER BY {columns}"
+        )
+        if lazy:
+            return LazyResults(self, sql, params, limit, offset)
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if limit is None else limit, offset]
+        return [self._record(row) for row in self.database.read(sql, params)]
+
+    @staticmethod
+    def _record(row):
+        intid, block_id, date, url, schema_id, data = row
+        attrs = {
+            "block_id": block_id,
+            "date": datetime.fromisoformat(date),
+            SCHEMA_ATTR: schema_id,
+            VALUES_ATTR: load_values(data),
+        }
+        if url is not None:
+            attrs["url"] = url
+        return FormDataRecord(intid, attrs)
+
+    def delete(self, id):
+        cursor = self.database.write(
+            "DELETE FROM form_data WHERE uid = ? AND id = ?", (self.uid, id)
+        )
+        if not cursor.rowcount:
+            raise KeyError(id)
+
+    def delete_many(self, ids):
+        ids = list(ids)
+        deleted = 0
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start : start + BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            deleted += self.database.write(
+                f"DELETE FROM form_data WHERE uid = ? AND id IN ({placeholders})",
+                [self.uid] + batch,
+            ).rowcount
+        return deleted
+
+    def delete_query(self, block_id=None, date_from=None, date_to=None):
+        where, params = self._where(block_id, date_from, date_to)
+        return self.database.write(
+            f"DELETE FROM form_data WHERE {where}", params
+        ).rowcount
+
+    def clear(self):
+        self.delete_query()
+        self.database.write("DELETE FROM form_block_schema WHERE uid = ?", (self.uid,))
+
+    def import_records(self, store, batch_size=None):
+        """Copy the records of another store, keeping their ids. Records
+        already copied are skipped.
+
+        The records are read while they are copied. With batch_size, the
+        transaction is committed every batch_size records.
+
+        @return: the number of read records
+        """
+        count = 0
+        for record in store.search(reverse=False, lazy=True):
+            fields = store.record_fields(record)
+            attrs = record.attrs
+            self._insert(
+                record.intid,
+                attrs.get("block_id", ""),
+                attrs.get("date") or datetime.now(),
+                attrs.get("url"),
+                tuple((field_id, label) for field_id, label, value in fields),
+                tuple(value for field_id, label, value in fields),
+            )
+            count += 1
+            if batch_size and not count % batch_size:
+                transaction.commit()
+        return count
+
+    # maintenance of the soups, nothing to do here
+
+    def merge_pending(self):
+        return 0
+
+    def compact_records(self, batch_size=None):
+        return 0
+
+    def split_soup(self):
+        return 0
+
@@ -18,14 +18,61 @@ class IFormDataStore(Interface):
         @return: record id
         """
 
-    def length():
+    def length(block_id=None):
         """
-        @return: number of items stored into store
+        @return: number of items stored into store (for the given block)
         """
 
-    def search(query):
+    def search(
+        query=None,
+        block_id=None,
+        date_from=None,
+        date_to=None,
+        sort_on="date",
+        reverse=True,
+        limit=None,
+        offset=0,
+    ):
         """
-        @return: items that match query
+        @return: items that match query, block_id and the date range
+            (date_from included, date_to excluded), sorted on the sort_on index
+            and sliced with offset and limit
+        """
+
+    def record_fields(record, order=()):
+        """
+        @return: (field_id, label, value) of the form fields stored in the
+            record, in the submission order
+        """
+
+    def stored_fields(block_id=None):
+        """
+        @return: the union of the (field_id, label) of the stored records
+            (for the given block), newest fields first
+        """
+
+    def delete(id):
+        """
+        Delete the record with the given id
+        """
+
+    def delete_many(ids):
+        """
+        Delete the records with the given ids
+
+        @return: the number of deleted records
+        """
+
+    def delete_query(block_id=None, date_from=None, date_to=None):
+        """
+        Delete the records of the given block and date range (see search)
+
+        @return: the number of deleted records
+        """
+
+    def clear():
+        """
+        Delete all the records
         """
 
 
@@ -0,0 +1,316 @@
+"""
+SMTP sessions for the mails of a submission.
+
+Every mail sent by a submission (recipient, bcc copies and acknowledgement)
+reuses the same SMTP session instead of paying a new connect, TLS handshake
+and login for each message: the session is closed at the end of the
+submission. With FORM_MAIL_SMTP_POOL_SIZE the sessions are kept in a pool
+shared between the worker threads, and reused by the next submissions.
+"""
+
+from Acquisition import aq_base
+from collective.volto.formsupport import logger
+from email.utils import getaddresses
+from Products.MailHost.MailHost import _mungeHeaders
+from Products.MailHost.MailHost import MailBase
+from zope.sendmail.mailer import SMTPMailer
+
+import os
+import smtplib
+import threading
+import time
+
+
+POOL_SIZE_ENV = "FORM_MAIL_SMTP_POOL_SIZE"
+# the pool is disabled by default
+POOL_SIZE = 0
+# idle connections are closed after this time (servers drop them anyway)
+IDLE_TIMEOUT = 30
+# connections idle for more than this time are checked with a NOOP before use
+HEALTH_CHECK_AFTER = 5
+# the default of zope.sendmail's SMTPMailer
+TIMEOUT = 10
+
+
+def get_pool_size():
+    try:
+        return int(os.environ.get(POOL_SIZE_ENV, POOL_SIZE))
+    except ValueError:
+        logger.warning(f"Invalid {POOL_SIZE_ENV} value, using {POOL_SIZE}")
+        return POOL_SIZE
+
+
+def message_envelope(msg, charset=None):
+    """Return the sender, the recipients and the bytes of an email message.
+
+    As MailHost.send, the recipients are taken from the To, Cc and Bcc
+    headers, the charset is set on the parts that miss it, the Bcc header is
+    removed and a missing Date is added. The message isn't changed: it can be
+    sent again with other recipients.
+    """
+    message = _mungeHeaders(msg, charset=charset)[0]
+    mfrom = getaddresses([msg["From"]])[0][1]
+    recipients = []
+    for header in ("To", "Cc", "Bcc"):
+        recipients.extend(msg.get_all(header, []))
+    mto = [address for name, address in getaddresses(recipients) if address]
+    return mfrom, mto, message
+
+
+def close_connection(connection):
+    try:
+        connection.quit()
+    except Exception:
+        connection.close()
+
+
+class SMTPConnectionPool:
+    """Keep up to ``size`` idle connections for each SMTP server/account"""
+
+    def __init__(
+        self,
+        size=POOL_SIZE,
+        idle_timeout=IDLE_TIMEOUT,
+        health_check_after=HEALTH_CHECK_AFTER,
+    ):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self._idle = {}  # maps key -> list of (connection, released at)
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else (None, None)
+
+    def acquire(self, key, connect):
+        """Return an idle connection for key, or a new one made by connect()"""
+        while True:
+            connection, released = self._pop(key)
+            if connection is None:
+                return connect()
+            idle_time = time.monotonic() - released
+            if idle_time > self.idle_timeout:
+                close_connection(connection)
+                continue
+            if idle_time > self.health_check_after:
+                try:
+                    code, response = connection.noop()
+                except (smtplib.SMTPException, OSError):
+                    code = None
+                if code != 250:
+                    close_connection(connection)
+                    continue
+            return connection
+
+    def release(self, key, connection):
+        """Give back a connection that can be reused"""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append((connection, time.monotonic()))
+                return
+        close_connection(connection)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, released in connections:
+                close_connection(connection)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(connections) for connections in self._idle.values())
+
+
+pool = SMTPConnectionPool()
+
+
+class PooledSMTPMailer:
+    """Mailer that takes its connections from a SMTPConnectionPool, with the
+    settings of zope.sendmail's SMTPMailer.
+    """
+
+    def __init__(
+        self,
+        pool=pool,
+        hostname="localhost",
+        port=25,
+        username=None,
+        password=None,
+        no_tls=False,
+        force_tls=False,
+        implicit_tls=False,
+        timeout=TIMEOUT,
+    ):
+        self.pool = pool
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.no_tls = no_tls
+        self.force_tls = force_tls
+        self.implicit_tls = implicit_tls
+        self.timeout = timeout
+
+    @property
+    def key(self):
+        return (
+            self.hostname,
+            str(self.port),
+            self.username,
+            self.implicit_tls,
+            self.force_tls,
+        )
+
+    def connect(self):
+        """Open an authenticated session"""
+        smtp = smtplib.SMTP_SSL if self.implicit_tls else smtplib.SMTP
+        connection = smtp(self.hostname, int(self.port), timeout=self.timeout)
+        try:
+            code, response = connection.ehlo()
+            if not 200 <= code < 300:
+                code, response = connection.helo()
+                if not 200 <= code < 300:
+                    raise RuntimeError(
+                        "Error sending HELO to the SMTP server "
+                        f"(code={code}, response={response})"
+                    )
+            if not self.implicit_tls:
+                have_tls = connection.has_extn("starttls")
+                if not have_tls and self.force_tls:
+                    raise RuntimeError("TLS is not available but TLS is required")
+                if have_tls and not self.no_tls:
+                    connection.starttls()
+                    connection.ehlo()
+            if connection.does_esmtp:
+                if self.username is not None and self.password is not None:
+                    connection.login(self.username, self.password)
+            elif self.username:
+                raise RuntimeError(
+                    "Mailhost does not support ESMTP but a username is configured"
+                )
+        except Exception:
+            close_connection(connection)
+            raise
+        return connection
+
+    def acquire(self):
+        return self.pool.acquire(self.key, self.connect)
+
+    def release(self, connection):
+        self.pool.release(self.key, connection)
+
+    def close(self):
+        """Nothing to do: the idle connections are kept by the pool"""
+
+    def send(self, fromaddr, toaddrs, message):
+        connection = self.acquire()
+        try:
+            connection.sendmail(fromaddr, toaddrs, message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+            # the server refused this message, but the session is still good
+            try:
+                connection.rset()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+                raise
+            self.release(connection)
+            raise
+        except Exception:
+            connection.close()
+            raise
+        self.release(connection)
+
+
+class SMTPSessionMailer(PooledSMTPMailer):
+    """Mailer that keeps its own SMTP session, opened by the first message
+    and reused by the next ones until close().
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(pool=None, **kwargs)
+        self.connection = None
+
+    def acquire(self):
+        connection, self.connection = self.connection, None
+        if connection is None:
+            connection = self.connect()
+        return connection
+
+    def release(self, connection):
+        self.connection = connection
+
+    def close(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            close_connection(connection)
+
+
+def mailer_settings(mailhost):
+    """The SMTP settings of the MailHost, as SMTPMailer arguments"""
+    return dict(
+        hostname=mailhost.smtp_host,
+        port=int(mailhost.smtp_port),
+        username=mailhost.smtp_uid or None,
+        password=mailhost.smtp_pwd or None,
+        force_tls=getattr(mailhost, "force_tls", False),
+        implicit_tls=getattr(mailhost, "implicit_tls", False),
+    )
+
+
+def make_mailer(mailhost, pool=pool):
+    """Return a mailer that uses the SMTP settings of the MailHost.
+
+    The mailer takes its connections from the pool, if it is enabled with
+    FORM_MAIL_SMTP_POOL_SIZE.
+    """
+    kwargs = mailer_settings(mailhost)
+    pool.size = get_pool_size()
+    if pool.size <= 0:
+        return SMTPMailer(**kwargs)
+    return PooledSMTPMailer(pool=pool, **kwargs)
+
+
+def sends_over_smtp(mailhost):
+    """Whether the MailHost sends the mails with its SMTP settings: a MailHost
+    that replaces the delivery (i.e. the MockMailHost of the tests) is used
+    as it is.
+    """
+    klass = type(aq_base(mailhost))
+    return (
+        getattr(klass, "send", None) is MailBase.send
+        and getattr(klass, "_send", None) is MailBase._send
+    )
+
+
+class MailSession:
+    """Send the mails of a submission over one SMTP session, closed by
+    close(), or over the connections of the pool if it is enabled.
+
+    With a MailHost that queues its mails, or that doesn't send them over
+    SMTP, the mails are sent by MailHost.send(immediate=True).
+    """
+
+    def __init__(self, mailhost):
+        self.mailhost = mailhost
+        self.mailer = None
+        if getattr(mailhost, "smtp_queue", False) or not sends_over_smtp(mailhost):
+            return
+        if get_pool_size() > 0:
+            self.mailer = make_mailer(mailhost)
+        else:
+            self.mailer = SMTPSessionMailer(**mailer_settings(mailhost))
+
+    def send(self, msg, charset=None):
+        if self.mailer is None:
+            self.mailhost.send(msg, charset=charset, immediate=True)
+            return
+        mfrom, mto, message = message_envelope(msg, charset=charset)
+        self.mailer.send(mfrom, mto, message)
+
+    def close(self):
+        if self.mailer is not None:
+            self.mailer.close()
@@ -0,0 +1,237 @@
+"""
+Durable spool for the mails sent by @submit-form.
+
+Messages are written in a maildir-like directory and delivered later by a
+worker thread or by the ``formsupport_mail_queue`` script::
+
+    <directory>/tmp      messages of not yet committed transactions
+    <directory>/new      messages waiting to be delivered
+    <directory>/cur      messages being delivered
+    <directory>/failed   messages that can't be delivered (dead letters)
+"""
+
+from collective.volto.formsupport import logger
+from collective.volto.formsupport.mail.pool import make_mailer
+from collective.volto.formsupport.mail.pool import message_envelope
+
+import json
+import os
+import smtplib
+import threading
+import time
+import transaction
+import uuid
+
+
+QUEUE_DIRECTORY_ENV = "FORM_MAIL_QUEUE_DIRECTORY"
+QUEUE_THREAD_ENV = "FORM_MAIL_QUEUE_THREAD"
+
+MAX_ATTEMPTS = 10
+BACKOFF = 60
+MAX_BACKOFF = 60 * 60
+# messages claimed by a processor that died are delivered again after this time
+CLAIM_TIMEOUT = 60 * 60
+WORKER_INTERVAL = 30
+
+workers = {}  # maps spool directory -> worker threads
+workers_lock = threading.Lock()
+spools = {}  # maps spool directory -> MailSpool
+spools_lock = threading.Lock()
+
+
+def get_mail_spool():
+    """Return the MailSpool configured with FORM_MAIL_QUEUE_DIRECTORY, if any.
+
+    The spool of a directory is created (with its folders) once per process.
+    """
+    directory = os.environ.get(QUEUE_DIRECTORY_ENV, "")
+    if not directory:
+        return None
+    with spools_lock:
+        spool = spools.get(directory)
+        if spool is None:
+            spool = spools[directory] = MailSpool(directory)
+        return spool
+
+
+def is_permanent_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, msg in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class MailSpool:
+    def __init__(
+        self,
+        directory,
+        max_attempts=MAX_ATTEMPTS,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+    ):
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        for folder in ("tmp", "new", "cur", "failed"):
+            os.makedirs(self._path(folder), exist_ok=True)
+
+    def _path(self, folder, name=""):
+        return os.path.join(self.directory, folder, name)
+
+    def _write(self, folder, name, entry):
+        path = self._path("tmp", f"{name}.{folder}")
+        with open(path, "w") as fd:
+            json.dump(entry, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(path, self._path(folder, name))
+
+    def _read(self, folder, name):
+        with open(self._path(folder, name)) as fd:
+            return json.load(fd)
+
+    def enqueue(self, mfrom, mto, message):
+        """Spool a message.
+
+        The message is moved in the queue only when the current transaction
+        is committed, so a conflict retry does not send it twice.
+        """
+        name = f"{time.time():.6f}-{uuid.uuid4().hex}"
+        entry = {
+            "from": mfrom,
+            "to": list(mto),
+            # latin-1 maps every byte to a char, so the message is kept as is
+            "message": message.decode("latin-1"),
+            "attempts": 0,
+            "next_attempt": 0,
+            "errors": [],
+        }
+        path = self._path("tmp", name)
+        with open(path, "w") as fd:
+            json.dump(entry, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        txn = transaction.get()
+        txn.addAfterCommitHook(self._after_commit, args=(name,))
+        txn.addAfterAbortHook(self._after_commit, args=(False, name))
+        return name
+
+    def enqueue_message(self, msg, charset=None):
+        """Spool an email.message.Message, with the recipients in its headers"""
+        return self.enqueue(*message_envelope(msg, charset=charset))
+
+    def _after_commit(self, status, name):
+        path = self._path("tmp", name)
+        if status:
+            os.replace(path, self._path("new", name))
+            wake_worker(self.directory)
+        elif os.path.exists(path):
+            os.unlink(path)
+
+    def pending(self):
+        return sorted(os.listdir(self._path("new")))
+
+    def failed(self):
+        return sorted(os.listdir(self._path("failed")))
+
+    def recover(self, now=None):
+        """Put back in the queue the messages claimed by a dead processor"""
+        now = now or time.time()
+        for name in os.listdir(self._path("cur")):
+            path = self._path("cur", name)
+            try:
+                if os.path.getmtime(path) + CLAIM_TIMEOUT < now:
+                    os.replace(path, self._path("new", name))
+            except FileNotFoundError:
+                continue
+
+    def process(self, mailer, now=None):
+        """Deliver the messages that are due.
+
+        @return: a tuple with the number of sent, deferred and failed messages
+        """
+        now = now or time.time()
+        sent = deferred = failed = 0
+        for name in self.pending():
+            try:
+                entry = self._read("new", name)
+            except (FileNotFoundError, ValueError):
+                continue
+            if entry["next_attempt"] > now:
+                continue
+            try:
+                # claim the message: only one processor can move it
+                os.replace(self._path("new", name), self._path("cur", name))
+            except FileNotFoundError:
+                continue
+            try:
+                mailer.send(
+                    entry["from"], entry["to"], entry["message"].encode("latin-1")
+                )
+            except Exception as e:
+                entry["attempts"] += 1
+                entry["errors"].append(f"{now}: {e!r}")
+                if is_permanent_error(e) or entry["attempts"] >= self.max_attempts:
+                    logger.error(f"Unable to deliver mail {name}: {e!r}")
+                    self._write("failed", name, entry)
+                    failed += 1
+                else:
+                    delay = self.backoff * 2 ** (entry["attempts"] - 1)
+                    entry["next_attempt"] = now + min(delay, self.max_backoff)
+                    logger.warning(f"Mail {name} deferred: {e!r}")
+                    self._write("new", name, entry)
+                    deferred += 1
+                os.unlink(self._path("cur", name))
+                continue
+            os.unlink(self._path("cur", name))
+            sent += 1
+        return sent, deferred, failed
+
+
+class MailSpoolWorker(threading.Thread):
+    """Deliver the spooled messages in the background"""
+
+    daemon = True
+
+    def __init__(self, spool, mailer, interval=WORKER_INTERVAL):
+        super().__init__(name=f"formsupport-mail-spool-{spool.directory}")
+        self.spool = spool
+        self.mailer = mailer
+        self.interval = interval
+        self.wake = threading.Event()
+        self.stopped = False
+
+    def run(self):
+        self.spool.recover()
+        while not self.stopped:
+            try:
+                self.spool.process(self.mailer)
+            except Exception as e:
+                logger.exception(e)
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+
+
+def start_worker(spool, mailhost):
+    """Start the worker thread of the spool, unless it is disabled with
+    FORM_MAIL_QUEUE_THREAD=0 (the formsupport_mail_queue script does the job).
+    """
+    if os.environ.get(QUEUE_THREAD_ENV, "1") in ("0", "false", "False"):
+        return None
+    with workers_lock:
+        worker = workers.get(spool.directory)
+        if worker is None or not worker.is_alive():
+            worker = MailSpoolWorker(spool, make_mailer(mailhost))
+            worker.start()
+            workers[spool.directory] = worker
+    return worker
+
+
+def wake_worker(directory):
+    worker = workers.get(directory)
+    if worker is not None:
+        worker.wake.set()
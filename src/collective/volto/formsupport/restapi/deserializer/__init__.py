@@ -1,3 +1,8 @@
+from collective.volto.formsupport import logger
+from collective.volto.formsupport.schema import FieldTemplate
+from collective.volto.formsupport.schema import get_field_template
+from collective.volto.formsupport.schema import sort_show_when
+from collective.volto.formsupport.utils import get_block_index
 from plone.base.interfaces import IPloneSiteRoot
 from plone.restapi.behaviors import IBlocks
 from plone.restapi.interfaces import IBlockFieldDeserializationTransformer
@@ -23,6 +28,8 @@ class FormBlockDeserializerBase:
         data,
     ):
         self._update_validations(data)
+        self._check_show_when(data)
+        self._check_subject(data)
         return data
 
     def _update_validations(self, data):
@@ -31,6 +38,83 @@ class FormBlockDeserializerBase:
                 field["validations"] = []
                 field["validationSettings"] = {}
 
+    @staticmethod
+    def _show_when_cycles(block):
+        """The ids of the fields whose show_when conditions are in a cycle"""
+        conditions = {}
+        for field in block.get("subblocks") or []:
+            show_when = field.get("show_when_when")
+            if show_when and show_when != "always":
+                conditions.setdefault(field.get("field_id", ""), show_when)
+        order, cycles = sort_show_when(conditions)
+        return cycles
+
+    def _check_show_when(self, data):
+        """Refuse new show_when conditions that depend on each other in a
+        cycle.
+
+        Cycles already in a stored form block are only logged, so pages saved
+        with them can still be edited: those fields are never shown.
+        """
+        cycles = self._show_when_cycles(data)
+        if not cycles:
+            return
+        # the blocks aren't changed yet
+        stored = {
+            field_id
+            for id, block in get_block_index(self.context).find_form_blocks()
+            for field_id in self._show_when_cycles(block)
+        }
+        new = [field_id for field_id in cycles if field_id not in stored]
+        if new:
+            raise ValueError(
+                "Circular show_when conditions between fields: {}".format(
+                    ", ".join(cycles)
+                )
+            )
+        logger.warning(
+            "Circular show_when conditions in a form block in {}: {}".format(
+                "/".join(self.context.getPhysicalPath()), ", ".join(cycles)
+            )
+        )
+
+    def _check_subject(self, data):
+        """Refuse new ${...} placeholders in the subject that match no field.
+
+        Placeholders already in the subject of a stored form block are only
+        logged, so pages saved with them can still be edited: they are left
+        as they are when the mail is sent.
+        """
+        field_ids = [
+            field["field_id"]
+            for field in data.get("subblocks") or []
+            if field.get("field_id")
+        ]
+        template = get_field_template(data.get("default_subject", ""))
+        unknown = [
+            placeholder
+            for placeholder in template.placeholders
+            if FieldTemplate.resolve(placeholder, field_ids) is None
+        ]
+        if not unknown:
+            return
+        # the blocks aren't changed yet
+        stored = {
+            placeholder
+            for id, block in get_block_index(self.context).find_form_blocks()
+            for placeholder in get_field_template(
+                block.get("default_subject", "")
+            ).placeholders
+        }
+        new = [placeholder for placeholder in unknown if placeholder not in stored]
+        if new:
+            raise ValueError("Unknown fields in the subject: {}".format(", ".join(new)))
+        logger.warning(
+            "Unknown fields in the subject of a form block in {}: {}".format(
+                "/".join(self.context.getPhysicalPath()), ", ".join(unknown)
+            )
+        )
+
 
 @implementer(IBlockFieldDeserializationTransformer)
 @adapter(IBlocks, IBrowserRequest)
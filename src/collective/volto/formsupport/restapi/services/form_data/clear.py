@@ -12,14 +12,14 @@ class FormDataClear(Service):
         expired = form_data.get("expired")
         store = getMultiAdapter((self.context, self.request), IFormDataStore)
 
-        if expired or block_id:
-            data = FormData(self.context, self.request, block_id=block_id)
-            if expired:
-                for item in data.get_expired_items():
-                    store.delete(item["id"])
-            else:
-                for item in data.get_items():
-                    store.delete(item["id"])
+        if expired:
+            expire_date = FormData(
+                self.context, self.request, block_id=block_id
+            ).expire_date
+            if expire_date:
+                store.delete_query(block_id=block_id, date_to=expire_date)
+        elif block_id:
+            store.delete_query(block_id=block_id)
         else:
             store.clear()
         return self.reply_no_content()
@@ -1,99 +1,295 @@
 from collective.volto.formsupport.interfaces import IFormDataStore
-from io import StringIO
-from plone.restapi.serializer.converters import json_compatible
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    COMPRESSIONS,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    EXPORT_FORMATS,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    get_compression_level,
+)
+from collective.volto.formsupport.utils import get_block_index
+from datetime import datetime
+from plone.memoize.instance import memoize
 from plone.restapi.services import Service
+from zExceptions import BadRequest
 from zope.component import getMultiAdapter
 
-import csv
+import tempfile
 
 
-SKIP_ATTRS = ["block_id", "fields_labels", "fields_order"]
+# rows written to the export file at once
+CHUNK_SIZE = 1000
+
+
+def accepts_encoding(header, encoding):
+    """If an Accept-Encoding header accepts the encoding"""
+    for item in header.split(","):
+        name, *params = item.split(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
 
 
 class FormDataExportGet(Service):
-    def __init__(self, context, request):
-        super().__init__(context, request)
-        self.form_fields_order = []
-        self.form_block = {}
-
-        blocks = getattr(context, "blocks", {})
-        if not blocks:
-            return
-        for id, block in blocks.items():
-            block_type = block.get("@type", "")
-            if block_type == "form":
-                self.form_block = block
-
-        if self.form_block:
-            for field in self.form_block.get("subblocks", []):
-                field_id = field["field_id"]
-                self.form_fields_order.append(field_id)
-
-    def get_ordered_keys(self, record):
-        """
-        We need this method because we want to maintain the fields order set in the form.
-        The form can also change during time, and each record can have different fields stored in it.
+    """Export the stored records as CSV, or in the format of the ``format``
+    parameter (see EXPORT_FORMATS).
+
+    The records can be filtered with the ``block_id``, ``date_from`` and
+    ``date_to`` (excluded) query parameters, resolved by the store indexes,
+    and the columns limited to the field ids of ``fields`` (a comma
+    separated list).
+
+    With ``compress`` (see COMPRESSIONS) the file is compressed while it is
+    written. A gzip export is sent with Content-Encoding when the client
+    accepts it, otherwise as a .gz file.
+    """
+
+    @property
+    @memoize
+    def block_id(self):
+        return self.request.form.get("block_id") or None
+
+    @property
+    @memoize
+    def form_blocks(self):
+        """The exported form blocks: the one of block_id, or all of them"""
+        blocks = get_block_index(self.context).find_form_blocks()
+        if self.block_id:
+            blocks = [(id, block) for id, block in blocks if id == self.block_id]
+            if not blocks:
+                raise BadRequest(f"Form block not found: {self.block_id}")
+        return blocks
+
+    @property
+    @memoize
+    def form_fields_order(self):
+        return [
+            field["field_id"]
+            for id, block in self.form_blocks
+            for field in block.get("subblocks", [])
+        ]
+
+    @property
+    @memoize
+    def fields(self):
+        """The field ids of the fields parameter, or None for all the fields"""
+        fields = self.request.form.get("fields")
+        if not fields:
+            return None
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        return {field.strip() for field in fields if field.strip()}
+
+    def get_date(self, name):
+        value = self.request.form.get(name)
+        if not value:
+            return None
+        try:
+            date = datetime.fromisoformat(value)
+        except ValueError:
+            raise BadRequest(f"Invalid {name}: {value}, use an ISO 8601 date")
+        if date.tzinfo is not None:
+            # the records are stored with the local time
+            date = date.astimezone().replace(tzinfo=None)
+        return date
+
+    @property
+    @memoize
+    def date_from(self):
+        return self.get_date("date_from")
+
+    @property
+    @memoize
+    def date_to(self):
+        return self.get_date("date_to")
+
+    def get_records(self):
+        """The records to export, as a lazy sequence"""
+        return self.store.search(
+            block_id=self.block_id,
+            date_from=self.date_from,
+            date_to=self.date_to,
+            lazy=True,
+        )
+
+    @property
+    @memoize
+    def writer(self):
+        """The writer of the format parameter (csv, ndjson or xlsx)"""
+        export_format = self.request.form.get("format") or "csv"
+        if export_format not in EXPORT_FORMATS:
+            raise BadRequest(
+                "Invalid format: {}, use one of {}".format(
+                    export_format, ", ".join(EXPORT_FORMATS)
+                )
+            )
+        return EXPORT_FORMATS[export_format]
+
+    @property
+    @memoize
+    def compression(self):
+        """The wrapper of the compress parameter (gzip or zip), or None"""
+        compress = self.request.form.get("compress")
+        if not compress:
+            return None
+        if compress not in COMPRESSIONS:
+            raise BadRequest(
+                "Invalid compress: {}, use one of {}".format(
+                    compress, ", ".join(COMPRESSIONS)
+                )
+            )
+        if self.writer.extension == "xlsx":
+            raise BadRequest("The xlsx format is already compressed")
+        return COMPRESSIONS[compress]
+
+    def validate_parameters(self):
+        """Check the parameters of the request before writing anything
+
+        @raise BadRequest: for an unknown block, format or compression, or an
+            invalid date
         """
-        record_order = record.attrs.get("fields_order", [])
-        if record_order:
-            return record_order
-        order = []
-        # first add the keys that are currently in the form
-        for k in self.form_fields_order:
-            if k in record.attrs:
-                order.append(k)
-        # finally append the keys stored in the record but that are not in the form (maybe the form changed during time)
-        for k in record.attrs.keys():
-            if k not in order and k not in SKIP_ATTRS:
-                order.append(k)
-        return order
+        # the memoized properties raise BadRequest for invalid values
+        for name in ("form_blocks", "writer", "compression", "date_from", "date_to"):
+            getattr(self, name)
+
+    @property
+    def filename(self):
+        return f"{self.__name__}.{self.writer.extension}"
 
     def render(self):
         self.check_permission()
 
-        self.request.response.setHeader(
-            "Content-Disposition",
-            f'attachment; filename="{self.__name__}.csv"',
-        )
-        self.request.response.setHeader("Content-Type", "text/comma-separated-values")
-        data = self.get_data()
-        if isinstance(data, str):
-            data = data.encode("utf-8")
-        self.request.response.write(data)
+        response = self.request.response
+        filename = self.filename
+        content_type = self.writer.content_type
+        compression = self.compression
+        if compression is not None:
+            if compression.encoding:
+                response.setHeader("Vary", "Accept-Encoding")
+            if compression.encoding and accepts_encoding(
+                self.request.getHeader("Accept-Encoding", ""), compression.encoding
+            ):
+                # decompressed by the client, and saved with the format extension
+                response.setHeader("Content-Encoding", compression.encoding)
+            else:
+                filename = f"{filename}.{compression.extension}"
+                content_type = compression.content_type
+        response.setHeader("Content-Disposition", f'attachment; filename="{filename}"')
+        response.setHeader("Content-Type", content_type)
+        # a file body is streamed by the publisher (with its Content-Length)
+        return self.get_data()
 
-    def get_fields_labels(self, item):
-        return item.attrs.get("fields_labels", {})
+    @property
+    @memoize
+    def store(self):
+        return getMultiAdapter((self.context, self.request), IFormDataStore)
 
     def get_data(self):
-        store = getMultiAdapter((self.context, self.request), IFormDataStore)
-        sbuf = StringIO()
+        """The export, written in chunks of rows to a temporary file.
+
+        response.write would buffer the whole export in memory, and the
+        records can't be read after the request closes the ZODB connection.
+        """
+        self.validate_parameters()
         fixed_columns = ["date"]
-        if "currentUrl" in self.form_block.get('sendAdditionalInfo', []):
+        if any(
+            "currentUrl" in block.get("sendAdditionalInfo", [])
+            for id, block in self.form_blocks
+        ):
             fixed_columns.append("url")
-        columns = []
-
-        rows = []
-        for item in store.search():
-            data = {}
-            fields_labels = self.get_fields_labels(item)
-            for k in self.get_ordered_keys(item):
-                if k in SKIP_ATTRS:
+
+        labels = [
+            label
+            for field_id, label in self.store.stored_fields(block_id=self.block_id)
+            if self.fields is None or field_id in self.fields
+        ]
+        result = tempfile.TemporaryFile()
+        try:
+            if not self.write_file(result, labels, fixed_columns):
+                # records stored before the schemas can have other fields
+                result.close()
+                result = tempfile.TemporaryFile()
+                self.write_file(result, self.find_labels(), fixed_columns)
+        except BaseException:
+            result.close()
+            raise
+        result.seek(0)
+        return result
+
+    def record_fields(self, record):
+        """The (field_id, label, value) of the exported fields of a record"""
+        # old records without the submission order follow the form order
+        fields = self.store.record_fields(record, order=self.form_fields_order)
+        if self.fields is None:
+            return fields
+        return [field for field in fields if field[0] in self.fields]
+
+    def find_labels(self):
+        """The labels of the fields of all the records"""
+        labels = {}
+        for index, item in enumerate(self.get_records()):
+            for k, label, value in self.record_fields(item):
+                labels.setdefault(label, None)
+            self.release(index)
+        return list(labels)
+
+    def write_file(self, result, labels, fixed_columns):
+        """Write the records to the file, compressed if requested"""
+        if self.compression is None:
+            return self.write_rows(self.writer(result), labels, fixed_columns)
+        fd = self.compression(result, self.filename, get_compression_level())
+        try:
+            return self.write_rows(self.writer(fd), labels, fixed_columns)
+        finally:
+            # the result file is left open
+            fd.close()
+
+    def write_rows(self, writer, labels, fixed_columns):
+        """Write the records, with a column for each label and for the fixed
+        columns.
+
+        @return: False if a record has a field without a column
+        """
+        columns = {}
+        for label in labels:
+            if label not in fixed_columns:
+                columns.setdefault(label, len(columns))
+        for column in fixed_columns:
+            columns[column] = len(columns)
+        writer.start(list(columns))
+        for index, item in enumerate(self.get_records()):
+            row = [None] * len(columns)
+            for k, label, value in self.record_fields(item):
+                if label in fixed_columns:
                     continue
-                value = item.attrs.get(k, None)
-                label = fields_labels.get(k, k)
-                if label not in columns and label not in fixed_columns:
-                    columns.append(label)
-                data[label] = json_compatible(value)
+                position = columns.get(label)
+                if position is None:
+                    writer.close()
+                    return False
+                row[position] = value
             for k in fixed_columns:
                 # add fixed columns values
-                value = item.attrs.get(k, None)
-                data[k] = json_compatible(value)
-            rows.append(data)
-        columns.extend(fixed_columns)
-        writer = csv.DictWriter(sbuf, fieldnames=columns, quoting=csv.QUOTE_ALL)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
-        res = sbuf.getvalue()
-        sbuf.close()
-        return res
+                row[columns[k]] = item.attrs.get(k, None)
+            writer.write(row)
+            if self.release(index):
+                writer.flush()
+        writer.close()
+        return True
+
+    def release(self, index):
+        """Every CHUNK_SIZE records, unload the records read from the ZODB"""
+        if (index + 1) % CHUNK_SIZE:
+            return False
+        jar = getattr(self.context, "_p_jar", None)
+        if jar is not None:
+            jar.cacheGC()
+        return True
@@ -0,0 +1,293 @@
+"""
+Writers of the @form-data-export formats.
+
+A writer gets the columns, then a row (a list of values, None for the
+missing fields) for each record, and writes them to a binary file. Rows are
+buffered until flush, called every few records.
+
+The file can be compressed on the fly, with the COMPRESSIONS wrappers.
+"""
+
+from collective.volto.formsupport import logger
+from datetime import date
+from datetime import datetime
+from io import StringIO
+from plone.restapi.serializer.converters import json_compatible
+from xml.sax.saxutils import escape
+
+import csv
+import gzip
+import json
+import math
+import os
+import re
+import zipfile
+
+
+class CSVWriter:
+    extension = "csv"
+    content_type = "text/comma-separated-values"
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer, quoting=csv.QUOTE_ALL)
+
+    def start(self, columns):
+        self.writer.writerow(columns)
+
+    def write(self, row):
+        self.writer.writerow([json_compatible(value) for value in row])
+
+    def flush(self):
+        self.fd.write(self.buffer.getvalue().encode("utf-8"))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        self.flush()
+
+
+class NDJSONWriter:
+    """A JSON object for each record, with the fields that it has"""
+
+    extension = "ndjson"
+    content_type = "application/x-ndjson"
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lines = []
+
+    def start(self, columns):
+        self.columns = columns
+
+    def write(self, row):
+        self.lines.append(
+            json.dumps(
+                {
+                    column: json_compatible(value)
+                    for column, value in zip(self.columns, row)
+                    if value is not None
+                },
+                ensure_ascii=False,
+            )
+        )
+
+    def flush(self):
+        if self.lines:
+            self.lines.append("")
+            self.fd.write("\n".join(self.lines).encode("utf-8"))
+            self.lines = []
+
+    def close(self):
+        self.flush()
+
+
+XLSX_FILES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats'
+        '.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships"><sheets><sheet name="Form data" sheetId="1" r:id="rId1"/>'
+        "</sheets></workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.openxmlformats'
+        '.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/><Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'styles" Target="styles.xml"/></Relationships>'
+    ),
+    # cell styles: 0 default, 1 date and time, 2 date
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+        'main"><numFmts count="1"><numFmt numFmtId="164" '
+        'formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/>'
+        "</border></borders>"
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+        'borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" '
+        'xfId="0"/><xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" '
+        'applyNumberFormat="1"/><xf numFmtId="14" fontId="0" fillId="0" '
+        'borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs></styleSheet>'
+    ),
+}
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    "<sheetData>"
+)
+SHEET_END = "</sheetData></worksheet>"
+EXCEL_EPOCH = datetime(1899, 12, 30)
+# characters that aren't allowed in XML 1.0
+ILLEGAL_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def column_name(index):
+    """The letters of a column (0 is A)"""
+    name = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+class XLSXWriter:
+    """A workbook with one sheet, written as a zip file. The rows are
+    compressed in the sheet entry as they are written, with inline strings
+    instead of a shared strings table, so nothing is kept in memory.
+
+    Numbers and booleans are stored as such, dates as Excel dates.
+    """
+
+    extension = "xlsx"
+    content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    def __init__(self, fd):
+        self.zip = zipfile.ZipFile(fd, "w", compression=zipfile.ZIP_DEFLATED)
+        for name, content in XLSX_FILES.items():
+            self.zip.writestr(name, content)
+        # the size isn't known in advance, and can be more than 2 GiB
+        self.sheet = self.zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self.sheet.write(SHEET_START.encode("utf-8"))
+        self.rows = []
+        self.row_number = 0
+
+    def start(self, columns):
+        self.names = [column_name(index) for index in range(len(columns))]
+        self.write(columns)
+
+    def write(self, row):
+        self.row_number += 1
+        number = self.row_number
+        cells = "".join(
+            self.cell(f"{name}{number}", value)
+            for name, value in zip(self.names, row)
+            if value is not None
+        )
+        self.rows.append(f'<row r="{number}">{cells}</row>')
+
+    @staticmethod
+    def cell(ref, value):
+        if isinstance(value, bool):
+            return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)) and math.isfinite(value):
+            return f'<c r="{ref}"><v>{value!r}</v></c>'
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.astimezone().replace(tzinfo=None)
+            serial = (value - EXCEL_EPOCH).total_seconds() / 86400
+            return f'<c r="{ref}" s="1"><v>{serial!r}</v></c>'
+        if isinstance(value, date):
+            serial = (value - EXCEL_EPOCH.date()).days
+            return f'<c r="{ref}" s="2"><v>{serial}</v></c>'
+        value = json_compatible(value)
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False)
+        value = escape(ILLEGAL_XML.sub("", value))
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{value}</t></is></c>'
+
+    def flush(self):
+        if self.rows:
+            self.sheet.write("".join(self.rows).encode("utf-8"))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.sheet.write(SHEET_END.encode("utf-8"))
+        self.sheet.close()
+        self.zip.close()
+
+
+EXPORT_FORMATS = {
+    "csv": CSVWriter,
+    "ndjson": NDJSONWriter,
+    "xlsx": XLSXWriter,
+}
+
+
+COMPRESSION_LEVEL_ENV = "FORM_DATA_EXPORT_COMPRESSION_LEVEL"
+# the zlib default, close to the size of 9 and much faster
+COMPRESSION_LEVEL = 6
+
+
+def get_compression_level():
+    try:
+        level = int(os.environ.get(COMPRESSION_LEVEL_ENV) or COMPRESSION_LEVEL)
+    except ValueError:
+        level = -1
+    if not 0 <= level <= 9:
+        logger.warning(
+            f"Invalid {COMPRESSION_LEVEL_ENV} value, using {COMPRESSION_LEVEL}"
+        )
+        return COMPRESSION_LEVEL
+    return level
+
+
+class GzipWrapper(gzip.GzipFile):
+    """The file compressed with gzip"""
+
+    extension = "gz"
+    content_type = "application/gzip"
+    # the name of the Content-Encoding, when the client accepts it
+    encoding = "gzip"
+
+    def __init__(self, fd, name, level):
+        super().__init__(filename=name, mode="wb", fileobj=fd, compresslevel=level)
+
+
+class ZipWrapper:
+    """The file as the only entry of a zip archive"""
+
+    extension = "zip"
+    content_type = "application/zip"
+    encoding = None
+
+    def __init__(self, fd, name, level):
+        self.zip = zipfile.ZipFile(
+            fd, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level
+        )
+        # the size isn't known in advance
+        self.entry = self.zip.open(name, "w", force_zip64=True)
+
+    def write(self, data):
+        return self.entry.write(data)
+
+    def close(self):
+        self.entry.close()
+        self.zip.close()
+
+
+COMPRESSIONS = {
+    "gzip": GzipWrapper,
+    "zip": ZipWrapper,
+}
@@ -1,20 +1,27 @@
+from collective.volto.formsupport.datamanager.base import RECORD_ATTRS
 from collective.volto.formsupport.interfaces import IDataAdapter
 from collective.volto.formsupport.interfaces import IFormDataStore
-from collective.volto.formsupport.utils import get_blocks
+from collective.volto.formsupport.utils import get_block_index
 from datetime import datetime
 from datetime import timedelta
 from plone import api
 from plone.memoize import view
+from plone.restapi.batching import DEFAULT_BATCH_SIZE
+from plone.restapi.batching import HypermediaBatch
+from plone.restapi.deserializer import parse_int
 from plone.restapi.interfaces import IExpandableElement
 from plone.restapi.serializer.converters import json_compatible
 from plone.restapi.services import Service
+from zExceptions import BadRequest
 from zope.component import adapter
 from zope.component import getAdapters
 from zope.component import getMultiAdapter
 from zope.interface import implementer
 from zope.interface import Interface
+from ZTUtils.Lazy import LazyMap
 
-import json
+
+SORT_INDEXES = ("date", "block_id")
 
 
 @implementer(IExpandableElement)
@@ -25,33 +32,75 @@ class FormData:
         self.request = request
         self.block_id = block_id or self.request.get("block_id")
 
+    @property
+    @view.memoize
+    def expire_date(self):
+        remove_data_after_days = int(self.form_block.get("remove_data_after_days") or 0)
+        if remove_data_after_days > 0:
+            return datetime.now() - timedelta(days=remove_data_after_days)
+        return None
+
+    def get_sort(self):
+        sort_on = self.request.form.get("sort_on") or "date"
+        if sort_on not in SORT_INDEXES:
+            raise BadRequest(
+                "Invalid sort_on: {}, use one of {}".format(
+                    sort_on, ", ".join(SORT_INDEXES)
+                )
+            )
+        sort_order = self.request.form.get("sort_order") or "descending"
+        return sort_on, sort_order not in ("ascending", "asc")
+
+    @property
+    @view.memoize
+    def store(self):
+        return getMultiAdapter((self.context, self.request), IFormDataStore)
+
+    @view.memoize
+    def get_records(self, limit=None):
+        """The stored records of the form, as a lazy sequence"""
+        if not self.form_block:
+            return []
+        sort_on, reverse = self.get_sort()
+        return self.store.search(
+            block_id=self.block_id,
+            sort_on=sort_on,
+            reverse=reverse,
+            limit=limit,
+            lazy=True,
+        )
+
+    @view.memoize
+    def get_expired_records(self):
+        expire_date = self.expire_date
+        if not self.form_block or not expire_date:
+            return []
+        return self.store.search(block_id=self.block_id, date_to=expire_date, lazy=True)
+
+    def items_total(self):
+        if not self.form_block:
+            return 0
+        return self.store.length(block_id=self.block_id)
+
+    def expired_total(self):
+        expire_date = self.expire_date
+        if not self.form_block or not expire_date:
+            return 0
+        return self.store.count(block_id=self.block_id, date_to=expire_date)
+
+    def expand_item(self, record):
+        expanded = self.expand_records(record)
+        expire_date = self.expire_date
+        expanded["__expired"] = expire_date and record.attrs["date"] < expire_date
+        return expanded
+
     @view.memoize
     def get_items(self):
-        block = self.form_block
-        items = []
-        if block:
-            store = getMultiAdapter((self.context, self.request), IFormDataStore)
-            remove_data_after_days = int(block.get("remove_data_after_days") or 0)
-            data = store.search()
-
-            if remove_data_after_days > 0:
-                expire_date = datetime.now() - timedelta(days=remove_data_after_days)
-            else:
-                expire_date = None
-            for record in data:
-                if not self.block_id or record.attrs.get("block_id") == self.block_id:
-                    expanded = self.expand_records(record)
-                    expanded["__expired"] = (
-                        expire_date and record.attrs["date"] < expire_date
-                    )
-                    items.append(expanded)
-        else:
-            items = []
-        return items
+        return [self.expand_item(record) for record in self.get_records()]
 
     @view.memoize
     def get_expired_items(self):
-        return [item for item in self.get_items() if item["__expired"]]
+        return [self.expand_item(record) for record in self.get_expired_records()]
 
     def __call__(self, expand=False):
         if not self.show_component():
@@ -65,14 +114,24 @@ class FormData:
         result = {"form_data": {"@id": service_id}}
         if not expand:
             return result
-        items = self.get_items()
-        expired_total = len(self.get_expired_items())
+        items_total = self.items_total()
         result["form_data"] = {
             "@id": f"{self.context.absolute_url()}/@form-data",
-            "items": items,
-            "items_total": len(items),
-            "expired_total": expired_total,
+            "items_total": items_total,
+            "expired_total": self.expired_total(),
         }
+        if "b_start" in self.request.form or "b_size" in self.request.form:
+            # load only the records up to the end of the requested batch
+            b_start = parse_int(self.request.form, "b_start", 0)
+            b_size = parse_int(self.request.form, "b_size", DEFAULT_BATCH_SIZE)
+            records = self.get_records(limit=max(b_start + b_size, 1))
+            items = LazyMap(self.expand_item, records, length=items_total)
+            batch = HypermediaBatch(self.request, items)
+            result["form_data"]["items"] = list(batch)
+            if batch.links:
+                result["form_data"]["batching"] = batch.links
+        else:
+            result["form_data"]["items"] = self.get_items()
         adapters = getAdapters((self.context, self.request), provided=IDataAdapter)
         for _, adpt in adapters:
             result = adpt(result, block_id=self.block_id)
@@ -81,13 +140,8 @@ class FormData:
     @property
     @view.memoize
     def form_block(self):
-        blocks = get_blocks(self.context)
-        if isinstance(blocks, str):
-            blocks = json.loads(blocks)
-        if not blocks:
-            return {}
-        for id, block in blocks.items():
-            if block.get("@type", "") == "form" and block.get("store", False):
+        for id, block in get_block_index(self.context).find_form_blocks():
+            if block.get("store", False):
                 if not self.block_id or self.block_id == id:
                     return block
         return {}
@@ -98,15 +152,12 @@ class FormData:
         return self.form_block and True or False
 
     def expand_records(self, record):
-        fields_labels = record.attrs.get("fields_labels", {})
         data = {}
-        for k, v in record.attrs.items():
-            if k in ["fields_labels", "fields_order"]:
-                continue
-            data[k] = {
-                "value": json_compatible(v),
-                "label": fields_labels.get(k, k),
-            }
+        for field_id, label, value in self.store.record_fields(record):
+            data[field_id] = {"value": json_compatible(value), "label": label}
+        for k in RECORD_ATTRS:
+            if k in record.attrs:
+                data[k] = {"value": json_compatible(record.attrs[k]), "label": k}
         data["id"] = record.intid
         return data
 
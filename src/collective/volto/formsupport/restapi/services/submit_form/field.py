@@ -49,6 +49,8 @@ class Field:
         _attribute("use_as_reply_bcc")
         self.required = field_data.get("required")
         self.validations = field_data.get("validations", {})
+        # validation utilities already resolved by the FormSchema, if any
+        self._validators = field_data.get("validators")
         self._display_value_mapping = field_data.get("dislpay_value_mapping")
         self._value = field_data.get("value", "")
         self._custom_field_id = field_data.get("custom_field_id")
@@ -97,11 +99,13 @@ class Field:
         if self.required and not self.internal_value:
             errors['required'] = 'This field is required'
 
-        available_validations = [
-            validation
-            for validationId, validation in getValidations()
-            if validationId in self.validations.keys()
-        ]
+        available_validations = self._validators
+        if available_validations is None:
+            available_validations = [
+                validation
+                for validationId, validation in getValidations()
+                if validationId in self.validations.keys()
+            ]
         for validation in available_validations:
             error = validation(self._value, **self.validations.get(validation._name))
             if error:
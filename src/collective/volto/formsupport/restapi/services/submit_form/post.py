@@ -1,4 +1,3 @@
-from bs4 import BeautifulSoup
 from datetime import datetime
 from email import policy
 from email.message import EmailMessage
@@ -8,8 +7,6 @@ from plone import api
 import codecs
 import logging
 import os
-import re
-
 
 
 try:
@@ -22,7 +19,12 @@ from collective.volto.formsupport.events import FormSubmittedEvent
 from collective.volto.formsupport.interfaces import IFormDataStore
 from collective.volto.formsupport.interfaces import IPostAdapter
 from collective.volto.formsupport.interfaces import IPostEvent
-from collective.volto.formsupport.utils import get_blocks
+from collective.volto.formsupport.mail.pool import MailSession
+from collective.volto.formsupport.mail.spool import get_mail_spool
+from collective.volto.formsupport.mail.spool import start_worker
+from collective.volto.formsupport.schema import get_field_template
+from collective.volto.formsupport.submission import get_submission_context
+from collective.volto.formsupport.utils import render_mail_fragment
 from plone.protect.interfaces import IDisableCSRFProtection
 from plone.registry.interfaces import IRegistry
 from plone.restapi.services import Service
@@ -89,6 +91,8 @@ class SubmitPost(Service):
                 )
                 self.request.response.setStatus(500)
                 return dict(type="InternalServerError", message=message)
+            finally:
+                self.close_mail_session()
 
         notify(FormSubmittedEvent(self.context, self.block, self.form_data))
 
@@ -112,39 +116,23 @@ class SubmitPost(Service):
         3. We use the fallback field: "default_from"
         """
 
-        subblocks = self.block.get("subblocks", "")
-        if subblocks:
-            for field in subblocks:
-                if field.get("use_as_reply_to", False):
-                    field_id = field.get("field_id", "")
-                    if field_id:
-                        for data in self.form_data.get("data", ""):
-                            if data.get("field_id", "") == field_id:
-                                return data.get("value", "")
+        for field_id in self.schema.reply_to_fields:
+            for data in self.form_data.get("data", ""):
+                if data.get("field_id", "") == field_id:
+                    return data.get("value", "")
 
         return self.form_data.get("from", "") or self.block.get("default_from", "")
 
     def get_block_data(self, block_id):
-        blocks = get_blocks(self.context)
-        if not blocks:
-            return {}
-        for id, block in blocks.items():
-            if id != block_id:
-                continue
-            block_type = block.get("@type", "")
-            if block_type != "form":
-                continue
-            return block
-        return {}
+        return get_submission_context(self.context, self.request).form_block(block_id)
+
+    @property
+    def schema(self):
+        """The compiled FormSchema of the block"""
+        return get_submission_context(self.context, self.request).schema(self.block)
 
     def get_bcc(self):
-        bcc = []
-        bcc_fields = []
-        for field in self.block.get("subblocks", []):
-            if field.get("use_as_bcc", False):
-                field_id = field.get("field_id", "")
-                if field_id not in bcc_fields:
-                    bcc_fields.append(field_id)
+        bcc_fields = self.schema.bcc_fields
         bcc = []
         for data in self.form_data.get("data", []):
             value = data.get("value", "")
@@ -155,33 +143,20 @@ class SubmitPost(Service):
         return bcc
 
     def get_acknowledgement_field_value(self):
-        acknowledgementField = self.block["acknowledgementFields"]
-        for field in self.block.get("subblocks", []):
-            if field.get("field_id") == acknowledgementField:
-                for data in self.form_data.get("data", []):
-                    if data.get("field_id", "") == field.get("field_id"):
-                        return data.get("value")
+        acknowledgementField = self.schema.acknowledgement_field
+        if not acknowledgementField:
+            return
+        for data in self.form_data.get("data", []):
+            if data.get("field_id", "") == acknowledgementField:
+                return data.get("value")
 
     def get_subject(self):
-        subject = self.form_data.get("subject", "") or self.block.get(
-            "default_subject", ""
-        )
-
-        for i in self.form_data.get("data", []):
-            field_id = i.get("field_id")
-
-            if not field_id:
-                continue
-
-            # Handle this kind of id format: `field_name_123321, whichj is used by frontend package logics
-            pattern = r"\$\{[^}]+\}"
-            matches = re.findall(pattern, subject)
-
-            for match in matches:
-                if field_id in match:
-                    subject = subject.replace(match, str(i.get("value")))
-
-        return subject
+        subject = self.form_data.get("subject", "")
+        if subject:
+            template = get_field_template(subject)
+        else:
+            template = self.schema.subject_template
+        return template.render(self.form_data.get("data", []))
 
     def send_data(self):
         subject = self.get_subject()
@@ -274,10 +249,6 @@ class SubmitPost(Service):
         mail_header = self.block.get("mail_header", {}).get("data", "")
         mail_footer = self.block.get("mail_footer", {}).get("data", "")
 
-        # Check if there is content
-        bs_mail_header = BeautifulSoup(mail_header)
-        bs_mail_footer = BeautifulSoup(mail_footer)
-
         portal = getMultiAdapter(
             (self.context, self.request), name="plone_portal_state"
         ).portal()
@@ -285,17 +256,11 @@ class SubmitPost(Service):
         frontend_domain = api.portal.get_registry_record(
             name="volto.frontend_domain", default=""
         )
+        base_url = frontend_domain or portal.absolute_url()
 
-        for snippet in [bs_mail_header, bs_mail_footer]:
-            if snippet:
-                for link in snippet.find_all("a"):
-                    if link.get("href", "").startswith("/"):
-                        link["href"] = (
-                            frontend_domain or portal.absolute_url()
-                        ) + link["href"]
-
-        mail_header = bs_mail_header.get_text() and bs_mail_header.prettify() or None
-        mail_footer = bs_mail_footer.get_text() and bs_mail_footer.prettify() or None
+        # links are made absolute and the html prettified only once
+        mail_header = render_mail_fragment(mail_header, base_url)
+        mail_footer = render_mail_fragment(mail_footer, base_url)
 
         email_format_page_template_mapping = {
             "list": "send_mail_template",
@@ -322,9 +287,29 @@ class SubmitPost(Service):
 
     def send_mail(self, msg, charset):
         host = api.portal.get_tool(name="MailHost")
-        # we set immediate=True because we need to catch exceptions.
-        # by default (False) exceptions are handled by MailHost and we can't catch them.
-        host.send(msg, charset=charset, immediate=True)
+        spool = get_mail_spool()
+        if spool is not None:
+            # queued delivery: the message is sent after the commit by the spool
+            # worker, that retries it on errors.
+            spool.enqueue_message(msg, charset=charset)
+            start_worker(spool, host)
+            return
+        # the session sends immediately (like host.send with immediate=True)
+        # because we need to catch exceptions, reusing one SMTP connection for
+        # all the mails of this submission.
+        self.get_mail_session(host).send(msg, charset=charset)
+
+    def get_mail_session(self, host):
+        session = getattr(self, "_mail_session", None)
+        if session is None:
+            session = self._mail_session = MailSession(host)
+        return session
+
+    def close_mail_session(self):
+        session = getattr(self, "_mail_session", None)
+        if session is not None:
+            self._mail_session = None
+            session.close()
 
     def manage_attachments(self, msg):
         attachments = self.form_data.get("attachments", {})
@@ -0,0 +1,257 @@
+from collections import deque
+from collective.volto.formsupport.validation import IFieldValidator
+from copy import deepcopy
+from functools import lru_cache
+from plone.memoize import ram
+from zope.component import queryUtility
+
+import hashlib
+import json
+import re
+
+
+PLACEHOLDER_RE = re.compile(r"\$\{[^}]+\}")
+
+
+class FieldTemplate:
+    """A text with ``${field_id}`` placeholders, parsed once in a list of
+    literal strings and placeholders.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        parts = []
+        placeholders = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            if match.start() > position:
+                parts.append((False, text[position : match.start()]))
+            parts.append((True, match.group()))
+            placeholders.append(match.group())
+            position = match.end()
+        if position < len(text):
+            parts.append((False, text[position:]))
+        self.parts = tuple(parts)
+        self.placeholders = tuple(placeholders)
+
+    @staticmethod
+    def resolve(placeholder, field_ids):
+        """Return the field id a placeholder refers to, or None.
+
+        ``${field_id}`` is the exact id; otherwise the first id contained in
+        the placeholder is used, as in ``${field_name_123321}`` generated
+        by the frontend.
+        """
+        if placeholder[2:-1] in field_ids:
+            return placeholder[2:-1]
+        for field_id in field_ids:
+            if field_id in placeholder:
+                return field_id
+        return None
+
+    def render(self, data):
+        """Fill the placeholders with the values of the submitted fields"""
+        if not self.placeholders:
+            return self.text
+        values = {}
+        for field in data:
+            field_id = field.get("field_id")
+            if field_id and field_id not in values:
+                values[field_id] = field.get("value")
+        result = []
+        for is_placeholder, text in self.parts:
+            if is_placeholder:
+                field_id = self.resolve(text, values)
+                if field_id is not None:
+                    text = str(values[field_id])
+            result.append(text)
+        return "".join(result)
+
+
+@lru_cache(maxsize=256)
+def get_field_template(text):
+    return FieldTemplate(text or "")
+
+
+def sort_show_when(conditions):
+    """Sort the fields with a show_when condition so that each field comes
+    after the field that controls it.
+
+    @param conditions: {field_id: controlling field_id}
+    @return: a tuple with the sorted field ids and the ids of the fields in
+        a cycle (that can't be sorted)
+    """
+    dependants = {}
+    pending = {}
+    for field_id, target_id in conditions.items():
+        if target_id in conditions:
+            dependants.setdefault(target_id, []).append(field_id)
+            pending[field_id] = 1
+        else:
+            pending[field_id] = 0
+    queue = deque(field_id for field_id, count in pending.items() if not count)
+    order = []
+    while queue:
+        field_id = queue.popleft()
+        order.append(field_id)
+        for dependant in dependants.get(field_id, []):
+            pending[dependant] -= 1
+            if not pending[dependant]:
+                queue.append(dependant)
+    cycles = tuple(field_id for field_id, count in pending.items() if count)
+    return tuple(order), cycles
+
+
+class FormSchema:
+    """Compiled view of the ``subblocks`` of a form block.
+
+    Built once per block revision (see get_form_schema), so the submission
+    code paths don't need to scan the subblocks for each field.
+    Values returned here are shared: never change them in place.
+    """
+
+    def __init__(self, block):
+        self.fields = {}  # field_id -> field spec
+        self.validations = {}  # field_id -> {validation_id: {setting_id: value}}
+        self.validators = {}  # field_id -> [validation utilities]
+        self.custom_field_ids = {}  # field_id -> custom_field_id
+        self.labels = {}  # stored field id (custom or not) -> label
+        bcc_fields = []
+        reply_to_fields = []
+        # field_id -> (controlling field_id, show_when_is, show_when_to)
+        self.show_when = {}
+
+        # the schema is cached and shared between requests: keep its own copy
+        block = deepcopy(block)
+        for field in block.get("subblocks", []) or []:
+            field_id = field.get("field_id", "")
+            if field_id in self.fields:
+                continue
+            self.fields[field_id] = field
+            validations = self._compile_validations(field)
+            self.validations[field_id] = validations
+            self.validators[field_id] = [
+                validator
+                for validator in (
+                    queryUtility(IFieldValidator, name=validation_id)
+                    for validation_id in validations
+                )
+                if validator is not None
+            ]
+            custom_field_id = block.get(field_id)
+            if custom_field_id:
+                self.custom_field_ids[field_id] = custom_field_id
+            stored_id = custom_field_id or field_id
+            self.labels[stored_id] = field.get("label", stored_id)
+            if field.get("use_as_bcc", False):
+                bcc_fields.append(field_id)
+            if field.get("use_as_reply_to", False) and field_id:
+                reply_to_fields.append(field_id)
+            show_when = field.get("show_when_when")
+            if show_when and show_when != "always":
+                self.show_when[field_id] = (
+                    show_when,
+                    field.get("show_when_is"),
+                    field.get("show_when_to"),
+                )
+
+        self.field_ids = tuple(self.fields)
+        self.subject_template = get_field_template(block.get("default_subject", ""))
+        self.show_when_order, self.show_when_cycles = sort_show_when(
+            {field_id: target[0] for field_id, target in self.show_when.items()}
+        )
+        self.bcc_fields = frozenset(bcc_fields)
+        self.reply_to_fields = tuple(reply_to_fields)
+        ack_field = block.get("acknowledgementFields")
+        self.acknowledgement_field = ack_field if ack_field in self.fields else None
+        self._accepted_ids = frozenset(self.fields) | frozenset(
+            self.custom_field_ids.values()
+        )
+
+    @staticmethod
+    def _compile_validations(field):
+        """Convert the validationSettings ("<validation>-<setting>": value) of
+        the enabled validations to {validation_id: {setting_id: value}}
+        """
+        validation_ids_to_apply = field.get("validations", [])
+        validations = {}
+        for validation_and_setting_id, setting_value in field.get(
+            "validationSettings", {}
+        ).items():
+            split_validation_and_setting_ids = validation_and_setting_id.split("-")
+            if len(split_validation_and_setting_ids) < 2:
+                continue
+            validation_id, setting_id = split_validation_and_setting_ids
+            if validation_id not in validation_ids_to_apply:
+                continue
+            validations.setdefault(validation_id, {})[setting_id] = setting_value
+        return validations
+
+    def __contains__(self, field_id):
+        return field_id in self.fields
+
+    def accepts(self, field_id):
+        """True if a submitted field with this id (or custom id) is in the form"""
+        return field_id in self._accepted_ids
+
+    def get(self, field_id, default=None):
+        return self.fields.get(field_id, default)
+
+    def hidden_fields(self, fields):
+        """Evaluate the show_when conditions for the submitted fields, in
+        dependency order.
+
+        A field is hidden if its condition is false or if the field that
+        controls it is hidden. Fields controlled by a field that was not
+        submitted are shown.
+
+        @param fields: the Field objects of the submission
+        @return: the set of the hidden field ids
+        """
+        by_id = {}
+        for field in fields:
+            by_id.setdefault(field.id, field)
+        hidden = set()
+        for field_id in self.show_when_order:
+            if self._is_hidden(field_id, by_id, hidden):
+                hidden.add(field_id)
+        # fields in a cycle (refused when the form is saved) only check
+        # their own condition
+        hidden.update(
+            field_id
+            for field_id in self.show_when_cycles
+            if self._is_hidden(field_id, by_id, ())
+        )
+        return hidden
+
+    def _is_hidden(self, field_id, fields, hidden):
+        target_id, show_when_is, show_when_to = self.show_when[field_id]
+        target = fields.get(target_id)
+        if target is None:
+            return False
+        return target_id in hidden or not target.should_show(
+            show_when_is=show_when_is, target_value=show_when_to
+        )
+
+    def form_fields(self):
+        """The field specs, with the ``custom_field_id`` that is not stored
+        in each subblock.
+        """
+        result = []
+        for field_id, field in self.fields.items():
+            if field_id in self.custom_field_ids:
+                field = {**field, "custom_field_id": self.custom_field_ids[field_id]}
+            result.append(field)
+        return result
+
+
+def _form_schema_cachekey(method, block):
+    return hashlib.sha1(
+        json.dumps(block, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+@ram.cache(_form_schema_cachekey)
+def get_form_schema(block):
+    """Return the FormSchema of a form block, cached by block content"""
+    return FormSchema(block or {})
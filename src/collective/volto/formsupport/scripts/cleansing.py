@@ -1,5 +1,6 @@
 from collective.volto.formsupport.interfaces import IFormDataStore
-from collective.volto.formsupport.restapi.services.form_data.form_data import FormData
+from datetime import datetime
+from datetime import timedelta
 from plone import api
 from zope.component import getMultiAdapter
 from zope.globalrequest import getRequest
@@ -51,12 +52,9 @@ def main(dryrun):
                         f"SKIP record cleanup from {brain.getPath()} block: {block_id}"
                     )
                     continue
-                data = FormData(obj, request, block_id)
+                expire_date = datetime.now() - timedelta(days=remove_data_after_days)
                 store = getMultiAdapter((obj, request), IFormDataStore)
-                deleted = 0
-                for item in data.get_expired_items():
-                    store.delete(item["id"])
-                    deleted += 1
+                deleted = store.delete_query(block_id=block_id, date_to=expire_date)
                 if deleted:
                     print(
                         f"[INFO] removed {deleted} records from {brain.getPath()} block: {block_id}"
@@ -0,0 +1,45 @@
+from collective.volto.formsupport.mail.pool import make_mailer
+from collective.volto.formsupport.mail.spool import get_mail_spool
+from collective.volto.formsupport.mail.spool import QUEUE_DIRECTORY_ENV
+from plone import api
+
+import click
+import sys
+import time
+
+
+@click.command(
+    help="bin/instance -OPlone run bin/formsupport_mail_queue [--loop] [--interval 30]",
+    context_settings=dict(
+        ignore_unknown_options=True,
+        allow_extra_args=True,
+    ),
+)
+@click.option(
+    "--loop/--no-loop",
+    is_flag=True,
+    default=False,
+    help="--no-loop (default) deliver the queue once, --loop keep delivering it",
+)
+@click.option(
+    "--interval",
+    default=30,
+    help="seconds between two deliveries with --loop",
+)
+def main(loop, interval):
+    spool = get_mail_spool()
+    if spool is None:
+        print(f"[ERROR] {QUEUE_DIRECTORY_ENV} is not set")
+        return 1
+    mailer = make_mailer(api.portal.get_tool(name="MailHost"))
+    spool.recover()
+    while True:
+        sent, deferred, failed = spool.process(mailer)
+        print(f"[INFO] sent: {sent}, deferred: {deferred}, failed: {failed}")
+        if not loop:
+            return 0
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.utils import get_block_index
+from plone import api
+from zope.component import getMultiAdapter
+from zope.globalrequest import getRequest
+
+import click
+import sys
+import time
+import transaction
+
+
+def merge_pending(request):
+    catalog = api.portal.get_tool("portal_catalog")
+    root_path = "/".join(api.portal.get().getPhysicalPath())
+    if "block_types" in catalog.indexes():
+        brains = catalog.unrestrictedSearchResults(block_types="form", path=root_path)
+    else:
+        brains = catalog.unrestrictedSearchResults(path=root_path)
+    merged = 0
+    for brain in brains:
+        obj = brain.getObject()
+        if not get_block_index(obj).find_form_blocks(store=True):
+            continue
+        store = getMultiAdapter((obj, request), IFormDataStore)
+        count = store.merge_pending()
+        if count:
+            print(f"[INFO] indexed {count} records in {brain.getPath()}")
+            transaction.commit()
+            merged += count
+    return merged
+
+
+@click.command(
+    help="bin/instance -OPlone run bin/formsupport_data_merge [--loop] [--interval 60]",
+    context_settings=dict(
+        ignore_unknown_options=True,
+        allow_extra_args=True,
+    ),
+)
+@click.option(
+    "--loop/--no-loop",
+    is_flag=True,
+    default=False,
+    help="--no-loop (default) index the pending records once, --loop keep indexing",
+)
+@click.option(
+    "--interval",
+    default=60,
+    help="seconds between two runs with --loop",
+)
+def main(loop, interval):
+    request = getRequest()
+    while True:
+        merged = merge_pending(request)
+        print(f"[INFO] indexed: {merged}")
+        if not loop:
+            return 0
+        time.sleep(interval)
+        transaction.begin()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
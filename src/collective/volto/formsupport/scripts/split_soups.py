@@ -0,0 +1,54 @@
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.utils import get_block_index
+from plone import api
+from zope.component import getMultiAdapter
+from zope.globalrequest import getRequest
+
+import click
+import sys
+import transaction
+
+
+@click.command(
+    help="bin/instance -OPlone run bin/formsupport_data_split [--dryrun|--no-dryrun]",
+    context_settings=dict(
+        ignore_unknown_options=True,
+        allow_extra_args=True,
+    ),
+)
+@click.option(
+    "--dryrun/--no-dryrun",
+    is_flag=True,
+    default=True,
+    help="--dryrun (default) simulate, --no-dryrun actually save the changes",
+)
+def main(dryrun):
+    if dryrun:
+        print("CHECK ONLY")
+    catalog = api.portal.get_tool("portal_catalog")
+    root_path = "/".join(api.portal.get().getPhysicalPath())
+    request = getRequest()
+    if "block_types" in catalog.indexes():
+        brains = catalog.unrestrictedSearchResults(block_types="form", path=root_path)
+    else:
+        print("[WARN] This script is optimized for plone.volto >= 4.1.0")
+        brains = catalog.unrestrictedSearchResults(path=root_path)
+    for brain in brains:
+        obj = brain.getObject()
+        if not get_block_index(obj).find_form_blocks(store=True):
+            continue
+        store = getMultiAdapter((obj, request), IFormDataStore)
+        moved = store.split_soup()
+        if moved:
+            print(
+                f"[INFO] moved {moved} records from {brain.getPath()} in a soup per block"
+                " (or partition)"
+            )
+        if not dryrun:
+            transaction.commit()
+    if not dryrun:
+        print("COMMIT")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
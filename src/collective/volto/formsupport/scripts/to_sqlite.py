@@ -0,0 +1,65 @@
+from collective.volto.formsupport.datamanager.catalog import FormDataStore
+from collective.volto.formsupport.datamanager.sqlite import get_sqlite_path
+from collective.volto.formsupport.datamanager.sqlite import SQLITE_PATH_ENV
+from collective.volto.formsupport.datamanager.sqlite import SQLiteFormDataStore
+from collective.volto.formsupport.utils import get_block_index
+from plone import api
+from zope.globalrequest import getRequest
+
+import click
+import sys
+import transaction
+
+
+# records copied in each transaction
+BATCH_SIZE = 1000
+
+
+@click.command(
+    help="bin/instance -OPlone run bin/formsupport_data_to_sqlite [--dryrun|--no-dryrun]",
+    context_settings=dict(
+        ignore_unknown_options=True,
+        allow_extra_args=True,
+    ),
+)
+@click.option(
+    "--dryrun/--no-dryrun",
+    is_flag=True,
+    default=True,
+    help="--dryrun (default) simulate, --no-dryrun actually save the changes",
+)
+def main(dryrun):
+    if not get_sqlite_path():
+        print(f"[ERROR] {SQLITE_PATH_ENV} is not set")
+        return 1
+    if dryrun:
+        print("CHECK ONLY")
+    catalog = api.portal.get_tool("portal_catalog")
+    root_path = "/".join(api.portal.get().getPhysicalPath())
+    request = getRequest()
+    if "block_types" in catalog.indexes():
+        brains = catalog.unrestrictedSearchResults(block_types="form", path=root_path)
+    else:
+        print("[WARN] This script is optimized for plone.volto >= 4.1.0")
+        brains = catalog.unrestrictedSearchResults(path=root_path)
+    for brain in brains:
+        obj = brain.getObject()
+        if not get_block_index(obj).find_form_blocks(store=True):
+            continue
+        source = FormDataStore(obj, request)
+        if not source.length():
+            continue
+        copied = SQLiteFormDataStore(obj, request).import_records(
+            source, batch_size=None if dryrun else BATCH_SIZE
+        )
+        print(f"[INFO] copied {copied} records from {brain.getPath()}")
+        if dryrun:
+            transaction.abort()
+        else:
+            transaction.commit()
+    if not dryrun:
+        print("COMMIT")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+from collective.volto.formsupport.schema import get_form_schema
+from collective.volto.formsupport.utils import get_block_index
+from plone import api
+from plone.restapi.deserializer import json_body
+from zope.annotation.interfaces import IAnnotations
+
+
+GLOBAL_FORM_REGISTRY_RECORD_ID = (
+    "collective.volto.formsupport.interfaces.IGlobalFormStore.global_forms_config"
+)
+ANNOTATION_KEY = "collective.volto.formsupport.submission"
+
+
+class SubmissionContext:
+    """Request-scoped view of a form submission.
+
+    The request body is parsed only once and the form blocks are resolved only
+    once per request, so the post adapter, the service, the store and the
+    captcha adapters can share the same data.
+    Values returned here are shared: never change them in place.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        self._data = None
+        self._blocks = {}
+
+    @property
+    def data(self):
+        """The parsed json body"""
+        if self._data is None:
+            self._data = json_body(self.request)
+        return self._data
+
+    @property
+    def block_id(self):
+        return self.data.get("block_id", "")
+
+    @property
+    def global_form_id(self):
+        return self.data.get("global_form_id", "")
+
+    @property
+    def block(self):
+        """The form block the submission refers to"""
+        return self.resolve_block(
+            block_id=self.block_id, global_form_id=self.data.get("global_form_id")
+        )
+
+    def resolve_block(self, block_id, global_form_id):
+        """Return the form block with the given id, also looking into the
+        global forms.
+        """
+        key = ("resolve", block_id, global_form_id)
+        if key not in self._blocks:
+            self._blocks[key] = self._resolve_block(block_id, global_form_id)
+        return self._blocks[key]
+
+    def form_block(self, block_id):
+        """Return the form block with the given id stored in the context"""
+        key = ("local", block_id)
+        if key not in self._blocks:
+            self._blocks[key] = get_block_index(self.context).get_form_block(block_id)
+        return self._blocks[key]
+
+    def schema(self, block):
+        """Return the FormSchema of a block returned by the methods above"""
+        key = ("schema", id(block))
+        if key not in self._blocks:
+            # keep a reference to the block, so its id is not reused
+            self._blocks[key] = (block, get_form_schema(block))
+        return self._blocks[key][1]
+
+    def _resolve_block(self, block_id, global_form_id):
+        # Prefer local forms it they're available, fall back to global form.
+        # Only the matching block is copied from the index.
+        index = get_block_index(self.context)
+        for id in (block_id, global_form_id):
+            block = index.get_form_block(id) if id else {}
+            if block:
+                return block
+        if not global_form_id:
+            return {}
+        for id, block in index.find_form_blocks(global_form_id=global_form_id):
+            return block
+        global_forms = (
+            api.portal.get_registry_record(GLOBAL_FORM_REGISTRY_RECORD_ID) or {}
+        )
+        for id, block in global_forms.items():
+            if (
+                id != block_id
+                and id != global_form_id
+                and block.get("global_form_id") != global_form_id
+            ):
+                continue
+            if block.get("@type", "") == "form":
+                return block
+        return {}
+
+
+def get_submission_context(context, request):
+    """Return the SubmissionContext for this context, stored on the request"""
+    contexts = IAnnotations(request).setdefault(ANNOTATION_KEY, {})
+    key = "/".join(context.getPhysicalPath())
+    if key not in contexts:
+        contexts[key] = SubmissionContext(context, request)
+    return contexts[key]
@@ -12,6 +12,8 @@ import collective.MockMailHost
 import collective.volto.formsupport
 import collective.volto.otp
 import plone.restapi
+import socketserver
+import threading
 
 
 class VoltoFormsupportLayer(PloneSandboxLayer):
@@ -83,3 +85,77 @@ VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING = FunctionalTesting(
     bases=(VOLTO_FORMSUPPORT_API_FIXTURE, z2.ZSERVER_FIXTURE),
     name="VoltoFormsupportRestApiLayer:Functional",
 )
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 localhost ESMTP test server")
+        mfrom, mto = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ")[0].upper()
+            if verb == "EHLO":
+                self.reply("250 localhost")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                if server.fail_with:
+                    self.reply(server.fail_with)
+                    continue
+                mfrom, mto = command[10:].strip("<>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                mto.append(command[8:].strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                for line in self.rfile:
+                    if line == b".\r\n":
+                        break
+                    data.append(line)
+                server.messages.append((mfrom, mto, b"".join(data)))
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """A SMTP stand-in that collects the delivered messages.
+
+    Set ``fail_with`` to a SMTP reply (i.e. "451 Try again later") to refuse
+    the messages.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.fail_with = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -67,3 +67,155 @@ class TestBlockDeserialization(unittest.TestCase):
             self.document.blocks["form-id"]["send_message"],
             "<b>click here</b><p><i>keep tags</i></p>",
         )
+
+    def test_deserializer_refuses_circular_show_when(self):
+        new_blocks = deepcopy(self.document.blocks)
+        new_blocks["form-id"]["subblocks"] = [
+            {
+                "field_id": "name",
+                "label": "Name",
+                "field_type": "text",
+                "show_when_when": "surname",
+                "show_when_is": "value_is",
+                "show_when_to": "John",
+            },
+            {
+                "field_id": "surname",
+                "label": "Surname",
+                "field_type": "text",
+                "show_when_when": "name",
+                "show_when_is": "value_is",
+                "show_when_to": "Doe",
+            },
+        ]
+        response = self.api_session.patch(
+            self.document_url,
+            json={"blocks": new_blocks},
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Circular show_when", response.text)
+        self.assertNotIn(
+            "show_when_when", self.document.blocks["form-id"]["subblocks"][0]
+        )
+
+    def test_deserializer_keeps_stored_circular_show_when(self):
+        subblocks = [
+            {
+                "field_id": "name",
+                "label": "Name",
+                "field_type": "text",
+                "show_when_when": "surname",
+                "show_when_is": "value_is",
+                "show_when_to": "John",
+            },
+            {
+                "field_id": "surname",
+                "label": "Surname",
+                "field_type": "text",
+                "show_when_when": "name",
+                "show_when_is": "value_is",
+                "show_when_to": "Doe",
+            },
+        ]
+        # saved before the conditions were checked
+        self.document.blocks["form-id"]["subblocks"] = deepcopy(subblocks)
+        self.document.blocks = deepcopy(self.document.blocks)
+        transaction.commit()
+        new_blocks = deepcopy(self.document.blocks)
+        new_blocks["form-id"]["title"] = "Contact us"
+
+        with self.assertLogs("collective.volto.formsupport", "WARNING") as logs:
+            response = self.api_session.patch(
+                self.document_url,
+                json={"blocks": new_blocks},
+            )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 204)
+        self.assertIn("name, surname", logs.output[0])
+        self.assertEqual(self.document.blocks["form-id"]["title"], "Contact us")
+
+        new_blocks["form-id"]["subblocks"].append(
+            {
+                "field_id": "message",
+                "label": "Message",
+                "field_type": "text",
+                "show_when_when": "email",
+                "show_when_is": "value_is",
+                "show_when_to": "",
+            }
+        )
+        new_blocks["form-id"]["subblocks"].append(
+            {
+                "field_id": "email",
+                "label": "Email",
+                "field_type": "text",
+                "show_when_when": "message",
+                "show_when_is": "value_is",
+                "show_when_to": "",
+            }
+        )
+        response = self.api_session.patch(
+            self.document_url,
+            json={"blocks": new_blocks},
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Circular show_when", response.text)
+
+    def test_deserializer_refuses_unknown_subject_placeholders(self):
+        new_blocks = deepcopy(self.document.blocks)
+        new_blocks["form-id"]["default_subject"] = "From ${name} ${unknown}"
+        response = self.api_session.patch(
+            self.document_url,
+            json={"blocks": new_blocks},
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown fields in the subject: ${unknown}", response.text)
+
+        new_blocks["form-id"]["default_subject"] = "From ${name} ${surname}"
+        response = self.api_session.patch(
+            self.document_url,
+            json={"blocks": new_blocks},
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            self.document.blocks["form-id"]["default_subject"],
+            "From ${name} ${surname}",
+        )
+
+    def test_deserializer_keeps_stored_unknown_subject_placeholders(self):
+        # saved before the placeholders were checked
+        self.document.blocks["form-id"]["default_subject"] = "From ${unknown}"
+        self.document.blocks = deepcopy(self.document.blocks)
+        transaction.commit()
+        new_blocks = deepcopy(self.document.blocks)
+        new_blocks["form-id"]["title"] = "Contact us"
+
+        with self.assertLogs("collective.volto.formsupport", "WARNING") as logs:
+            response = self.api_session.patch(
+                self.document_url,
+                json={"blocks": new_blocks},
+            )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 204)
+        self.assertIn("${unknown}", logs.output[0])
+        self.assertEqual(self.document.blocks["form-id"]["title"], "Contact us")
+
+        new_blocks["form-id"]["default_subject"] = "From ${unknown} ${other}"
+        response = self.api_session.patch(
+            self.document_url,
+            json={"blocks": new_blocks},
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown fields in the subject: ${other}", response.text)
@@ -0,0 +1,254 @@
+from collective.volto.formsupport.datamanager.sqlite import get_database
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.restapi.services.form_data.csv import (
+    accepts_encoding,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    column_name,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    COMPRESSIONS,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import CSVWriter
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    EXPORT_FORMATS,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    get_compression_level,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    NDJSONWriter,
+)
+from collective.volto.formsupport.restapi.services.form_data.export import (
+    XLSXWriter,
+)
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from io import BytesIO
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from unittest import mock
+from xml.etree import ElementTree
+from zope.component import getMultiAdapter
+
+import gzip
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import transaction
+import unittest
+import zipfile
+
+
+NS = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+ROWS = [
+    ["John", 42, True, datetime(2024, 5, 1, 12, 0)],
+    ["<Jane & co>", 1.5, None, date(2024, 5, 2)],
+]
+
+
+class TestWriters(unittest.TestCase):
+    # the converters of json_compatible are registered adapters
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def export(self, writer_class, rows=ROWS):
+        fd = BytesIO()
+        writer = writer_class(fd)
+        writer.start(["Name", "Age", "Accept", "date"])
+        for index, row in enumerate(rows):
+            writer.write(row)
+            if index % 2:
+                writer.flush()
+        writer.close()
+        return fd.getvalue()
+
+    def test_csv(self):
+        self.assertEqual(
+            self.export(CSVWriter).decode("utf-8").splitlines(),
+            [
+                '"Name","Age","Accept","date"',
+                '"John","42","True","2024-05-01T12:00:00"',
+                '"<Jane & co>","1.5","","2024-05-02"',
+            ],
+        )
+
+    def test_ndjson(self):
+        lines = self.export(NDJSONWriter).decode("utf-8").splitlines()
+
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {
+                    "Name": "John",
+                    "Age": 42,
+                    "Accept": True,
+                    "date": "2024-05-01T12:00:00",
+                },
+                {"Name": "<Jane & co>", "Age": 1.5, "date": "2024-05-02"},
+            ],
+        )
+
+    def test_xlsx(self):
+        with zipfile.ZipFile(BytesIO(self.export(XLSXWriter))) as xlsx:
+            self.assertIn("xl/workbook.xml", xlsx.namelist())
+            sheet = ElementTree.fromstring(xlsx.read("xl/worksheets/sheet1.xml"))
+            # written with zip64 sizes, the sheet can be larger than 2 GiB
+            info = xlsx.getinfo("xl/worksheets/sheet1.xml")
+            self.assertEqual(info.extract_version, zipfile.ZIP64_VERSION)
+        rows = sheet.findall("s:sheetData/s:row", NS)
+        cells = [
+            [(cell.get("r"), cell.get("t"), cell.get("s")) for cell in row]
+            for row in rows
+        ]
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(
+            rows[0].find("s:c/s:is/s:t", NS).text,
+            "Name",
+        )
+        self.assertEqual(
+            cells[1],
+            [
+                ("A2", "inlineStr", None),
+                ("B2", None, None),
+                ("C2", "b", None),
+                ("D2", None, "1"),
+            ],
+        )
+        # the missing value has no cell
+        self.assertEqual([cell[0] for cell in cells[2]], ["A3", "B3", "D3"])
+        self.assertEqual(rows[2].find("s:c/s:is/s:t", NS).text, "<Jane & co>")
+        values = [cell.findtext("s:v", namespaces=NS) for cell in rows[1]]
+        self.assertEqual(values[1:], ["42", "1", "45413.5"])
+        self.assertEqual(rows[2][-1].findtext("s:v", namespaces=NS), "45414")
+
+    def test_xlsx_illegal_characters(self):
+        data = self.export(XLSXWriter, rows=[["a\x00b\x1f", None, None, None]])
+
+        with zipfile.ZipFile(BytesIO(data)) as xlsx:
+            sheet = ElementTree.fromstring(xlsx.read("xl/worksheets/sheet1.xml"))
+        self.assertEqual(sheet.findall(".//s:t", NS)[-1].text, "ab")
+
+    def test_column_name(self):
+        self.assertEqual(
+            [column_name(index) for index in (0, 25, 26, 51, 52, 701, 702)],
+            ["A", "Z", "AA", "AZ", "BA", "ZZ", "AAA"],
+        )
+
+
+class TestCompressions(unittest.TestCase):
+    def compress(self, name, data, level=6):
+        fd = BytesIO()
+        wrapper = COMPRESSIONS[name](fd, "export.csv", level)
+        for index in range(0, len(data), 1000):
+            wrapper.write(data[index : index + 1000])
+        wrapper.close()
+        self.assertFalse(fd.closed)
+        return fd.getvalue()
+
+    def test_gzip(self):
+        data = b'"John","42"\n' * 10000
+
+        compressed = self.compress("gzip", data)
+        self.assertEqual(gzip.decompress(compressed), data)
+        self.assertLess(len(compressed), len(data) / 10)
+        self.assertLess(len(compressed), len(self.compress("gzip", data, level=0)))
+
+    def test_zip(self):
+        data = b'"John","42"\n' * 10000
+
+        with zipfile.ZipFile(BytesIO(self.compress("zip", data))) as archive:
+            self.assertEqual(archive.namelist(), ["export.csv"])
+            self.assertEqual(archive.read("export.csv"), data)
+
+    def test_compression_level(self):
+        for value, level in (("", 6), ("1", 1), ("9", 9), ("10", 6), ("fast", 6)):
+            with mock.patch.dict(
+                os.environ, {"FORM_DATA_EXPORT_COMPRESSION_LEVEL": value}
+            ):
+                self.assertEqual(get_compression_level(), level)
+
+    def test_accepts_encoding(self):
+        self.assertTrue(accepts_encoding("gzip, deflate", "gzip"))
+        self.assertTrue(accepts_encoding("deflate, GZIP;q=0.5", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+        self.assertFalse(accepts_encoding("gzip;q=0", "gzip"))
+        self.assertFalse(accepts_encoding("identity", "gzip"))
+        self.assertFalse(accepts_encoding("", "gzip"))
+
+
+@unittest.skipUnless(
+    os.environ.get("FORMSUPPORT_BENCHMARKS"), "set FORMSUPPORT_BENCHMARKS to run"
+)
+class BenchmarkExport(unittest.TestCase):
+    """Time and peak memory of the export formats, on a SQLite store with
+    FORMSUPPORT_BENCHMARK_RECORDS records (500000 by default).
+
+    FORMSUPPORT_BENCHMARKS=1 zope-testrunner --test-path=src -t BenchmarkExport
+    """
+
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.records = int(os.environ.get("FORMSUPPORT_BENCHMARK_RECORDS", 500000))
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "form_data.sqlite")
+        self.environ = mock.patch.dict(os.environ, {"FORM_DATA_SQLITE_PATH": self.path})
+        self.environ.start()
+        self.document = api.content.create(
+            type="Document", title="Form", container=self.portal
+        )
+        self.document.blocks = {"form-id": {"@type": "form", "store": True}}
+        store = getMultiAdapter((self.document, self.request), IFormDataStore)
+        start = datetime.now() - timedelta(days=365)
+        schema = (("name", "Name"), ("age", "Age"), ("message", "Message"))
+        for i in range(self.records):
+            store._insert(
+                i + 1,
+                "form-id",
+                start + timedelta(seconds=i * 60),
+                None,
+                schema,
+                (f"User {i}", i % 90, f"A message from the user number {i}"),
+            )
+
+    def tearDown(self):
+        transaction.abort()
+        self.environ.stop()
+        get_database(self.path).close()
+        shutil.rmtree(self.tempdir)
+
+    def test_formats(self):
+        exports = [(export_format, None) for export_format in EXPORT_FORMATS]
+        exports += [("csv", "gzip"), ("csv", "zip"), ("ndjson", "gzip")]
+        for export_format, compress in exports:
+            self.request.form["format"] = export_format
+            self.request.form["compress"] = compress
+            service = getMultiAdapter(
+                (self.document, self.request),
+                name="GET_application_json_@form-data-export",
+            )
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            with service.get_data() as data:
+                size = os.fstat(data.fileno()).st_size
+            elapsed = time.perf_counter() - start
+            # in KB on Linux, how much the export raised the peak of the process
+            growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+            name = f"{export_format}.{compress}" if compress else export_format
+            print(
+                f"\n{name}: {self.records} records in "
+                f"{elapsed:.1f}s ({self.records / elapsed:.0f}/s), "
+                f"{size / 2**20:.1f} MB, peak memory +{growth / 1024:.1f} MB"
+            )
@@ -0,0 +1,964 @@
+from collective.volto.formsupport.datamanager.catalog import FormDataSoup
+from collective.volto.formsupport.datamanager.catalog import get_partition_key
+from collective.volto.formsupport.datamanager.catalog import get_partition_range
+from collective.volto.formsupport.datamanager.catalog import MergedResults
+from collective.volto.formsupport.datamanager.catalog import RESERVED_IDS_KEY
+from collective.volto.formsupport.datamanager.catalog import SLOT_COUNT
+from collective.volto.formsupport.datamanager.catalog import SLOTS_KEY
+from collective.volto.formsupport.datamanager.catalog import SOUP_NAME
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.restapi.services.form_data.clear import (
+    FormDataClear,
+)
+from collective.volto.formsupport.restapi.services.form_data.form_data import (
+    FormData,
+)
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    construct_fields,
+)
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from collective.volto.formsupport.upgrades import to_1303
+from collective.volto.formsupport.upgrades import to_1304
+from datetime import datetime
+from datetime import timedelta
+from io import StringIO
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from plone.dexterity.content import Item
+from repoze.catalog.catalog import Catalog
+from repoze.catalog.indexes.field import CatalogFieldIndex
+from repoze.catalog.query import Eq
+from souper.plone.locator import SOUPKEY
+from souper.soup import NodeAttributeIndexer
+from souper.soup import Record
+from unittest import mock
+from zExceptions import BadRequest
+from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getMultiAdapter
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import transaction
+import unittest
+
+
+NOW = datetime.now()
+
+
+class FormDataStoreTestCase(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "form-a": {"@type": "form", "store": True},
+            "form-b": {"@type": "form", "store": True},
+        }
+        self.store = getMultiAdapter((self.document, self.request), IFormDataStore)
+
+    def add_record(self, block_id, days_ago, append=False, **attrs):
+        record = Record()
+        record.attrs.update(attrs)
+        record.attrs["block_id"] = block_id
+        record.attrs["date"] = NOW - timedelta(days=days_ago)
+        soup = self.store.get_target_soup(block_id, record.attrs["date"])
+        if append:
+            return soup.append(record)
+        return soup.add(record)
+
+    def add_records(self):
+        # ids of the records of each block, latest first
+        self.a = [self.add_record("form-a", days) for days in (1, 5, 10, 40)]
+        self.b = [self.add_record("form-b", days) for days in (2, 20)]
+
+    def ids(self, records):
+        return [record.intid for record in records]
+
+
+class TestSearch(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_records()
+
+    def test_search_all(self):
+        self.assertEqual(
+            self.ids(self.store.search()),
+            [self.a[0], self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]],
+        )
+        self.assertEqual(
+            self.ids(self.store.search(reverse=False))[:2], [self.a[3], self.b[1]]
+        )
+
+    def test_search_block_id(self):
+        self.assertEqual(self.ids(self.store.search(block_id="form-a")), self.a)
+        self.assertEqual(self.ids(self.store.search(block_id="form-b")), self.b)
+        self.assertEqual(self.store.search(block_id="missing"), [])
+
+    def test_search_dates(self):
+        self.assertEqual(
+            self.ids(self.store.search(date_from=NOW - timedelta(days=10))),
+            [self.a[0], self.b[0], self.a[1], self.a[2]],
+        )
+        # date_to is excluded
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))),
+            [self.b[1], self.a[3]],
+        )
+        self.assertEqual(
+            self.ids(
+                self.store.search(
+                    block_id="form-a",
+                    date_from=NOW - timedelta(days=10),
+                    date_to=NOW - timedelta(days=1),
+                )
+            ),
+            [self.a[1], self.a[2]],
+        )
+
+    def test_limit_offset(self):
+        self.assertEqual(self.ids(self.store.search(limit=2)), [self.a[0], self.b[0]])
+        self.assertEqual(
+            self.ids(self.store.search(limit=2, offset=2)), [self.a[1], self.a[2]]
+        )
+        self.assertEqual(
+            self.ids(self.store.search(block_id="form-a", limit=3, offset=2)),
+            self.a[2:],
+        )
+        self.assertEqual(self.store.search(limit=0), [])
+
+    def test_search_query(self):
+        self.store.soup.catalog["category"] = CatalogFieldIndex(
+            NodeAttributeIndexer("category")
+        )
+        record_id = self.add_record("form-a", 3, category="news")
+
+        self.assertEqual(
+            self.ids(self.store.search(query=Eq("category", "news"))), [record_id]
+        )
+
+    def test_unknown_sort_index(self):
+        with self.assertRaises(ValueError):
+            self.store.search(sort_on="unknown")
+
+
+class TestSearchWithoutDateIndex(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_records()
+        # catalog of a soup created before the date index was added
+        catalog = Catalog()
+        catalog["block_id"] = CatalogFieldIndex(NodeAttributeIndexer("block_id"))
+        self.store.soup.storage.catalog = catalog
+        self.store.soup.reindex()
+
+    def test_search(self):
+        self.assertEqual(
+            self.ids(
+                self.store.search(
+                    block_id="form-a", date_from=NOW - timedelta(days=10), limit=2
+                )
+            ),
+            self.a[:2],
+        )
+
+    def test_upgrade_rebuilds_catalog(self):
+        to_1303(self.portal.portal_setup)
+
+        self.assertIn("date", self.store.soup.catalog)
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))),
+            [self.b[1], self.a[3]],
+        )
+
+
+class TestFormDataListing(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_records()
+        self.document.blocks["form-a"]["remove_data_after_days"] = 15
+        self.request["ACTUAL_URL"] = f"{self.document.absolute_url()}/@form-data"
+
+    def get_form_data(self, block_id="form-a", **form):
+        self.request.form.update(form)
+        self.request["QUERY_STRING"] = "&".join(f"{k}={v}" for k, v in form.items())
+        return FormData(self.document, self.request, block_id=block_id)(expand=True)[
+            "form_data"
+        ]
+
+    def test_not_batched(self):
+        result = self.get_form_data()
+
+        self.assertEqual([item["id"] for item in result["items"]], self.a)
+        self.assertEqual(result["items_total"], 4)
+        self.assertEqual(result["expired_total"], 1)
+        self.assertNotIn("batching", result)
+
+    def test_batched(self):
+        result = self.get_form_data(b_size=2, b_start=2)
+
+        self.assertEqual([item["id"] for item in result["items"]], self.a[2:])
+        self.assertEqual(result["items_total"], 4)
+        self.assertEqual(result["expired_total"], 1)
+        self.assertEqual([item["__expired"] for item in result["items"]], [False, True])
+        self.assertEqual(
+            result["batching"]["first"],
+            f"{self.document.absolute_url()}/@form-data?b_start=0&b_size=2",
+        )
+        self.assertNotIn("next", result["batching"])
+
+    def test_batch_loads_only_the_page(self):
+        result = self.get_form_data(b_size=1)
+
+        records = FormData(self.document, self.request, block_id="form-a").get_records(
+            limit=1
+        )
+        self.assertEqual([item["id"] for item in result["items"]], self.a[:1])
+        self.assertEqual(result["items_total"], 4)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(list(records._data), [0])
+
+    def test_last_batch(self):
+        result = self.get_form_data(b_size=3, b_start=3)
+
+        self.assertEqual([item["id"] for item in result["items"]], self.a[3:])
+        self.assertEqual(result["items_total"], 4)
+        self.assertIn("prev", result["batching"])
+
+    def test_sort(self):
+        result = self.get_form_data(sort_on="date", sort_order="ascending")
+
+        self.assertEqual([item["id"] for item in result["items"]], self.a[::-1])
+
+    def test_invalid_sort(self):
+        with self.assertRaises(BadRequest):
+            self.get_form_data(sort_on="message")
+
+
+class TestCounters(FormDataStoreTestCase):
+    def test_length(self):
+        self.assertEqual(self.store.length(), 0)
+        self.assertEqual(self.store.length(block_id="form-a"), 0)
+        # records stored before the counters
+        self.add_records()
+        self.assertIsNone(self.store.counters)
+        self.assertEqual(self.store.length(), 6)
+        self.assertEqual(self.store.length(block_id="form-a"), 4)
+
+        self.store.delete(self.a[0])
+        self.assertEqual(self.store.counters["form-a"](), 3)
+        self.assertNotIn("form-b", self.store.counters)
+        self.assertEqual(self.store.length(block_id="form-a"), 3)
+        self.assertEqual(self.store.length(block_id="form-b"), 2)
+        self.assertEqual(self.store.length(), 5)
+
+        self.store.clear()
+        self.assertIsNone(self.store.counters)
+        self.assertEqual(self.store.length(block_id="form-a"), 0)
+
+    def test_add_updates_counters(self):
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.document.blocks["form-a"]["subblocks"] = [
+            {"field_id": "message", "label": "Message", "field_type": "text"}
+        ]
+        self.store.add(construct_fields([{"field_id": "message", "value": "hi"}]))
+        self.store.add(construct_fields([{"field_id": "message", "value": "hi"}]))
+
+        self.assertEqual(self.store.counters["form-a"](), 2)
+        self.assertEqual(self.store.length(block_id="form-a"), 2)
+
+    def test_count(self):
+        self.add_records()
+
+        self.assertEqual(self.store.count(), 6)
+        self.assertEqual(self.store.count(block_id="form-b"), 2)
+        self.assertEqual(
+            self.store.count(block_id="form-a", date_to=NOW - timedelta(days=5)), 2
+        )
+
+
+class TestDelete(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_records()
+        # initialize the counter of form-a
+        self.store.delete(self.a.pop(0))
+
+    def test_delete_many(self):
+        deleted = self.store.delete_many([self.a[0], self.b[1], 1234])
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            self.ids(self.store.search()), [self.b[0], self.a[1], self.a[2]]
+        )
+        self.assertEqual(self.store.length(), 3)
+        self.assertEqual(self.store.length(block_id="form-a"), 2)
+        self.assertEqual(self.store.length(block_id="form-b"), 1)
+        self.assertEqual(self.store.count(block_id="form-b"), 1)
+        self.assertEqual(self.store.delete_many([]), 0)
+
+    def test_delete_query(self):
+        deleted = self.store.delete_query(
+            block_id="form-a", date_to=NOW - timedelta(days=5)
+        )
+
+        self.assertEqual(deleted, 2)
+        self.assertEqual(
+            self.ids(self.store.search()), [self.b[0], self.a[0], self.b[1]]
+        )
+        self.assertEqual(self.store.length(block_id="form-a"), 1)
+
+        self.assertEqual(self.store.delete_query(block_id="form-b"), 2)
+        self.assertEqual(self.ids(self.store.search()), [self.a[0]])
+        self.assertEqual(self.store.length(), 1)
+
+    def test_delete_query_all(self):
+        self.assertEqual(self.store.delete_query(), 5)
+        self.assertEqual(self.store.search(), [])
+        self.assertEqual(self.store.length(block_id="form-a"), 0)
+
+    def test_clear_expired(self):
+        self.document.blocks["form-a"]["remove_data_after_days"] = 15
+        self.request["BODY"] = json.dumps({"block_id": "form-a", "expired": True})
+        service = FormDataClear()
+        service.context = self.document
+        service.request = self.request
+        service.reply()
+
+        self.assertEqual(
+            self.ids(self.store.search()), [self.b[0], *self.a[:2], self.b[1]]
+        )
+
+
+class TestSoupPerBlock(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.environ = mock.patch.dict(os.environ, {"FORM_DATA_SOUP_PER_BLOCK": "1"})
+        self.environ.start()
+        self.assertTrue(self.store._use_soup_per_block())
+        self.add_records()
+
+    def tearDown(self):
+        self.environ.stop()
+
+    def test_soups(self):
+        self.assertEqual(list(self.store.blocks), ["form-a", "form-b"])
+        self.assertEqual(set(self.store.get_soup("form-a").data), set(self.a))
+        self.assertEqual(set(self.store.get_soup("form-b").data), set(self.b))
+        self.assertNotIn(SOUPKEY % "form_data", IAnnotations(self.document))
+
+    def test_slots(self):
+        soup = self.store.get_soup("form-b")
+        # the other soups aren't read to generate the ids
+        self.assertEqual(soup.slot, 1)
+        self.assertEqual(soup.siblings, ())
+        self.assertEqual({intid % SLOT_COUNT for intid in self.a}, {0})
+        self.assertEqual({intid % SLOT_COUNT for intid in self.b}, {1})
+
+    def test_soups_without_slots(self):
+        # stores created before the slots check the ids of the other soups
+        del IAnnotations(self.document)[SLOTS_KEY]
+        soup = self.store.get_target_soup("form-b")
+        self.assertIsNone(soup.slot)
+        self.assertEqual(
+            [sibling.soup_name for sibling in soup.siblings], ["form_data:form-a"]
+        )
+        with mock.patch.object(soup, "_randrange", side_effect=[self.a[0], 7]):
+            self.assertEqual(soup._generateid(), 7)
+
+    def test_search(self):
+        self.assertEqual(
+            self.ids(self.store.search()),
+            [self.a[0], self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]],
+        )
+        self.assertEqual(
+            self.ids(self.store.search(limit=2, offset=1)), [self.b[0], self.a[1]]
+        )
+        self.assertEqual(
+            self.ids(self.store.search(block_id="form-a", lazy=True)), self.a
+        )
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))),
+            [self.b[1], self.a[3]],
+        )
+        self.assertEqual(self.store.search(block_id="missing"), [])
+
+    def test_lazy_search(self):
+        records = self.store.search(lazy=True, offset=1)
+        self.assertIsInstance(records, MergedResults)
+        self.assertEqual(
+            self.ids(records), [self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]]
+        )
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[1].intid, self.a[1])
+        self.assertEqual(records[3].intid, self.b[1])
+        self.assertEqual(records[0].intid, self.b[0])
+        self.assertEqual(records[-1].intid, self.a[3])
+        self.assertEqual(self.ids(records[1:3]), [self.a[1], self.a[2]])
+        with self.assertRaises(IndexError):
+            records[5]
+
+        records = self.store.search(lazy=True, limit=2, offset=1)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(self.ids(records), [self.b[0], self.a[1]])
+        with self.assertRaises(ValueError):
+            self.store.search(sort_on="unknown", lazy=True)
+
+    def test_lazy_search_length(self):
+        records = self.store.search(lazy=True)
+        # counted from the sizes of the soup results, without reading the ids
+        with mock.patch.object(
+            MergedResults, "_get_docids"
+        ) as get_docids, mock.patch.object(MergedResults, "__iter__") as iterate:
+            self.assertEqual(len(records), 6)
+            self.assertEqual(
+                len(self.store.search(lazy=True, date_to=NOW - timedelta(days=10))),
+                2,
+            )
+            self.assertEqual(len(self.store.search(lazy=True, limit=4, offset=3)), 3)
+        get_docids.assert_not_called()
+        iterate.assert_not_called()
+
+    def test_length(self):
+        self.assertEqual(self.store.length(), 6)
+        self.assertEqual(self.store.length(block_id="form-a"), 4)
+        self.assertEqual(self.store.length(block_id="missing"), 0)
+        self.assertEqual(
+            self.store.count(block_id="form-a", date_to=NOW - timedelta(days=5)), 2
+        )
+        self.assertIsNone(self.store.counters)
+
+    def test_delete(self):
+        self.store.delete(self.b[0])
+        self.assertEqual(self.store.delete_many([self.a[0], self.b[1]]), 2)
+        self.assertEqual(
+            self.store.delete_query(block_id="form-a", date_to=NOW - timedelta(days=5)),
+            2,
+        )
+        self.assertEqual(self.ids(self.store.search()), [self.a[1]])
+        self.assertEqual(self.store.length(), 1)
+
+        self.assertEqual(self.store.delete_query(block_id="form-a"), 1)
+        self.assertEqual(self.store.length(), 0)
+
+    def test_add(self):
+        self.request["BODY"] = json.dumps({"block_id": "form-c"})
+        self.document.blocks["form-c"] = {
+            "@type": "form",
+            "store": True,
+            "subblocks": [
+                {"field_id": "message", "label": "Message", "field_type": "text"}
+            ],
+        }
+        record_id = self.store.add(
+            construct_fields([{"field_id": "message", "value": "hi"}])
+        )
+
+        self.assertIn("form-c", self.store.blocks)
+        self.assertEqual(self.ids(self.store.search(block_id="form-c")), [record_id])
+        self.assertNotIn(record_id, self.a + self.b)
+
+
+class TestSplitSoup(FormDataStoreTestCase):
+    def test_split_soup(self):
+        self.add_records()
+        self.store.delete(self.a[0])
+        self.assertIsNotNone(self.store.counters)
+
+        self.assertEqual(self.store.split_soup(), 5)
+        self.assertEqual(list(self.store.blocks), ["form-a", "form-b"])
+        self.assertEqual(
+            self.ids(self.store.search()),
+            [self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]],
+        )
+        self.assertEqual(self.store.length(block_id="form-a"), 3)
+        self.assertIsNone(self.store.counters)
+        self.assertNotIn(SOUPKEY % "form_data", IAnnotations(self.document))
+        self.assertEqual(self.store.split_soup(), 0)
+
+    def test_split_soup_reserved_ids(self):
+        self.add_records()
+        self.store.split_soup()
+        reserved = IAnnotations(self.document)[RESERVED_IDS_KEY]
+        self.assertEqual(set(reserved), set(self.a + self.b))
+
+        # the new records don't use the ids kept by the moved records
+        soup = self.store.get_target_soup("form-b")
+        reserved.insert(5 * SLOT_COUNT + soup.slot)
+        with mock.patch.object(soup, "_randrange", side_effect=[5, 6]):
+            self.assertEqual(soup._generateid(), 6 * SLOT_COUNT + soup.slot)
+
+    def test_split_soup_in_partitions(self):
+        self.add_records()
+
+        with mock.patch.dict(os.environ, {"FORM_DATA_PARTITION_MONTHS": "1"}):
+            self.assertEqual(self.store.split_soup(), 6)
+        self.assertEqual(self.store.partition_months, 1)
+        self.assertEqual(
+            set(self.store.partitions["form-b"]),
+            {get_partition_key(NOW - timedelta(days=d), 1) for d in (2, 20)},
+        )
+        self.assertEqual(
+            self.ids(self.store.search()),
+            [self.a[0], self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]],
+        )
+
+    def test_split_soup_per_block_in_partitions(self):
+        with mock.patch.dict(os.environ, {"FORM_DATA_SOUP_PER_BLOCK": "1"}):
+            self.assertTrue(self.store._use_soup_per_block())
+        self.add_records()
+        self.assertEqual(self.store.split_soup(), 0)
+
+        with mock.patch.dict(os.environ, {"FORM_DATA_PARTITION_MONTHS": "1"}):
+            self.assertEqual(self.store.split_soup(), 6)
+            self.assertEqual(self.store.split_soup(), 0)
+        self.assertNotIn(SOUPKEY % "form_data:form-a", IAnnotations(self.document))
+        self.assertEqual(self.ids(self.store.search(block_id="form-a")), self.a)
+
+    def test_shared_soup_with_records_is_kept(self):
+        self.add_records()
+        with mock.patch.dict(os.environ, {"FORM_DATA_SOUP_PER_BLOCK": "1"}):
+            self.assertFalse(self.store._use_soup_per_block())
+        self.assertIsNone(self.store.blocks)
+
+
+class TestPartitions(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.environ = mock.patch.dict(os.environ, {"FORM_DATA_PARTITION_MONTHS": "1"})
+        self.environ.start()
+        self.assertTrue(self.store._use_soup_per_block())
+        self.add_records()
+
+    def tearDown(self):
+        self.environ.stop()
+
+    def keys(self, *days):
+        return {get_partition_key(NOW - timedelta(days=d), 1) for d in days}
+
+    def test_partition_key(self):
+        self.assertEqual(get_partition_key(datetime(2024, 11, 30), 1), "2024-11")
+        self.assertEqual(get_partition_key(datetime(2024, 11, 30), 3), "2024-10")
+        self.assertEqual(get_partition_key(datetime(2024, 1, 1), 12), "2024-01")
+        self.assertEqual(
+            get_partition_range("2024-10", 3),
+            (datetime(2024, 10, 1), datetime(2025, 1, 1)),
+        )
+
+    def test_partitions(self):
+        self.assertEqual(self.store.partition_months, 1)
+        self.assertEqual(list(self.store.blocks), ["form-a", "form-b"])
+        self.assertEqual(set(self.store.partitions["form-a"]), self.keys(1, 5, 10, 40))
+        self.assertEqual(set(self.store.partitions["form-b"]), self.keys(2, 20))
+        soup = self.store.get_soup("form-a", NOW - timedelta(days=40))
+        self.assertEqual(list(soup.data), [self.a[3]])
+
+    def test_search(self):
+        self.assertEqual(
+            self.ids(self.store.search()),
+            [self.a[0], self.b[0], self.a[1], self.a[2], self.b[1], self.a[3]],
+        )
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))),
+            [self.b[1], self.a[3]],
+        )
+        self.assertEqual(
+            self.ids(
+                self.store.search(block_id="form-a", date_from=NOW - timedelta(days=5))
+            ),
+            self.a[:2],
+        )
+        self.assertEqual(self.store.count(date_from=NOW - timedelta(days=10)), 4)
+        self.assertEqual(self.store.length(block_id="form-a"), 4)
+        # only the partitions in the range
+        self.assertEqual(
+            len(self.store.get_soups(date_from=NOW - timedelta(days=1))),
+            len(self.keys(1)) + len(self.keys(1)),
+        )
+
+    def test_delete_query_drops_partitions(self):
+        old = [self.add_record("form-a", days) for days in (130, 160, 400)]
+        cutoff = get_partition_range(
+            get_partition_key(NOW - timedelta(days=130), 1), 1
+        )[0] + timedelta(days=1)
+
+        self.assertEqual(self.store.delete_query(block_id="form-a", date_to=cutoff), 2)
+        self.assertEqual(
+            set(self.store.partitions["form-a"]),
+            self.keys(1, 5, 10, 40, 130),
+        )
+        annotations = IAnnotations(self.document)
+        for days in (160, 400):
+            key = get_partition_key(NOW - timedelta(days=days), 1)
+            self.assertNotIn(SOUPKEY % f"form_data:form-a:{key}", annotations)
+        self.assertEqual(
+            self.ids(self.store.search(block_id="form-a")), self.a + old[:1]
+        )
+
+    def test_clear(self):
+        self.store.clear()
+
+        self.assertEqual(self.store.length(), 0)
+        self.assertEqual(self.store.get_soups(), [])
+
+    def test_add(self):
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.document.blocks["form-a"]["subblocks"] = [
+            {"field_id": "message", "label": "Message", "field_type": "text"}
+        ]
+        record_id = self.store.add(
+            construct_fields([{"field_id": "message", "value": "hi"}])
+        )
+
+        self.assertIn(
+            get_partition_key(datetime.now(), 1), self.store.partitions["form-a"]
+        )
+        self.assertEqual(self.store.search(block_id="form-a")[0].intid, record_id)
+        self.assertNotIn(record_id, self.a + self.b)
+
+
+class TestDeferredIndexing(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_records()
+        self.pending = [
+            self.add_record("form-a", days, append=True) for days in (0, 7, 30)
+        ]
+
+    def test_pending(self):
+        self.assertEqual(set(self.store.soup.pending), set(self.pending))
+        self.assertEqual(self.store.soup.catalog["date"].documentCount(), 6)
+
+    def test_search_merges_pending(self):
+        expected = [
+            self.pending[0],
+            self.a[0],
+            self.a[1],
+            self.pending[1],
+            self.a[2],
+            self.pending[2],
+            self.a[3],
+        ]
+        self.assertEqual(self.ids(self.store.search(block_id="form-a")), expected)
+        self.assertEqual(
+            self.ids(self.store.search(block_id="form-a", limit=2, offset=2)),
+            expected[2:4],
+        )
+        self.assertEqual(
+            self.ids(self.store.search(date_from=NOW - timedelta(days=8)))[:4],
+            [self.pending[0], self.a[0], self.b[0], self.a[1]],
+        )
+        self.assertEqual(self.store.count(block_id="form-a"), 7)
+        self.assertEqual(self.store.count(date_to=NOW - timedelta(days=25)), 2)
+
+    def test_merge_pending(self):
+        expected = self.ids(self.store.search())
+
+        self.assertEqual(self.store.merge_pending(), 3)
+        self.assertEqual(len(self.store.soup.pending), 0)
+        self.assertEqual(self.store.soup.catalog["date"].documentCount(), 9)
+        self.assertEqual(self.ids(self.store.search()), expected)
+        self.assertEqual(self.store.merge_pending(), 0)
+
+    def test_delete(self):
+        self.store.delete(self.pending[0])
+        self.assertNotIn(self.pending[0], self.store.soup.pending)
+
+        self.assertEqual(
+            self.store.delete_query(block_id="form-a", date_to=NOW - timedelta(days=6)),
+            4,
+        )
+        self.assertEqual(self.ids(self.store.search(block_id="form-a")), self.a[:2])
+        self.assertEqual(self.store.length(block_id="form-a"), 2)
+
+    def test_add(self):
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.document.blocks["form-a"]["subblocks"] = [
+            {"field_id": "message", "label": "Message", "field_type": "text"}
+        ]
+        with mock.patch.dict(os.environ, {"FORM_DATA_DEFERRED_INDEXING": "1"}):
+            record_id = self.store.add(
+                construct_fields([{"field_id": "message", "value": "hi"}])
+            )
+
+        self.assertIn(record_id, self.store.soup.pending)
+        self.assertEqual(self.store.search(block_id="form-a")[0].intid, record_id)
+        self.assertEqual(self.store.length(block_id="form-a"), 8)
+
+
+@unittest.skipUnless(
+    os.environ.get("FORMSUPPORT_BENCHMARKS"), "set FORMSUPPORT_BENCHMARKS to run"
+)
+class BenchmarkConcurrentSubmissions(unittest.TestCase):
+    """Concurrent submissions to the same soup, through a ZEO server, with
+    the indexed add and with the deferred indexing append.
+
+    FORMSUPPORT_BENCHMARKS=1 zope-testrunner --test-path=src \\
+        -t BenchmarkConcurrentSubmissions
+    """
+
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+    threads = 8
+    submissions = 50
+    existing = 1000
+
+    def setUp(self):
+        try:
+            # not a test dependency, only needed by the benchmark
+            import ZEO
+        except ImportError:
+            self.skipTest("ZEO is not installed")
+        self.zeo = ZEO
+        self.tempdir = tempfile.mkdtemp()
+        self.addr, self.stop = ZEO.server(
+            path=os.path.join(self.tempdir, "Data.fs"), port=0
+        )
+        db, tm, root = self.connect()
+        with tm:
+            item = root["form"] = Item(id="form")
+            soup = FormDataSoup(SOUP_NAME, item)
+            for i in range(self.existing):
+                soup.add(self.get_record(i))
+            # created once, as for any content that already has submissions
+            soup.append(self.get_record(-1))
+            soup.merge_pending()
+        db.close()
+
+    def tearDown(self):
+        self.stop()
+        shutil.rmtree(self.tempdir)
+
+    def connect(self):
+        db = self.zeo.DB(self.addr)
+        tm = transaction.TransactionManager()
+        root = db.open(transaction_manager=tm).root()
+        return db, tm, root
+
+    @staticmethod
+    def get_record(i):
+        record = Record()
+        record.attrs["block_id"] = "form-id"
+        record.attrs["date"] = datetime.now()
+        record.attrs["message"] = f"submission {i}"
+        return record
+
+    def submit(self, method, conflicts):
+        db, tm, root = self.connect()
+        try:
+            for i in range(self.submissions):
+                while True:
+                    try:
+                        with tm:
+                            soup = FormDataSoup(SOUP_NAME, root["form"])
+                            getattr(soup, method)(self.get_record(i))
+                        break
+                    except ConflictError:
+                        conflicts.append(1)
+        finally:
+            db.close()
+
+    def run_benchmark(self, method):
+        conflicts = []
+        threads = [
+            threading.Thread(target=self.submit, args=(method, conflicts))
+            for i in range(self.threads)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        total = self.threads * self.submissions
+        print(
+            f"\n{method}: {total} submissions in {elapsed:.2f}s "
+            f"({total / elapsed:.0f}/s), {len(conflicts)} conflicts "
+            f"({len(conflicts) / (total + len(conflicts)):.1%} of the commits)"
+        )
+
+        db, tm, root = self.connect()
+        with tm:
+            soup = FormDataSoup(SOUP_NAME, root["form"])
+            soup.merge_pending()
+            self.assertEqual(len(soup.storage), self.existing + 1 + total)
+            self.assertEqual(len(soup.data), self.existing + 1 + total)
+            self.assertEqual(
+                soup.catalog["date"].documentCount(), self.existing + 1 + total
+            )
+        db.close()
+
+    def test_add(self):
+        self.run_benchmark("add")
+
+    def test_append(self):
+        self.run_benchmark("append")
+
+
+class TestCompactRecords(FormDataStoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.document.blocks["form-a"]["subblocks"] = [
+            {"field_id": "message", "label": "Message", "field_type": "text"},
+            {"field_id": "name", "label": "Name", "field_type": "text"},
+        ]
+
+    def submit(self, **values):
+        return self.store.add(
+            construct_fields(
+                [
+                    {"field_id": field_id, "value": value}
+                    for field_id, value in values.items()
+                ]
+            )
+        )
+
+    def test_add(self):
+        first = self.store.soup.get(self.submit(name="John", message="hi"))
+        second = self.store.soup.get(self.submit(name="Jane", message="hello"))
+        third = self.store.soup.get(self.submit(message="bye"))
+
+        self.assertEqual(
+            sorted(first.attrs.keys()), ["_schema", "_values", "block_id", "date"]
+        )
+        self.assertEqual(first.attrs["_values"], ("John", "hi"))
+        self.assertEqual(
+            list(self.store.schemas["form-a"]),
+            [
+                (("name", "Name"), ("message", "Message")),
+                (("message", "Message"),),
+            ],
+        )
+        self.assertEqual(
+            self.store.record_fields(second),
+            [("name", "Name", "Jane"), ("message", "Message", "hello")],
+        )
+        self.assertEqual(
+            self.store.record_fields(third), [("message", "Message", "bye")]
+        )
+
+    def test_expand_records(self):
+        record = self.store.soup.get(self.submit(name="John", message="hi"))
+        expanded = FormData(self.document, self.request).expand_records(record)
+
+        self.assertEqual(expanded["name"], {"value": "John", "label": "Name"})
+        self.assertEqual(expanded["message"], {"value": "hi", "label": "Message"})
+        self.assertEqual(expanded["block_id"], {"value": "form-a", "label": "block_id"})
+        self.assertEqual(expanded["id"], record.intid)
+        self.assertEqual(
+            sorted(expanded), ["block_id", "date", "id", "message", "name"]
+        )
+
+    def test_stored_fields(self):
+        self.submit(message="bye")
+        self.submit(name="John", message="hi")
+
+        self.assertEqual(
+            self.store.stored_fields(),
+            [("name", "Name"), ("message", "Message")],
+        )
+        self.assertEqual(self.store.stored_fields(block_id="form-b"), [])
+
+    def export(self, service):
+        with service.get_data() as data:
+            return [*csv.reader(StringIO(data.read().decode("utf-8")))]
+
+    def test_export_columns(self):
+        self.submit(name="John", message="hi")
+        self.add_record("form-a", 1, extra="legacy", fields_labels={"extra": "Extra"})
+        service = getMultiAdapter(
+            (self.document, self.request), name="GET_application_json_@form-data-export"
+        )
+
+        # the legacy record isn't in the schemas: the columns are searched
+        rows = self.export(service)
+        self.assertEqual(rows[0], ["Name", "Message", "Extra", "date"])
+        self.assertEqual(rows[1][:3], ["John", "hi", ""])
+        self.assertEqual(rows[2][:3], ["", "", "legacy"])
+
+        self.store.compact_records()
+        rows = self.export(service)
+        self.assertEqual(rows[0], ["Extra", "Name", "Message", "date"])
+
+    def test_legacy_records(self):
+        ordered = self.store.soup.get(
+            self.add_record(
+                "form-a",
+                1,
+                name="John",
+                message="hi",
+                fields_labels={"name": "Name", "message": "Message"},
+                fields_order=["name", "message"],
+            )
+        )
+        unordered = self.store.soup.get(
+            self.add_record("form-a", 2, name="Jane", message="hello")
+        )
+        expanded = FormData(self.document, self.request).expand_records(ordered)
+
+        self.assertEqual(
+            self.store.record_fields(ordered),
+            [("name", "Name", "John"), ("message", "Message", "hi")],
+        )
+        self.assertEqual(
+            self.store.record_fields(unordered, order=["name"]),
+            [("name", "name", "Jane"), ("message", "message", "hello")],
+        )
+
+        self.assertEqual(self.store.compact_records(), 2)
+        self.assertEqual(self.store.compact_records(), 0)
+        self.assertNotIn("fields_labels", ordered.attrs)
+        self.assertEqual(ordered.attrs["_values"], ("John", "hi"))
+        self.assertEqual(
+            FormData(self.document, self.request).expand_records(ordered), expanded
+        )
+        self.assertEqual(
+            self.store.search(block_id="form-a", date_from=NOW - timedelta(days=1))[
+                0
+            ].intid,
+            ordered.intid,
+        )
+
+    def test_compact_in_batches(self):
+        for days in (1, 2, 3):
+            self.add_record("form-a", days, name="John")
+
+        with mock.patch("transaction.commit") as commit:
+            self.assertEqual(self.store.compact_records(batch_size=2), 3)
+        self.assertEqual(commit.call_count, 1)
+
+    def test_upgrade_nested_form(self):
+        self.document.blocks = {
+            "columns": {
+                "@type": "__grid",
+                "blocks": {"form-a": {"@type": "form", "store": True}},
+                "blocks_layout": {"items": ["form-a"]},
+            },
+        }
+        self.document.reindexObject()
+        record = self.store.soup.get(self.add_record("form-a", 1, name="John"))
+
+        with mock.patch("transaction.commit"):
+            to_1304(self.portal)
+        self.assertEqual(record.attrs["_values"], ("John",))
+
+    def test_clear(self):
+        self.submit(name="John")
+        self.store.clear()
+
+        self.assertIsNone(self.store.schemas)
@@ -0,0 +1,267 @@
+from collective.volto.formsupport.mail import pool
+from collective.volto.formsupport.mail.pool import MailSession
+from collective.volto.formsupport.mail.pool import make_mailer
+from collective.volto.formsupport.mail.pool import message_envelope
+from collective.volto.formsupport.mail.pool import PooledSMTPMailer
+from collective.volto.formsupport.mail.pool import SMTPConnectionPool
+from collective.volto.formsupport.mail.pool import SMTPSessionMailer
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING,
+)
+from collective.volto.formsupport.testing import LocalSMTPServer
+from email.message import EmailMessage
+from email.message import Message
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import SITE_OWNER_NAME
+from plone.app.testing import SITE_OWNER_PASSWORD
+from plone.app.testing import TEST_USER_ID
+from plone.registry.interfaces import IRegistry
+from plone.restapi.testing import RelativeSession
+from Products.CMFPlone.tests.utils import MockMailHost
+from Products.MailHost.MailHost import MailHost
+from unittest import mock
+from zope.component import getUtility
+from zope.sendmail.mailer import SMTPMailer
+
+import os
+import smtplib
+import socket
+import transaction
+import unittest
+
+
+MESSAGE = b"Subject: test\r\n\r\nhello"
+
+
+class TestSMTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.server.start()
+        self.pool = SMTPConnectionPool(size=2)
+        self.mailer = PooledSMTPMailer(
+            pool=self.pool, hostname="127.0.0.1", port=self.server.port
+        )
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.stop()
+
+    def send(self, to="jane@doe.com"):
+        self.mailer.send("john@doe.com", [to], MESSAGE)
+
+    def test_connection_reused(self):
+        for to in ("jane@doe.com", "bob@doe.com", "smith@doe.com"):
+            self.send(to)
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(
+            [mto for mfrom, mto, message in self.server.messages],
+            [["jane@doe.com"], ["bob@doe.com"], ["smith@doe.com"]],
+        )
+        self.assertEqual(len(self.pool), 1)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        self.send()
+        self.send()
+
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_health_check_replaces_dead_connections(self):
+        self.pool.health_check_after = -1
+        self.send()
+        connection, released = self.pool._idle[self.mailer.key][0]
+        connection.sock.shutdown(socket.SHUT_RDWR)
+
+        self.send()
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_refused_message_keeps_the_session(self):
+        self.server.fail_with = "451 Try again later"
+        with self.assertRaises(smtplib.SMTPSenderRefused):
+            self.send()
+
+        self.server.fail_with = None
+        self.send()
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_pool_size(self):
+        first = self.pool.acquire(self.mailer.key, self.mailer.connect)
+        second = self.pool.acquire(self.mailer.key, self.mailer.connect)
+        third = self.pool.acquire(self.mailer.key, self.mailer.connect)
+        for connection in (first, second, third):
+            self.pool.release(self.mailer.key, connection)
+
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.pool), 2)
+
+
+class TestSMTPSessionMailer(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.server.start()
+        self.mailer = SMTPSessionMailer(hostname="127.0.0.1", port=self.server.port)
+
+    def tearDown(self):
+        self.mailer.close()
+        self.server.stop()
+
+    def test_session_reused_until_close(self):
+        for to in ("jane@doe.com", "bob@doe.com"):
+            self.mailer.send("john@doe.com", [to], MESSAGE)
+        self.assertEqual(self.server.connections, 1)
+
+        self.mailer.close()
+        self.assertIsNone(self.mailer.connection)
+        self.mailer.send("john@doe.com", ["smith@doe.com"], MESSAGE)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.messages), 3)
+
+
+class TestMailSession(unittest.TestCase):
+    def setUp(self):
+        self.mailhost = MailHost("MailHost", smtp_host="127.0.0.1", smtp_port=25)
+
+    def test_pool_is_opt_in(self):
+        self.assertIsInstance(make_mailer(self.mailhost), SMTPMailer)
+        # without the pool, a submission still uses one session
+        self.assertIsInstance(MailSession(self.mailhost).mailer, SMTPSessionMailer)
+
+        with mock.patch.dict(os.environ, {"FORM_MAIL_SMTP_POOL_SIZE": "2"}):
+            self.assertIsInstance(make_mailer(self.mailhost), PooledSMTPMailer)
+            self.assertIsInstance(MailSession(self.mailhost).mailer, PooledSMTPMailer)
+            # the MailHost queue is used as it is
+            self.mailhost.smtp_queue = True
+            self.assertIsNone(MailSession(self.mailhost).mailer)
+
+    def test_mailhost_delivery(self):
+        # a MailHost that replaces the delivery is used as it is
+        self.assertIsNone(MailSession(MockMailHost("MailHost")).mailer)
+
+    def test_message_envelope(self):
+        msg = EmailMessage()
+        msg["From"] = "John <john@doe.com>"
+        msg["To"] = "Jane <jane@doe.com>, bob@doe.com"
+        msg["Bcc"] = "smith@doe.com"
+        msg.set_content("hello")
+
+        mfrom, mto, message = message_envelope(msg)
+
+        self.assertEqual(mfrom, "john@doe.com")
+        self.assertEqual(mto, ["jane@doe.com", "bob@doe.com", "smith@doe.com"])
+        self.assertNotIn(b"smith@doe.com", message)
+        self.assertIn(b"Date: ", message)
+        # the message can be sent again
+        self.assertEqual(msg["Bcc"], "smith@doe.com")
+        self.assertIsNone(msg["Date"])
+
+    def test_message_envelope_charset(self):
+        msg = Message()
+        msg["From"] = "john@doe.com"
+        msg["To"] = "jane@doe.com"
+        msg.set_payload("hello")
+
+        mfrom, mto, message = message_envelope(msg, charset="utf-8")
+
+        self.assertIn(b'Content-Type: text/plain; charset="utf-8"', message)
+        self.assertIsNone(msg["Content-Type"])
+
+
+class TestPooledSubmit(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+
+        self.server = LocalSMTPServer()
+        self.server.start()
+        # a real MailHost instead of MockMailHost, that replaces the delivery
+        self.mock_mailhost = self.portal.MailHost
+        self.portal._delOb("MailHost")
+        self.portal._setOb(
+            "MailHost",
+            MailHost("MailHost", smtp_host="127.0.0.1", smtp_port=self.server.port),
+        )
+
+        registry = getUtility(IRegistry)
+        registry["plone.email_from_address"] = "site_addr@plone.com"
+        registry["plone.email_from_name"] = "Plone test site"
+        registry["plone.smtp_host"] = "127.0.0.1"
+        registry["plone.smtp_port"] = self.server.port
+
+        self.api_session = RelativeSession(self.portal.absolute_url())
+        self.api_session.headers.update({"Accept": "application/json"})
+        self.api_session.auth = (SITE_OWNER_NAME, SITE_OWNER_PASSWORD)
+        self.environ = mock.patch.dict(os.environ, {"FORM_MAIL_SMTP_POOL_SIZE": "2"})
+        self.environ.start()
+
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "send": ["recipient"],
+                "subblocks": [
+                    {"field_id": "message", "label": "Message", "field_type": "text"},
+                    {
+                        "field_id": "contact",
+                        "label": "Contact",
+                        "field_type": "from",
+                        "use_as_bcc": True,
+                    },
+                    {
+                        "field_id": "other_contact",
+                        "label": "Other contact",
+                        "field_type": "from",
+                        "use_as_bcc": True,
+                    },
+                ],
+            },
+        }
+        transaction.commit()
+
+    def tearDown(self):
+        self.api_session.close()
+        self.portal._delOb("MailHost")
+        self.portal._setOb("MailHost", self.mock_mailhost)
+        transaction.commit()
+        pool.pool.clear()
+        self.environ.stop()
+        self.server.stop()
+
+    def test_one_connection_per_submission(self):
+        response = self.api_session.post(
+            f"{self.document.absolute_url()}/@submit-form",
+            json={
+                "from": "john@doe.com",
+                "subject": "test subject",
+                "block_id": "form-id",
+                "data": [
+                    {"field_id": "message", "value": "just want to say hi"},
+                    {"field_id": "contact", "value": "smith@doe.com"},
+                    {"field_id": "other_contact", "value": "jane@doe.com"},
+                ],
+            },
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(
+            [mto for mfrom, mto, message in self.server.messages],
+            [["site_addr@plone.com"], ["smith@doe.com"], ["jane@doe.com"]],
+        )
+        self.assertEqual(self.server.connections, 1)
+
+    def test_one_connection_per_submission_without_pool(self):
+        self.environ.stop()
+        with mock.patch.dict(os.environ, {"FORM_MAIL_SMTP_POOL_SIZE": "0"}):
+            self.test_one_connection_per_submission()
+        self.environ.start()
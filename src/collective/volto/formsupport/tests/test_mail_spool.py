@@ -0,0 +1,208 @@
+from collective.volto.formsupport.mail.spool import get_mail_spool
+from collective.volto.formsupport.mail.spool import MailSpool
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING,
+)
+from collective.volto.formsupport.testing import LocalSMTPServer
+from email.message import EmailMessage
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import SITE_OWNER_NAME
+from plone.app.testing import SITE_OWNER_PASSWORD
+from plone.app.testing import TEST_USER_ID
+from plone.registry.interfaces import IRegistry
+from plone.restapi.testing import RelativeSession
+from Products.MailHost.interfaces import IMailHost
+from unittest import mock
+from zope.component import getUtility
+from zope.sendmail.mailer import SMTPMailer
+
+import os
+import shutil
+import tempfile
+import transaction
+import unittest
+
+
+def make_message(to="jane@doe.com"):
+    msg = EmailMessage()
+    msg.set_content("hello")
+    msg["Subject"] = "test"
+    msg["From"] = "John <john@doe.com>"
+    msg["To"] = to
+    return msg
+
+
+class RecordingMailer:
+    def __init__(self):
+        self.messages = []
+
+    def send(self, fromaddr, toaddrs, message):
+        self.messages.append((fromaddr, toaddrs, message))
+
+
+class TestMailSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = MailSpool(self.directory, max_attempts=3, backoff=10)
+        self.server = LocalSMTPServer()
+        self.server.start()
+        self.mailer = SMTPMailer(hostname="127.0.0.1", port=self.server.port)
+
+    def tearDown(self):
+        transaction.abort()
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def test_message_queued_only_on_commit(self):
+        self.spool.enqueue_message(make_message())
+        self.assertEqual(self.spool.pending(), [])
+        transaction.abort()
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(os.listdir(os.path.join(self.directory, "tmp")), [])
+
+        self.spool.enqueue_message(make_message())
+        transaction.commit()
+        self.assertEqual(len(self.spool.pending()), 1)
+
+    def test_deliver(self):
+        self.spool.enqueue_message(make_message())
+        self.spool.enqueue_message(make_message(to="Bob <bob@doe.com>"))
+        transaction.commit()
+
+        self.assertEqual(self.spool.process(self.mailer), (2, 0, 0))
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(
+            [(mfrom, mto) for mfrom, mto, message in self.server.messages],
+            [("john@doe.com", ["jane@doe.com"]), ("john@doe.com", ["bob@doe.com"])],
+        )
+        self.assertIn(b"Subject: test", self.server.messages[0][2])
+
+    def test_retry_with_backoff(self):
+        self.spool.enqueue_message(make_message())
+        transaction.commit()
+        self.server.fail_with = "451 Try again later"
+
+        self.assertEqual(self.spool.process(self.mailer, now=1000), (0, 1, 0))
+        # not due yet
+        self.assertEqual(self.spool.process(self.mailer, now=1005), (0, 0, 0))
+        self.assertEqual(self.spool.process(self.mailer, now=1010), (0, 1, 0))
+        # backoff doubled
+        self.assertEqual(self.spool.process(self.mailer, now=1025), (0, 0, 0))
+
+        self.server.fail_with = None
+        self.assertEqual(self.spool.process(self.mailer, now=1030), (1, 0, 0))
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_dead_letters(self):
+        self.spool.enqueue_message(make_message())
+        self.spool.enqueue_message(make_message())
+        transaction.commit()
+
+        self.server.fail_with = "550 No such user"
+        self.assertEqual(self.spool.process(self.mailer), (0, 0, 2))
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(len(self.spool.failed()), 2)
+
+    def test_dead_letter_after_max_attempts(self):
+        self.spool.enqueue_message(make_message())
+        transaction.commit()
+        self.server.fail_with = "451 Try again later"
+
+        for now in (1000, 2000, 3000):
+            self.spool.process(self.mailer, now=now)
+        self.assertEqual(self.spool.pending(), [])
+        self.assertEqual(len(self.spool.failed()), 1)
+
+    def test_spool_per_directory(self):
+        self.assertIsNone(get_mail_spool())
+        with mock.patch.dict(os.environ, {"FORM_MAIL_QUEUE_DIRECTORY": self.directory}):
+            spool = get_mail_spool()
+            with mock.patch("os.makedirs") as makedirs:
+                self.assertIs(get_mail_spool(), spool)
+        makedirs.assert_not_called()
+        self.assertEqual(spool.directory, self.directory)
+
+
+class TestQueuedSubmit(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.mailhost = getUtility(IMailHost)
+        self.mailhost.reset()
+
+        registry = getUtility(IRegistry)
+        registry["plone.email_from_address"] = "site_addr@plone.com"
+        registry["plone.email_from_name"] = "Plone test site"
+
+        self.api_session = RelativeSession(self.portal.absolute_url())
+        self.api_session.headers.update({"Accept": "application/json"})
+        self.api_session.auth = (SITE_OWNER_NAME, SITE_OWNER_PASSWORD)
+
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "send": ["recipient"],
+                "subblocks": [
+                    {"field_id": "message", "label": "Message", "field_type": "text"},
+                    {
+                        "field_id": "contact",
+                        "label": "Contact",
+                        "field_type": "from",
+                        "use_as_bcc": True,
+                    },
+                ],
+            },
+        }
+        transaction.commit()
+
+        self.directory = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(
+            os.environ,
+            {
+                "FORM_MAIL_QUEUE_DIRECTORY": self.directory,
+                "FORM_MAIL_QUEUE_THREAD": "0",
+            },
+        )
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.api_session.close()
+        shutil.rmtree(self.directory)
+
+    def test_submit_spools_messages(self):
+        response = self.api_session.post(
+            f"{self.document.absolute_url()}/@submit-form",
+            json={
+                "from": "john@doe.com",
+                "subject": "test subject",
+                "block_id": "form-id",
+                "data": [
+                    {"field_id": "message", "value": "just want to say hi"},
+                    {"field_id": "contact", "value": "smith@doe.com"},
+                ],
+            },
+        )
+        transaction.commit()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.mailhost.messages), 0)
+
+        spool = MailSpool(self.directory)
+        self.assertEqual(len(spool.pending()), 2)
+        mailer = RecordingMailer()
+        self.assertEqual(spool.process(mailer), (2, 0, 0))
+        self.assertEqual(
+            sorted(mto for mfrom, mto, message in mailer.messages),
+            [["site_addr@plone.com"], ["smith@doe.com"]],
+        )
+        for mfrom, mto, message in mailer.messages:
+            self.assertNotIn(b"Bcc:", message)
@@ -0,0 +1,154 @@
+from collective.volto.formsupport.interfaces import IPostAdapter
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from zope.component import getMultiAdapter
+
+import json
+import os
+import time
+import unittest
+
+
+SAMPLES = [
+    "",
+    "yes",
+    "  John Doe  ",
+    "john@doe.com",
+    "multi\nline\n text",
+    "1 > 0",
+    "a < b",
+    "Fish &amp; Chips",
+    "AT&T",
+    "<b>bold</b> text",
+    "<script>alert('x')</script>",
+    '<a href="/foo" onclick="evil()">link</a>',
+    "&#8364; 10",
+    "unknown &entity; here",
+]
+
+
+class TestSanitize(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.transforms = api.portal.get_tool(name="portal_transforms")
+
+    def get_adapter(self, values):
+        document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"field_id": f"field_{i}", "label": f"Field {i}"}
+                    for i in range(len(values))
+                ],
+            },
+        }
+        self.request["BODY"] = json.dumps(
+            {
+                "block_id": "form-id",
+                "data": [
+                    {"field_id": f"field_{i}", "value": value}
+                    for i, value in enumerate(values)
+                ],
+            }
+        )
+        return getMultiAdapter((document, self.request), IPostAdapter)
+
+    def convert(self, value):
+        return (
+            self.transforms.convertTo("text/plain", value, mimetype="text/html")
+            .getData()
+            .strip()
+        )
+
+    def test_same_output_as_the_transform(self):
+        adapter = self.get_adapter(SAMPLES)
+
+        self.assertEqual(
+            [field["value"] for field in adapter.form_data["data"]],
+            [self.convert(value) for value in SAMPLES],
+        )
+
+    def test_non_string_values_are_not_changed(self):
+        adapter = self.get_adapter([True, 42, ["a", "<b>b</b>"]])
+
+        self.assertEqual(
+            [field["value"] for field in adapter.form_data["data"]],
+            [True, 42, ["a", "<b>b</b>"]],
+        )
+
+
+@unittest.skipUnless(
+    os.environ.get("FORMSUPPORT_BENCHMARKS"), "set FORMSUPPORT_BENCHMARKS to run"
+)
+class BenchmarkSanitize(unittest.TestCase):
+    """Compare the per-field transform with the sanitize_values fast path.
+
+    FORMSUPPORT_BENCHMARKS=1 zope-testrunner --test-path=src -t BenchmarkSanitize
+    """
+
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+    rounds = 20
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.transforms = api.portal.get_tool(name="portal_transforms")
+        self.adapter = getMultiAdapter(
+            (self.portal, self.layer["request"]), IPostAdapter
+        )
+
+    def get_values(self, size):
+        # mostly plain values, as in real forms, with some markup
+        values = []
+        for i in range(size):
+            if i % 10 == 0:
+                values.append(f"<p>Some <b>rich</b> text number {i} &amp; more</p>")
+            elif i % 3 == 0:
+                values.append(f"user{i}@example.com")
+            else:
+                values.append(f"Plain answer number {i}")
+        return values
+
+    def run_benchmark(self, size):
+        values = self.get_values(size)
+
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            expected = [
+                self.transforms.convertTo("text/plain", value, mimetype="text/html")
+                .getData()
+                .strip()
+                for value in values
+            ]
+        transform_time = (time.perf_counter() - start) / self.rounds
+
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            result = self.adapter.sanitize_values(values)
+        fast_path_time = (time.perf_counter() - start) / self.rounds
+
+        self.assertEqual(result, expected)
+        print(
+            f"\n{size} fields: transform {transform_time * 1000:.2f}ms, "
+            f"sanitize_values {fast_path_time * 1000:.2f}ms "
+            f"({transform_time / fast_path_time:.1f}x)"
+        )
+
+    def test_50_fields(self):
+        self.run_benchmark(50)
+
+    def test_500_fields(self):
+        self.run_benchmark(500)
@@ -0,0 +1,312 @@
+from collective.volto.formsupport.interfaces import IPostAdapter
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    AttachmentField,
+)
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    construct_fields,
+)
+from collective.volto.formsupport.restapi.services.submit_form.field import EmailField
+from collective.volto.formsupport.schema import FieldTemplate
+from collective.volto.formsupport.schema import FormSchema
+from collective.volto.formsupport.schema import get_form_schema
+from collective.volto.formsupport.schema import sort_show_when
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from zope.component import getMultiAdapter
+
+import json
+import unittest
+
+
+BLOCK = {
+    "@type": "form",
+    "store": True,
+    "send": ["recipient", "acknowledgement"],
+    "acknowledgementFields": "email",
+    "name": "full_name",
+    "subblocks": [
+        {"field_id": "name", "label": "Name", "field_type": "text"},
+        {
+            "field_id": "email",
+            "label": "Email",
+            "field_type": "from",
+            "use_as_bcc": True,
+            "use_as_reply_to": True,
+        },
+        {
+            "field_id": "age",
+            "label": "Age",
+            "field_type": "text",
+            "validations": ["isInt"],
+            "validationSettings": {
+                "isInt-foo": "bar",
+                "isURL-foo": "ignored, not enabled",
+                "broken": "ignored",
+            },
+        },
+        {"field_id": "file", "label": "File", "field_type": "attachment"},
+    ],
+}
+
+
+class TestFormSchema(unittest.TestCase):
+    def test_schema(self):
+        schema = FormSchema(BLOCK)
+
+        self.assertEqual(schema.field_ids, ("name", "email", "age", "file"))
+        self.assertEqual(schema.get("email")["label"], "Email")
+        self.assertEqual(schema.validations["age"], {"isInt": {"foo": "bar"}})
+        self.assertEqual(schema.validations["name"], {})
+        self.assertEqual(schema.custom_field_ids, {"name": "full_name"})
+        self.assertEqual(
+            schema.labels,
+            {"full_name": "Name", "email": "Email", "age": "Age", "file": "File"},
+        )
+        self.assertEqual(schema.bcc_fields, {"email"})
+        self.assertEqual(schema.reply_to_fields, ("email",))
+        self.assertEqual(schema.acknowledgement_field, "email")
+
+    def test_accepts_custom_field_ids(self):
+        schema = FormSchema(BLOCK)
+
+        self.assertTrue(schema.accepts("name"))
+        self.assertTrue(schema.accepts("full_name"))
+        self.assertFalse(schema.accepts("unknown"))
+
+    def test_form_fields(self):
+        fields = FormSchema(BLOCK).form_fields()
+
+        self.assertEqual(fields[0]["custom_field_id"], "full_name")
+        self.assertNotIn("custom_field_id", fields[1])
+        self.assertNotIn("custom_field_id", BLOCK["subblocks"][0])
+
+    def test_unknown_acknowledgement_field(self):
+        schema = FormSchema({**BLOCK, "acknowledgementFields": "missing"})
+
+        self.assertIsNone(schema.acknowledgement_field)
+
+    def test_cached_by_block_content(self):
+        schema = get_form_schema(BLOCK)
+
+        self.assertIs(get_form_schema(json.loads(json.dumps(BLOCK))), schema)
+        changed = {**BLOCK, "subblocks": BLOCK["subblocks"][:1]}
+        self.assertIsNot(get_form_schema(changed), schema)
+        self.assertEqual(get_form_schema(changed).field_ids, ("name",))
+
+
+class TestFieldTemplate(unittest.TestCase):
+    def test_parts(self):
+        template = FieldTemplate("Request from ${name} (${email})")
+
+        self.assertEqual(
+            template.parts,
+            (
+                (False, "Request from "),
+                (True, "${name}"),
+                (False, " ("),
+                (True, "${email}"),
+                (False, ")"),
+            ),
+        )
+        self.assertEqual(template.placeholders, ("${name}", "${email}"))
+
+    def test_render(self):
+        template = FieldTemplate("Request from ${name} (${email}), ${unknown}")
+        data = [
+            {"field_id": "email", "value": "john@doe.com"},
+            {"field_id": "name", "value": "John"},
+            {"field_id": "name", "value": "ignored"},
+        ]
+
+        self.assertEqual(
+            template.render(data), "Request from John (john@doe.com), ${unknown}"
+        )
+        self.assertEqual(
+            FieldTemplate("no placeholders").render(data), "no placeholders"
+        )
+
+    def test_render_non_string_values(self):
+        template = FieldTemplate("${count} items, ${accept}")
+        data = [
+            {"field_id": "count", "value": 3},
+            {"field_id": "accept", "value": True},
+        ]
+
+        self.assertEqual(template.render(data), "3 items, True")
+
+    def test_values_are_not_templates(self):
+        template = FieldTemplate("${name} ${email}")
+        data = [
+            {"field_id": "name", "value": "${email}"},
+            {"field_id": "email", "value": "john@doe.com"},
+        ]
+
+        self.assertEqual(template.render(data), "${email} john@doe.com")
+
+    def test_placeholder_containing_the_field_id(self):
+        template = FieldTemplate("Hello ${field_name_123321}")
+        data = [{"field_id": "123321", "value": "John"}]
+
+        self.assertEqual(template.render(data), "Hello John")
+        # an exact id wins
+        data.append({"field_id": "field_name_123321", "value": "Jane"})
+        self.assertEqual(template.render(data), "Hello Jane")
+
+    def test_schema_subject_template(self):
+        schema = FormSchema({**BLOCK, "default_subject": "From ${name}"})
+
+        self.assertEqual(schema.subject_template.placeholders, ("${name}",))
+
+
+CONDITIONAL_BLOCK = {
+    "@type": "form",
+    "store": True,
+    "subblocks": [
+        {
+            "field_id": "c",
+            "label": "C",
+            "required": True,
+            "show_when_when": "b",
+            "show_when_is": "value_is",
+            "show_when_to": "yes",
+        },
+        {
+            "field_id": "b",
+            "label": "B",
+            "show_when_when": "a",
+            "show_when_is": "value_is",
+            "show_when_to": "yes",
+        },
+        {"field_id": "a", "label": "A", "show_when_when": "always"},
+        {
+            "field_id": "d",
+            "label": "D",
+            "show_when_when": "a",
+            "show_when_is": "value_is_not",
+            "show_when_to": "yes",
+        },
+    ],
+}
+
+
+class TestShowWhen(unittest.TestCase):
+    def get_fields(self, **values):
+        return construct_fields(
+            [{"id": field_id, "value": value} for field_id, value in values.items()]
+        )
+
+    def test_sort_show_when(self):
+        order, cycles = sort_show_when({"c": "b", "b": "a", "d": "a", "a": "x"})
+        self.assertEqual(order, ("a", "b", "d", "c"))
+        self.assertEqual(cycles, ())
+
+        order, cycles = sort_show_when({"a": "b", "b": "a", "c": "x", "d": "a"})
+        self.assertEqual(order, ("c",))
+        self.assertEqual(cycles, ("a", "b", "d"))
+
+    def test_schema_order(self):
+        schema = FormSchema(CONDITIONAL_BLOCK)
+
+        self.assertEqual(schema.show_when_order, ("b", "d", "c"))
+        self.assertEqual(schema.show_when["c"], ("b", "value_is", "yes"))
+        self.assertNotIn("a", schema.show_when)
+
+    def test_hidden_fields(self):
+        schema = FormSchema(CONDITIONAL_BLOCK)
+
+        self.assertEqual(schema.hidden_fields(self.get_fields(a="yes", b="yes")), {"d"})
+        self.assertEqual(
+            schema.hidden_fields(self.get_fields(a="yes", b="no")), {"c", "d"}
+        )
+        # not submitted controlling fields don't hide anything
+        self.assertEqual(schema.hidden_fields(self.get_fields(c="")), set())
+
+    def test_hidden_chain(self):
+        schema = FormSchema(CONDITIONAL_BLOCK)
+
+        # b has the right value for c, but it is hidden itself
+        self.assertEqual(
+            schema.hidden_fields(self.get_fields(a="no", b="yes", c="")), {"b", "c"}
+        )
+
+    def test_cycles_check_their_own_condition(self):
+        schema = FormSchema(
+            {
+                "subblocks": [
+                    {
+                        "field_id": "a",
+                        "show_when_when": "b",
+                        "show_when_is": "value_is",
+                        "show_when_to": "yes",
+                    },
+                    {
+                        "field_id": "b",
+                        "show_when_when": "a",
+                        "show_when_is": "value_is",
+                        "show_when_to": "yes",
+                    },
+                ]
+            }
+        )
+
+        self.assertEqual(schema.show_when_cycles, ("a", "b"))
+        self.assertEqual(schema.hidden_fields(self.get_fields(a="yes", b="no")), {"a"})
+
+
+class TestFormSchemaSubmission(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {"form-id": BLOCK}
+
+    def test_fields_use_their_own_spec(self):
+        self.request["BODY"] = json.dumps(
+            {
+                "block_id": "form-id",
+                "data": [
+                    {"field_id": "email", "value": "john@doe.com"},
+                    {"field_id": "name", "value": "John"},
+                    {"field_id": "file", "value": "file.txt"},
+                    {"field_id": "unknown", "value": "skipped"},
+                ],
+            }
+        )
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+        email, name, attachment = adapter.format_fields()
+
+        self.assertIsInstance(email, EmailField)
+        self.assertEqual(email.label, "Email")
+        self.assertEqual(name.label, "Name")
+        self.assertEqual(name.field_id, "full_name")
+        self.assertIsInstance(attachment, AttachmentField)
+        self.assertEqual(
+            [field.field_id for field in adapter.filter_parameters()],
+            ["email", "full_name"],
+        )
+
+    def test_hidden_required_fields_are_not_validated(self):
+        self.document.blocks = {"form-id": CONDITIONAL_BLOCK}
+        data = {
+            "block_id": "form-id",
+            "data": [
+                {"field_id": "a", "value": "no"},
+                {"field_id": "b", "value": "yes"},
+                {"field_id": "c", "value": ""},
+            ],
+        }
+        self.request["BODY"] = json.dumps(data)
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+
+        self.assertEqual(adapter()["data"], data["data"])
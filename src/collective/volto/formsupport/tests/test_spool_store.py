@@ -0,0 +1,355 @@
+from collective.volto.formsupport.datamanager.catalog import FormDataStore
+from collective.volto.formsupport.datamanager.spool import DELETED
+from collective.volto.formsupport.datamanager.spool import INDEX
+from collective.volto.formsupport.datamanager.spool import SpoolChanges
+from collective.volto.formsupport.datamanager.spool import SpoolFile
+from collective.volto.formsupport.datamanager.spool import SpoolFormDataStore
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.restapi.services.form_data.form_data import (
+    FormData,
+)
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    construct_fields,
+)
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING,
+)
+from collective.volto.formsupport.tests import test_store_action_form
+from datetime import datetime
+from datetime import timedelta
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from unittest import mock
+from ZODB.POSException import ConflictError
+from zope.component import getMultiAdapter
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import transaction
+import unittest
+
+
+NOW = datetime.now()
+
+
+class TestSpoolStore(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.tempdir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(
+            os.environ, {"FORM_DATA_SPOOL_DIRECTORY": self.tempdir}
+        )
+        self.environ.start()
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "form-a": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"field_id": "message", "label": "Message", "field_type": "text"},
+                    {"field_id": "name", "label": "Name", "field_type": "text"},
+                ],
+            },
+            "form-b": {"@type": "form", "store": True},
+        }
+        transaction.commit()
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.store = getMultiAdapter((self.document, self.request), IFormDataStore)
+
+    def tearDown(self):
+        transaction.abort()
+        self.environ.stop()
+        shutil.rmtree(self.tempdir)
+
+    def add_records(self):
+        for id, block_id, days in (
+            (1, "form-a", 1),
+            (2, "form-a", 5),
+            (3, "form-a", 10),
+            (4, "form-a", 40),
+            (5, "form-b", 2),
+            (6, "form-b", 20),
+        ):
+            self.store._append(
+                id, block_id, NOW - timedelta(days=days), None, [["a", "A"]], [id]
+            )
+        transaction.commit()
+
+    def ids(self, records):
+        return [record.intid for record in records]
+
+    def test_adapter(self):
+        self.assertIsInstance(self.store, SpoolFormDataStore)
+        with mock.patch.dict(os.environ, {"FORM_DATA_SPOOL_DIRECTORY": ""}):
+            store = getMultiAdapter((self.document, self.request), IFormDataStore)
+        self.assertIsInstance(store, FormDataStore)
+
+    def test_add(self):
+        record_id = self.store.add(
+            construct_fields(
+                [
+                    {"field_id": "name", "value": "John"},
+                    {"field_id": "message", "value": "hi"},
+                    {"field_id": "unknown", "value": "skipped"},
+                ]
+            )
+        )
+        # written on commit
+        self.assertEqual(self.store.length(), 0)
+        transaction.commit()
+        (record,) = self.store.search()
+
+        self.assertEqual(record.intid, record_id)
+        self.assertEqual(record.attrs["block_id"], "form-a")
+        self.assertEqual(
+            self.store.record_fields(record),
+            [("name", "Name", "John"), ("message", "Message", "hi")],
+        )
+        expanded = FormData(self.document, self.request).expand_records(record)
+        self.assertEqual(expanded["message"], {"value": "hi", "label": "Message"})
+
+    def test_files(self):
+        self.add_records()
+        (spool_file,) = self.store.get_files("form-b")
+        data, entries, deleted = spool_file.read()
+
+        self.assertEqual(len(data[:].splitlines()), 2)
+        self.assertEqual([entry[2] for entry in entries], [5, 6])
+        self.assertEqual(os.path.getsize(spool_file.index_path), 2 * INDEX.size)
+        offset = entries[1][0]
+        self.assertEqual(json.loads(data[offset : data.find(b"\n", offset)])["id"], 6)
+
+    def test_search(self):
+        self.add_records()
+
+        self.assertEqual(self.ids(self.store.search()), [1, 5, 2, 3, 6, 4])
+        self.assertEqual(self.ids(self.store.search(reverse=False))[:2], [4, 6])
+        self.assertEqual(self.ids(self.store.search(block_id="form-b")), [5, 6])
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))), [6, 4]
+        )
+        self.assertEqual(
+            self.ids(
+                self.store.search(
+                    date_from=NOW - timedelta(days=10), date_to=NOW - timedelta(days=2)
+                )
+            ),
+            [2, 3],
+        )
+        self.assertEqual(self.ids(self.store.search(limit=2, offset=1)), [5, 2])
+        self.assertEqual(self.ids(self.store.search(offset=4)), [6, 4])
+        self.assertEqual(
+            self.ids(self.store.search(sort_on="block_id", reverse=False)),
+            [4, 3, 2, 1, 6, 5],
+        )
+        with self.assertRaises(ValueError):
+            self.store.search(sort_on="unknown")
+
+    def test_stored_fields(self):
+        self.store._append(1, "form-a", NOW, None, [["a", "A"]], [1])
+        self.store._append(2, "form-a", NOW, None, [["b", "B"], ["a", "A"]], [2, 1])
+        self.store._append(3, "form-b", NOW, None, [["a", "A"]], [1])
+        transaction.commit()
+        self.store._append(4, "form-a", NOW, None, [["a", "A"]], [1])
+        transaction.commit()
+
+        self.assertEqual(
+            self.store.stored_fields(block_id="form-a"), [("b", "B"), ("a", "A")]
+        )
+        (spool_file,) = self.store.get_files("form-a")
+        self.assertEqual(len(spool_file.read_schemas()), 2)
+
+    def test_schema_versions(self):
+        self.store._append(1, "form-a", NOW, None, [["a", "A"]], [1])
+        self.store._append(2, "form-a", NOW, None, [["b", "B"], ["a", "A"]], [2, 1])
+        transaction.commit()
+        (spool_file,) = self.store.get_files("form-a")
+        spool_file.append([(3, NOW.timestamp(), {}, (("a", "A"),))])
+        with open(spool_file.data_path, "rb") as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual([json.loads(line)["schema"] for line in lines], [0, 1, 0])
+        self.assertNotIn(b'"fields"', lines[0])
+        self.assertEqual(len(spool_file.read_schemas()), 2)
+
+        # a line written with the whole schema, by an older version
+        with open(spool_file.data_path, "wb") as fd:
+            fd.write(b"\n".join(lines[:2]) + b"\n")
+            fd.write(
+                json.dumps(
+                    {
+                        "id": 3,
+                        "block_id": "form-a",
+                        "date": NOW.isoformat(),
+                        "fields": [["c", "C"]],
+                        "values": [3],
+                    }
+                ).encode("utf-8")
+                + b"\n"
+            )
+
+        records = self.store.search(sort_on="block_id", reverse=False)
+        self.assertEqual(
+            [self.store.record_fields(record) for record in records],
+            [[("a", "A", 1)], [("b", "B", 2), ("a", "A", 1)], [("c", "C", 3)]],
+        )
+
+        # the files removed and written again (i.e. by another process)
+        other = SpoolFile(spool_file.path, "form-a")
+        other.remove()
+        other.append([(4, NOW.timestamp(), {}, (("d", "D"),))])
+        self.assertEqual(spool_file.read()[1][0][2], 4)
+        self.assertEqual(spool_file.get_schema(0), (("d", "D"),))
+
+    def test_length(self):
+        self.add_records()
+
+        self.assertEqual(self.store.length(), 6)
+        self.assertEqual(self.store.length(block_id="form-a"), 4)
+        self.assertEqual(
+            self.store.count(block_id="form-a", date_to=NOW - timedelta(days=5)), 2
+        )
+
+    def test_delete(self):
+        self.add_records()
+
+        self.store.delete(1)
+        transaction.commit()
+        with self.assertRaises(KeyError):
+            self.store.delete(1)
+        self.assertEqual(self.store.delete_many([2, 5, 99]), 2)
+        transaction.commit()
+        self.assertEqual(self.store.length(), 3)
+        self.assertEqual(
+            self.store.delete_query(
+                block_id="form-a", date_to=NOW - timedelta(days=20)
+            ),
+            1,
+        )
+        transaction.commit()
+        self.assertEqual(self.ids(self.store.search()), [3, 6])
+        # the rewritten file drops the deleted lines too
+        (spool_file,) = self.store.get_files("form-a")
+        self.assertEqual(len(spool_file.read()[0][:].splitlines()), 1)
+
+        self.store.clear()
+        transaction.commit()
+        self.assertEqual(self.store.length(), 0)
+
+    def test_abort(self):
+        self.add_records()
+        self.store.delete(1)
+        self.store._append(7, "form-a", NOW, None, [], [])
+        transaction.abort()
+
+        self.assertEqual(self.store.length(), 6)
+
+    def test_write_error(self):
+        self.add_records()
+        self.store._append(7, "form-a", NOW, None, [], [])
+
+        with mock.patch.object(SpoolFile, "append", side_effect=OSError("full")):
+            with self.assertRaises(OSError):
+                transaction.commit()
+        transaction.abort()
+        self.assertEqual(self.store.length(), 6)
+
+    def test_rollback(self):
+        self.add_records()
+        self.store._append(7, "form-a", NOW, None, [], [])
+        # a data manager voting after the spool
+        failing = mock.Mock(spec=SpoolChanges)
+        failing.sortKey.return_value = "~~failing"
+        failing.tpc_vote.side_effect = ConflictError
+        transaction.get().join(failing)
+
+        with self.assertRaises(ConflictError):
+            transaction.commit()
+        transaction.abort()
+        self.assertEqual(self.store.length(), 6)
+        self.assertNotIn(7, self.ids(self.store.search()))
+
+    def test_count(self):
+        self.add_records()
+        (spool_file,) = self.store.get_files("form-b")
+        self.assertEqual(len(spool_file), 2)
+
+        # deleted twice by concurrent transactions
+        self.assertEqual(spool_file.delete([5]), 1)
+        self.assertEqual(spool_file.delete([5, 99]), 0)
+        self.assertEqual(len(spool_file), 1)
+
+        # a count that doesn't match the files is computed again
+        spool_file._save_count(10)
+        with open(spool_file.deleted_path, "ab") as fd:
+            fd.write(DELETED.pack(6))
+        self.assertEqual(len(spool_file), 0)
+
+    def test_values(self):
+        values = (("a", 1), NOW, b"bytes")
+        self.store._append(1, "form-a", NOW, None, [], values)
+        transaction.commit()
+
+        (record,) = self.store.search()
+        self.assertEqual(record.attrs["_values"], values)
+
+    def test_other_contents(self):
+        self.add_records()
+        other = api.content.create(
+            type="Document", title="Other", container=self.portal
+        )
+        store = getMultiAdapter((other, self.request), IFormDataStore)
+
+        self.assertEqual(store.length(), 0)
+        store.clear()
+        transaction.commit()
+        self.assertEqual(self.store.length(), 6)
+
+    def test_concurrent_appends(self):
+        def append(start):
+            for id in range(start, start + 50):
+                self.store._append(id, "form-a", NOW, None, [], [])
+                transaction.commit()
+
+        threads = [
+            threading.Thread(target=append, args=(start,)) for start in (1, 101, 201)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        records = self.store.search()
+        self.assertEqual(len(records), 150)
+        self.assertEqual(len(set(self.ids(records))), 150)
+
+
+class TestMailStoreSpool(test_store_action_form.TestMailStore):
+    """The submit, listing, export and clear tests with the spool store"""
+
+    # the form isn't stored
+    test_unable_to_store_data = None
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(
+            os.environ, {"FORM_DATA_SPOOL_DIRECTORY": self.tempdir}
+        )
+        self.environ.start()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.environ.stop()
+        shutil.rmtree(self.tempdir)
@@ -0,0 +1,330 @@
+from collective.volto.formsupport.datamanager.catalog import FormDataStore
+from collective.volto.formsupport.datamanager.sqlite import get_database
+from collective.volto.formsupport.datamanager.sqlite import SQLiteFormDataStore
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.restapi.services.form_data.form_data import (
+    FormData,
+)
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    construct_fields,
+)
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from collective.volto.formsupport.tests import test_store_action_form
+from datetime import datetime
+from datetime import timedelta
+from DateTime import DateTime
+from decimal import Decimal
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from souper.soup import Record
+from unittest import mock
+from zope.component import getMultiAdapter
+from zope.interface.verify import verifyObject
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import transaction
+import unittest
+
+
+NOW = datetime.now()
+
+
+class TestSQLiteStore(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "form_data.sqlite")
+        self.environ = mock.patch.dict(os.environ, {"FORM_DATA_SQLITE_PATH": self.path})
+        self.environ.start()
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "form-a": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"field_id": "message", "label": "Message", "field_type": "text"},
+                    {"field_id": "name", "label": "Name", "field_type": "text"},
+                ],
+            },
+            "form-b": {"@type": "form", "store": True},
+        }
+        self.request["BODY"] = json.dumps({"block_id": "form-a"})
+        self.store = getMultiAdapter((self.document, self.request), IFormDataStore)
+
+    def tearDown(self):
+        transaction.abort()
+        self.environ.stop()
+        get_database(self.path).close()
+        shutil.rmtree(self.tempdir)
+
+    def add_records(self):
+        self.a = [
+            self.store._insert(id, "form-a", NOW - timedelta(days=days), None, (), ())
+            for id, days in ((1, 1), (2, 5), (3, 10), (4, 40))
+        ]
+        self.b = [
+            self.store._insert(id, "form-b", NOW - timedelta(days=days), None, (), ())
+            for id, days in ((5, 2), (6, 20))
+        ]
+
+    def ids(self, records):
+        return [record.intid for record in records]
+
+    def test_adapter(self):
+        self.assertIsInstance(self.store, SQLiteFormDataStore)
+        with mock.patch.dict(os.environ, {"FORM_DATA_SQLITE_PATH": ""}):
+            store = getMultiAdapter((self.document, self.request), IFormDataStore)
+        self.assertIsInstance(store, FormDataStore)
+        # both implement the whole interface, deletions included
+        self.assertTrue(verifyObject(IFormDataStore, self.store))
+        self.assertTrue(verifyObject(IFormDataStore, store))
+
+    def test_database(self):
+        connection = get_database(self.path).connection()
+
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        indexes = {row[1] for row in connection.execute("PRAGMA index_list(form_data)")}
+        self.assertIn("form_data_block_date", indexes)
+        self.assertIn("form_data_date", indexes)
+
+    def test_add(self):
+        record_id = self.store.add(
+            construct_fields(
+                [
+                    {"field_id": "name", "value": "John"},
+                    {"field_id": "message", "value": "hi"},
+                    {"field_id": "unknown", "value": "skipped"},
+                ]
+            )
+        )
+        (record,) = self.store.search()
+
+        self.assertEqual(record.intid, record_id)
+        self.assertEqual(record.attrs["block_id"], "form-a")
+        self.assertEqual(
+            self.store.record_fields(record),
+            [("name", "Name", "John"), ("message", "Message", "hi")],
+        )
+        expanded = FormData(self.document, self.request).expand_records(record)
+        self.assertEqual(expanded["message"], {"value": "hi", "label": "Message"})
+        self.assertEqual(expanded["id"], record_id)
+
+    def test_search(self):
+        self.add_records()
+
+        self.assertEqual(self.ids(self.store.search()), [1, 5, 2, 3, 6, 4])
+        self.assertEqual(self.ids(self.store.search(reverse=False))[:2], [4, 6])
+        self.assertEqual(self.ids(self.store.search(block_id="form-b")), [5, 6])
+        self.assertEqual(
+            self.ids(self.store.search(date_to=NOW - timedelta(days=10))), [6, 4]
+        )
+        self.assertEqual(
+            self.ids(
+                self.store.search(
+                    date_from=NOW - timedelta(days=10), date_to=NOW - timedelta(days=2)
+                )
+            ),
+            [2, 3],
+        )
+        self.assertEqual(self.ids(self.store.search(limit=2, offset=1)), [5, 2])
+        self.assertEqual(self.ids(self.store.search(offset=4)), [6, 4])
+        self.assertEqual(
+            self.ids(self.store.search(sort_on="block_id", reverse=False)),
+            [4, 3, 2, 1, 6, 5],
+        )
+        with self.assertRaises(ValueError):
+            self.store.search(sort_on="unknown")
+
+    def test_values(self):
+        values = (
+            "text",
+            3,
+            None,
+            ["a", ("b", 1)],
+            {"name": {"nested": True}, 1: "other keys"},
+            {"__type__": "user data"},
+            {"c", "d"},
+            NOW,
+            NOW.date(),
+            NOW.time(),
+            DateTime("2026-10-17T12:00:00.123456+02:00"),
+            b"\x00bytes",
+            Decimal("1.10"),
+        )
+        record_id = self.store._insert(1, "form-a", NOW, None, (), values)
+
+        (record,) = self.store.search()
+        self.assertEqual(record.intid, record_id)
+        self.assertEqual(record.attrs["_values"], values)
+        self.assertEqual(
+            [type(value) for value in record.attrs["_values"]],
+            [type(value) for value in values],
+        )
+        with self.assertRaises(TypeError):
+            self.store._insert(2, "form-a", NOW, None, (), (object(),))
+
+    def test_lazy_search(self):
+        self.add_records()
+        records = self.store.search(lazy=True, offset=1, limit=4)
+
+        self.assertEqual(self.ids(records), [5, 2, 3, 6])
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[1].intid, 2)
+        self.assertEqual(records[-1].intid, 6)
+        self.assertEqual(self.ids(records[1:3]), [2, 3])
+        self.assertEqual(self.ids(records[2:]), [3, 6])
+        self.assertEqual(self.ids(records[3:10]), [6])
+        self.assertEqual(self.ids(records[::2]), [5, 3])
+        self.assertEqual(records[4:], [])
+        with self.assertRaises(IndexError):
+            records[4]
+
+        # an item is read with its own LIMIT and OFFSET
+        with mock.patch.object(
+            self.store.database, "read", wraps=self.store.database.read
+        ) as read:
+            self.assertEqual(records[2].intid, 3)
+        ((sql, params),) = [call.args for call in read.call_args_list]
+        self.assertTrue(sql.endswith(" LIMIT ? OFFSET ?"))
+        self.assertEqual(params[-2:], [1, 3])
+
+    def test_stored_fields(self):
+        self.store._insert(1, "form-a", NOW, None, (("a", "A"),), (1,))
+        self.store._insert(2, "form-a", NOW, None, (("b", "B"), ("a", "A")), (2, 1))
+        self.store._insert(3, "form-b", NOW, None, (("c", "C"),), (3,))
+
+        self.assertEqual(
+            self.store.stored_fields(block_id="form-a"), [("b", "B"), ("a", "A")]
+        )
+        self.assertEqual(len(self.store.stored_fields()), 3)
+        self.store.clear()
+        self.assertEqual(self.store.stored_fields(), [])
+
+    def test_length(self):
+        self.add_records()
+
+        self.assertEqual(self.store.length(), 6)
+        self.assertEqual(self.store.length(block_id="form-a"), 4)
+        self.assertEqual(
+            self.store.count(block_id="form-a", date_to=NOW - timedelta(days=5)), 2
+        )
+
+    def test_delete(self):
+        self.add_records()
+
+        self.store.delete(1)
+        with self.assertRaises(KeyError):
+            self.store.delete(1)
+        self.assertEqual(self.store.delete_many([2, 5, 99]), 2)
+        self.assertEqual(
+            self.store.delete_query(
+                block_id="form-a", date_to=NOW - timedelta(days=20)
+            ),
+            1,
+        )
+        self.assertEqual(self.ids(self.store.search()), [3, 6])
+
+        self.store.clear()
+        self.assertEqual(self.store.length(), 0)
+
+    def test_other_contents(self):
+        self.add_records()
+        other = api.content.create(
+            type="Document", title="Other", container=self.portal
+        )
+        store = getMultiAdapter((other, self.request), IFormDataStore)
+
+        self.assertEqual(store.length(), 0)
+        store.clear()
+        self.assertEqual(self.store.length(), 6)
+
+    def test_abort(self):
+        self.add_records()
+        transaction.abort()
+
+        self.assertEqual(self.store.length(), 0)
+
+    def test_isolation(self):
+        self.add_records()
+        self.assertEqual(self.store.length(), 6)
+        counts = []
+
+        def count():
+            # a new transaction, in another thread
+            counts.append(self.store.length())
+            get_database(self.path).close()
+
+        thread = threading.Thread(target=count)
+        thread.start()
+        thread.join()
+        self.assertEqual(counts, [0])
+
+    def test_import_records(self):
+        soups = FormDataStore(self.document, self.request)
+        for days, message in ((1, "new"), (5, "old")):
+            record = Record()
+            record.attrs["block_id"] = "form-a"
+            record.attrs["date"] = NOW - timedelta(days=days)
+            record.attrs["message"] = message
+            record.attrs["fields_labels"] = {"message": "Message"}
+            soups.soup.add(record)
+
+        self.assertEqual(self.store.import_records(soups), 2)
+        self.assertEqual(self.store.import_records(soups), 2)
+        records = self.store.search()
+        self.assertEqual(self.ids(records), self.ids(soups.search()))
+        self.assertEqual(
+            self.store.record_fields(records[1]), [("message", "Message", "old")]
+        )
+        self.assertEqual(records[1].attrs["date"], NOW - timedelta(days=5))
+
+    def test_import_records_in_batches(self):
+        soups = FormDataStore(self.document, self.request)
+        for days in (1, 2, 3):
+            record = Record()
+            record.attrs["block_id"] = "form-a"
+            record.attrs["date"] = NOW - timedelta(days=days)
+            soups.soup.add(record)
+
+        with mock.patch.object(
+            soups, "search", wraps=soups.search
+        ) as search, mock.patch("transaction.commit") as commit:
+            self.assertEqual(self.store.import_records(soups, batch_size=2), 3)
+        self.assertTrue(search.call_args.kwargs["lazy"])
+        self.assertEqual(commit.call_count, 1)
+
+
+class TestMailStoreSQLite(test_store_action_form.TestMailStore):
+    """The submit, listing, export and clear tests with the SQLite store"""
+
+    # the form isn't stored
+    test_unable_to_store_data = None
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.environ = mock.patch.dict(
+            os.environ,
+            {"FORM_DATA_SQLITE_PATH": os.path.join(self.tempdir, "form_data.sqlite")},
+        )
+        self.environ.start()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        self.environ.stop()
+        shutil.rmtree(self.tempdir)
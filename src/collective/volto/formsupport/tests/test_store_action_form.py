@@ -1,7 +1,11 @@
+from collective.volto.formsupport.restapi.services.form_data import (
+    csv as csv_export,
+)
 from collective.volto.formsupport.testing import (  # noqa: E501,
     VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING,
 )
 from datetime import datetime
+from io import BytesIO
 from io import StringIO
 from plone import api
 from plone.app.testing import setRoles
@@ -10,11 +14,15 @@ from plone.app.testing import SITE_OWNER_PASSWORD
 from plone.app.testing import TEST_USER_ID
 from plone.restapi.testing import RelativeSession
 from Products.MailHost.interfaces import IMailHost
+from unittest import mock
 from zope.component import getUtility
 
 import csv
+import gzip
+import json
 import transaction
 import unittest
+import zipfile
 
 
 class TestMailStore(unittest.TestCase):
@@ -72,9 +80,9 @@ class TestMailStore(unittest.TestCase):
         response = self.api_session.get(url)
         return response
 
-    def export_csv(self):
+    def export_csv(self, **params):
         url = f"{self.document_url}/@form-data-export"
-        response = self.api_session.get(url)
+        response = self.api_session.get(url, params=params)
         return response
 
     def clear_data(self):
@@ -258,6 +266,195 @@ class TestMailStore(unittest.TestCase):
         self.assertTrue(sorted_data[0][-1].startswith(now))
         self.assertTrue(sorted_data[1][-1].startswith(now))
 
+    def test_export_csv_filters(self):
+        blocks = {
+            "form-a": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"label": "Message", "field_id": "message", "field_type": "text"},
+                    {"label": "Name", "field_id": "name", "field_type": "text"},
+                ],
+            },
+            "form-b": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"label": "Email", "field_id": "email", "field_type": "text"},
+                ],
+            },
+        }
+        for block_id, values in (
+            ("form-a", {"message": "hi", "name": "John"}),
+            ("form-a", {"message": "bye", "name": "Sally"}),
+            ("form-b", {"email": "john@doe.com"}),
+        ):
+            # a page with a single form, as the submission takes the first one
+            self.document.blocks = {block_id: blocks[block_id]}
+            transaction.commit()
+            self.submit_form(
+                data={
+                    "from": "john@doe.com",
+                    "data": [
+                        {"field_id": field_id, "value": value}
+                        for field_id, value in values.items()
+                    ],
+                    "subject": "test subject",
+                    "block_id": block_id,
+                },
+            )
+        self.document.blocks = blocks
+        transaction.commit()
+
+        def export(**params):
+            response = self.export_csv(**params)
+            self.assertEqual(response.status_code, 200)
+            return [*csv.reader(StringIO(response.text), delimiter=",")]
+
+        self.assertEqual(len(export()), 4)
+        data = export(block_id="form-a")
+        self.assertEqual(data[0], ["Message", "Name", "date"])
+        self.assertEqual(sorted(row[0] for row in data[1:]), ["bye", "hi"])
+        data = export(block_id="form-a", fields="name")
+        self.assertEqual(data[0], ["Name", "date"])
+        self.assertEqual(sorted(row[0] for row in data[1:]), ["John", "Sally"])
+        data = export(block_id="form-b")
+        self.assertEqual(data[1][0], "john@doe.com")
+
+        today = datetime.now().date()
+        self.assertEqual(len(export(date_from=today.isoformat())), 4)
+        self.assertEqual(
+            export(date_to=today.isoformat(), block_id="form-b"), [["Email", "date"]]
+        )
+
+        self.assertEqual(self.export_csv(block_id="unknown").status_code, 400)
+        self.assertEqual(self.export_csv(date_from="last week").status_code, 400)
+
+    def test_export_formats(self):
+        self.document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"label": "Message", "field_id": "message", "field_type": "text"},
+                ],
+            },
+        }
+        transaction.commit()
+        self.submit_form(
+            data={
+                "from": "john@doe.com",
+                "data": [{"field_id": "message", "value": "hi"}],
+                "subject": "test subject",
+                "block_id": "form-id",
+            },
+        )
+
+        response = self.export_csv(format="ndjson")
+        self.assertEqual(response.headers["Content-Type"], "application/x-ndjson")
+        self.assertIn(".ndjson", response.headers["Content-Disposition"])
+        (line,) = response.text.splitlines()
+        self.assertEqual(sorted(json.loads(line)), ["Message", "date"])
+
+        response = self.export_csv(format="xlsx")
+        self.assertTrue(
+            response.headers["Content-Type"].startswith(
+                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        )
+        with zipfile.ZipFile(BytesIO(response.content)) as xlsx:
+            self.assertIn(b"hi", xlsx.read("xl/worksheets/sheet1.xml"))
+
+        self.assertEqual(self.export_csv(format="pdf").status_code, 400)
+
+    def test_export_compressed(self):
+        self.document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"label": "Message", "field_id": "message", "field_type": "text"},
+                ],
+            },
+        }
+        transaction.commit()
+        self.submit_form(
+            data={
+                "from": "john@doe.com",
+                "data": [{"field_id": "message", "value": "hi"}],
+                "subject": "test subject",
+                "block_id": "form-id",
+            },
+        )
+        url = f"{self.document_url}/@form-data-export"
+
+        # decoded by the client
+        response = self.export_csv(compress="gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertTrue(
+            response.headers["Content-Type"].startswith("text/comma-separated-values")
+        )
+        self.assertIn('.csv"', response.headers["Content-Disposition"])
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertIn('"hi"', response.text)
+
+        response = self.api_session.get(
+            url,
+            params={"compress": "gzip", "format": "ndjson"},
+            headers={"Accept-Encoding": "identity"},
+        )
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["Content-Type"], "application/gzip")
+        self.assertIn('.ndjson.gz"', response.headers["Content-Disposition"])
+        (line,) = gzip.decompress(response.content).splitlines()
+        self.assertEqual(json.loads(line)["Message"], "hi")
+
+        response = self.export_csv(compress="zip")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["Content-Type"], "application/zip")
+        self.assertIn('.csv.zip"', response.headers["Content-Disposition"])
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            (name,) = archive.namelist()
+            self.assertTrue(name.endswith(".csv"))
+            self.assertIn(b'"hi"', archive.read(name))
+
+        self.assertEqual(self.export_csv(compress="bz2").status_code, 400)
+        self.assertEqual(
+            self.export_csv(compress="zip", format="xlsx").status_code, 400
+        )
+
+    def test_export_csv_in_chunks(self):
+        self.document.blocks = {
+            "form-id": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {
+                        "label": "Message",
+                        "field_id": "message",
+                        "field_type": "text",
+                    },
+                ],
+            },
+        }
+        transaction.commit()
+        for message in ("one", "two", "three"):
+            self.submit_form(
+                data={
+                    "from": "john@doe.com",
+                    "data": [{"field_id": "message", "value": message}],
+                    "subject": "test subject",
+                    "block_id": "form-id",
+                },
+            )
+
+        with mock.patch.object(csv_export, "CHUNK_SIZE", 2):
+            response = self.export_csv()
+        data = [*csv.reader(StringIO(response.text), delimiter=",")]
+        self.assertEqual(data[0], ["Message", "date"])
+        self.assertEqual(sorted(row[0] for row in data[1:]), ["one", "three", "two"])
+        self.assertEqual(response.headers["Content-Length"], str(len(response.content)))
+
     def test_data_id_mapping(self):
         self.document.blocks = {
             "form-id": {
@@ -0,0 +1,159 @@
+from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.interfaces import IPostAdapter
+from collective.volto.formsupport.restapi.services.submit_form.field import (
+    construct_fields,
+)
+from collective.volto.formsupport.submission import get_submission_context
+from collective.volto.formsupport.submission import GLOBAL_FORM_REGISTRY_RECORD_ID
+from collective.volto.formsupport.submission import SubmissionContext
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING,
+)
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from unittest import mock
+from zope.component import getMultiAdapter
+
+import json
+import unittest
+
+
+class TestSubmissionContext(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        self.request = self.layer["request"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "text-id": {"@type": "text"},
+            "form-id": {
+                "@type": "form",
+                "store": True,
+                "subblocks": [
+                    {"field_id": "name", "label": "Name", "field_type": "text"},
+                ],
+            },
+        }
+        self.request["BODY"] = json.dumps(
+            {
+                "block_id": "form-id",
+                "data": [{"field_id": "name", "value": "John"}],
+            }
+        )
+
+    def test_submission_context_is_shared_in_the_request(self):
+        self.assertIs(
+            get_submission_context(self.document, self.request),
+            get_submission_context(self.document, self.request),
+        )
+        self.assertIsNot(
+            get_submission_context(self.document, self.request),
+            get_submission_context(self.portal, self.request),
+        )
+
+    def test_body_parsed_and_block_resolved_once(self):
+        with mock.patch(
+            "collective.volto.formsupport.submission.json_body",
+            side_effect=lambda request: json.loads(request["BODY"]),
+        ) as json_body, mock.patch.object(
+            SubmissionContext,
+            "_resolve_block",
+            autospec=True,
+            side_effect=SubmissionContext._resolve_block,
+        ) as resolve_block:
+            adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+            store = getMultiAdapter((self.document, self.request), IFormDataStore)
+
+            self.assertEqual(adapter.block_id, "form-id")
+            self.assertEqual(store.block_id, "form-id")
+            self.assertEqual(store.get_block(), adapter.block)
+            self.assertEqual(json_body.call_count, 1)
+            self.assertEqual(resolve_block.call_count, 1)
+
+    def test_resolve_global_form(self):
+        global_form = {"@type": "form", "subblocks": [], "global_form_id": "global-id"}
+        api.portal.set_registry_record(
+            GLOBAL_FORM_REGISTRY_RECORD_ID, {"global-id": global_form}
+        )
+        context = get_submission_context(self.document, self.request)
+
+        self.assertEqual(context.resolve_block("form-id", "global-id")["@type"], "form")
+        self.assertEqual(context.resolve_block("missing", "global-id"), global_form)
+        self.assertEqual(context.resolve_block("missing", None), {})
+
+        # a local copy of the global form is preferred
+        self.document.blocks["local-id"] = {
+            "@type": "form",
+            "global_form_id": "global-id",
+            "title": "local",
+        }
+        self.assertEqual(context.resolve_block("other", "global-id")["title"], "local")
+
+    def test_form_fields_do_not_change_the_block(self):
+        self.document.blocks["form-id"]["name"] = "custom-name"
+        store = getMultiAdapter((self.document, self.request), IFormDataStore)
+
+        fields = store.get_form_fields()
+
+        self.assertEqual(fields[0]["custom_field_id"], "custom-name")
+        self.assertNotIn(
+            "custom_field_id", self.document.blocks["form-id"]["subblocks"][0]
+        )
+
+    def test_fields_built_once(self):
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+
+        with mock.patch(
+            "collective.volto.formsupport.adapters.post.construct_fields",
+            wraps=construct_fields,
+        ) as construct:
+            fields = adapter.filter_parameters()
+            self.assertEqual(adapter.filter_parameters(), fields)
+            self.assertEqual(adapter.format_fields(), fields)
+            self.assertEqual(construct.call_count, 1)
+
+        # callers can change the returned list
+        fields.append("other")
+        self.assertEqual(len(adapter.filter_parameters()), 1)
+
+    def test_referer_traversed_only_for_the_page_title(self):
+        self.request["HTTP_REFERER"] = self.document.absolute_url()
+        self.document.blocks["form-id"]["sendAdditionalInfo"] = ["currentUrl"]
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+
+        with mock.patch(
+            "collective.volto.formsupport.adapters.post.api.content.get"
+        ) as get_content:
+            fields = adapter.filter_parameters()
+
+        self.assertEqual([field.field_id for field in fields], ["name", "url"])
+        get_content.assert_not_called()
+
+    def test_page_title_from_referer(self):
+        self.request["HTTP_REFERER"] = self.document.absolute_url()
+        self.document.blocks["form-id"]["sendAdditionalInfo"] = ["title"]
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+
+        fields = adapter.filter_parameters()
+
+        self.assertEqual(fields[-1].field_id, "current_page_title")
+        self.assertEqual(fields[-1].internal_value, "Example context")
+
+    def test_page_title_without_content(self):
+        self.request["HTTP_REFERER"] = self.portal.absolute_url() + "/missing"
+        self.document.blocks["form-id"]["sendAdditionalInfo"] = ["title"]
+        adapter = getMultiAdapter((self.document, self.request), IPostAdapter)
+
+        with self.assertLogs("collective.volto.formsupport", "WARNING") as logs:
+            fields = adapter.filter_parameters()
+
+        self.assertEqual([field.field_id for field in fields], ["name"])
+        self.assertIn("/plone/missing", logs.output[0])
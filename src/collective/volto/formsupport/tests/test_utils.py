@@ -0,0 +1,132 @@
+from bs4 import BeautifulSoup
+from collective.volto.formsupport.testing import (  # noqa: E501,
+    VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING,
+)
+from collective.volto.formsupport.utils import get_block_index
+from collective.volto.formsupport.utils import get_blocks
+from collective.volto.formsupport.utils import render_mail_fragment
+from plone import api
+from plone.app.testing import setRoles
+from plone.app.testing import TEST_USER_ID
+from unittest import mock
+
+import transaction
+import unittest
+
+
+class TestBlockIndex(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING
+
+    def setUp(self):
+        self.portal = self.layer["portal"]
+        setRoles(self.portal, TEST_USER_ID, ["Manager"])
+
+        self.document = api.content.create(
+            type="Document",
+            title="Example context",
+            container=self.portal,
+        )
+        self.document.blocks = {
+            "text-id": {"@type": "text"},
+            "form-id": {"@type": "form", "store": True},
+            "columns-id": {
+                "@type": "columns",
+                "data": {
+                    "blocks": {
+                        "nested-form-id": {"@type": "form", "send": ["recipient"]},
+                    },
+                },
+            },
+        }
+        transaction.commit()
+
+    def tearDown(self):
+        api.content.delete(obj=self.document)
+        transaction.commit()
+
+    def test_index_flattens_blocks(self):
+        index = get_block_index(self.document)
+
+        self.assertEqual(
+            sorted(get_blocks(self.document).keys()),
+            ["columns-id", "form-id", "nested-form-id", "text-id"],
+        )
+        self.assertEqual(index.get_form_block("text-id"), {})
+        self.assertEqual(
+            index.get_form_block("nested-form-id"),
+            {"@type": "form", "send": ["recipient"]},
+        )
+        self.assertEqual(
+            sorted(id for id, block in index.find_form_blocks()),
+            ["form-id", "nested-form-id"],
+        )
+        self.assertEqual(
+            [id for id, block in index.find_form_blocks(store=True)], ["form-id"]
+        )
+
+    def test_index_is_cached_by_object_revision(self):
+        index = get_block_index(self.document)
+        self.assertIs(get_block_index(self.document), index)
+        self.assertEqual(index.get("form-id"), self.document.blocks["form-id"])
+
+        self.document.blocks = {"other-form-id": {"@type": "form"}}
+        # pending changes are never cached
+        self.assertEqual(list(get_blocks(self.document)), ["other-form-id"])
+        self.assertIsNot(get_block_index(self.document), index)
+
+        transaction.commit()
+        new_index = get_block_index(self.document)
+        self.assertIs(get_block_index(self.document), new_index)
+        self.assertEqual(list(get_blocks(self.document)), ["other-form-id"])
+
+    def test_index_is_read_only(self):
+        index = get_block_index(self.document)
+
+        with self.assertRaises(TypeError):
+            index.get("form-id")["store"] = False
+        with self.assertRaises(TypeError):
+            get_blocks(self.document)["form-id"]["store"] = False
+        with self.assertRaises(AttributeError):
+            index.get("nested-form-id")["send"].append("acknowledgement")
+        # the form blocks are copies
+        index.get_form_block("form-id")["store"] = False
+        (block,) = [block for id, block in index.find_form_blocks() if id == "form-id"]
+        block["store"] = False
+        index.get_form_block("nested-form-id")["send"].append("acknowledgement")
+
+        self.assertIs(get_block_index(self.document), index)
+        self.assertTrue(index.get_form_block("form-id")["store"])
+        self.assertEqual(index.get("nested-form-id")["send"], ("recipient",))
+        self.assertTrue(self.document.blocks["form-id"]["store"])
+
+
+class TestMailFragment(unittest.TestCase):
+    layer = VOLTO_FORMSUPPORT_API_FUNCTIONAL_TESTING
+
+    def test_relative_links_made_absolute(self):
+        html = render_mail_fragment(
+            '<p>See <a href="/privacy">privacy</a> and <a href="https://plone.org">'
+            "plone</a></p>",
+            "https://example.com",
+        )
+
+        self.assertIn('href="https://example.com/privacy"', html)
+        self.assertIn('href="https://plone.org"', html)
+
+    def test_no_text(self):
+        self.assertIsNone(render_mail_fragment("", "https://example.com"))
+        self.assertIsNone(render_mail_fragment("<p></p>", "https://example.com"))
+
+    def test_cached_by_content_and_base_url(self):
+        with mock.patch(
+            "collective.volto.formsupport.utils.BeautifulSoup",
+            wraps=BeautifulSoup,
+        ) as soup:
+            header = '<p><a href="/cached">header</a></p>'
+            first = render_mail_fragment(header, "https://example.com")
+            self.assertEqual(render_mail_fragment(header, "https://example.com"), first)
+            self.assertEqual(soup.call_count, 1)
+
+            other = render_mail_fragment(header, "https://other.example.com")
+            self.assertIn("https://other.example.com/cached", other)
+            self.assertEqual(soup.call_count, 2)
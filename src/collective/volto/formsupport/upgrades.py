@@ -1,10 +1,13 @@
 from Acquisition import aq_base
 from collective.volto.formsupport.interfaces import IFormDataStore
+from collective.volto.formsupport.utils import flatten_block_hierachy
+from collective.volto.formsupport.utils import get_block_index
 from copy import deepcopy
 from plone import api
 from plone.app.upgrade.utils import installOrReinstallProduct
 from plone.dexterity.utils import iterSchemata
 from plone.i18n.normalizer.interfaces import IIDNormalizer
+from souper.soup import get_soup
 from souper.soup import Record
 from zope.component import getMultiAdapter
 from zope.component import getUtility
@@ -12,6 +15,7 @@ from zope.globalrequest import getRequest
 from zope.schema import getFields
 
 import json
+import transaction
 
 
 try:
@@ -25,15 +29,30 @@ from collective.volto.formsupport import logger
 
 
 DEFAULT_PROFILE = "profile-collective.volto.formsupport:default"
+# records converted in each transaction by to_1304
+COMPACT_BATCH_SIZE = 1000
+
+
+def _iter_blocks(blocks):
+    """All the blocks, including those nested in containers or columns"""
+    for id, block in flatten_block_hierachy(blocks):
+        yield block
 
 
 def _has_block_form(block_data):
-    for block in block_data.values():
+    for block in _iter_blocks(block_data):
         if block.get("@type", "") == "form":
             return True
     return False
 
 
+def _has_stored_form(item):
+    return any(
+        block.get("store", False)
+        for id, block in get_block_index(item).find_form_blocks()
+    )
+
+
 def _get_all_content_with_blocks():
     content = []
 
@@ -240,3 +259,37 @@ def to_1300(context):  # noqa: C901 # pragma: no cover
 
 def to_1301(context):
     installOrReinstallProduct(api.portal.get(), "collective.volto.otp")
+
+
+def to_1303(context):
+    logger.info("### START REBUILD FORM DATA CATALOGS ###")
+
+    for item in _get_all_content_with_blocks():
+        if not _has_stored_form(item):
+            continue
+        soup = get_soup("form_data", item)
+        if "date" in soup.catalog:
+            continue
+        soup.rebuild()
+        logger.info(f"[REBUILT] - {item.absolute_url()}")
+
+    logger.info("### FINISHED REBUILD FORM DATA CATALOGS ###")
+
+
+def to_1304(context):
+    """Convert the records in batches, each committed: converted records are
+    skipped, so the step can be run again if it's interrupted.
+    """
+    logger.info("### START COMPACT FORM DATA RECORDS ###")
+
+    request = getRequest()
+    for item in _get_all_content_with_blocks():
+        if not _has_stored_form(item):
+            continue
+        store = getMultiAdapter((item, request), IFormDataStore)
+        compacted = store.compact_records(batch_size=COMPACT_BATCH_SIZE)
+        if compacted:
+            logger.info(f"[COMPACTED] - {compacted} records in {item.absolute_url()}")
+        transaction.commit()
+
+    logger.info("### FINISHED COMPACT FORM DATA RECORDS ###")
@@ -1,12 +1,23 @@
+from Acquisition import aq_base
+from bs4 import BeautifulSoup
 from collections import deque
+from collections.abc import Mapping
+from plone.memoize import ram
+from types import MappingProxyType
 
-import copy
 import json
 
 
 EMAIL_OTP_LIFETIME = 5 * 60
 
 
+def has_markup(value):
+    """Return True if the string could contain html tags or entities: the html
+    to text conversion leaves anything else as it is.
+    """
+    return "<" in value or "&" in value
+
+
 def flatten_block_hierachy(blocks):
     """Given some blocks, return all contained blocks, including "subblocks"
     This allows embedding the form block into something like columns datastorage
@@ -21,7 +32,7 @@ def flatten_block_hierachy(blocks):
         block_value = blocktuple[1]
 
         if "data" in block_value:
-            if isinstance(block_value["data"], dict):
+            if isinstance(block_value["data"], Mapping):
                 if "blocks" in block_value["data"]:
                     queue.extend(list(block_value["data"]["blocks"].items()))
 
@@ -29,13 +40,125 @@ def flatten_block_hierachy(blocks):
             queue.extend(list(block_value["blocks"].items()))
 
 
+def freeze(value):
+    """A read only version of a JSON value: dicts become mapping proxies and
+    lists tuples
+    """
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """A JSON value with dicts and lists from a value returned by freeze"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class BlockIndex:
+    """Flat index of the blocks of a context, by block id.
+
+    The index is cached and shared between threads, so it keeps a read only
+    version of the blocks (see freeze), built once for each revision of the
+    object: get, items and get_blocks return it without copying. The form
+    block methods return copies of the form blocks only, that callers can
+    change.
+    """
+
+    def __init__(self, blocks):
+        if isinstance(blocks, str):
+            blocks = json.loads(blocks)
+        self._blocks = dict(flatten_block_hierachy(freeze(blocks))) if blocks else {}
+        self._form_block_ids = tuple(
+            id for id, block in self._blocks.items() if block.get("@type", "") == "form"
+        )
+
+    def __contains__(self, block_id):
+        return block_id in self._blocks
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, block_id, default=None):
+        """The read only block with the given id"""
+        return self._blocks.get(block_id, default)
+
+    def items(self):
+        """The (block_id, read only block) pairs"""
+        return self._blocks.items()
+
+    def get_form_block(self, block_id):
+        """Return the form block with the given id, or an empty dict"""
+        block = self._blocks.get(block_id, {})
+        if block.get("@type", "") != "form":
+            return {}
+        return thaw(block)
+
+    def find_form_blocks(self, **criteria):
+        """Return a list of (block_id, block) for the form blocks that have
+        all the given values, i.e. ``find_form_blocks(store=True)``.
+        """
+        result = []
+        for id in self._form_block_ids:
+            block = self._blocks[id]
+            if all(block.get(k) == v for k, v in criteria.items()):
+                result.append((id, thaw(block)))
+        return result
+
+
+def _block_index_cachekey(method, context):
+    """Cache the index for a persistent revision of the object: new or
+    modified (but still not committed) objects are not cached.
+    """
+    obj = aq_base(context)
+    if getattr(obj, "_p_jar", None) is None or getattr(obj, "blocks", None) is None:
+        raise ram.DontCache
+    obj._p_activate()
+    if obj._p_changed:
+        raise ram.DontCache
+    return (id(obj._p_jar.db()), obj._p_oid, obj._p_serial)
+
+
+@ram.cache(_block_index_cachekey)
+def _get_cached_block_index(context):
+    return BlockIndex(getattr(context, "blocks", {}))
+
+
+def get_block_index(context):
+    """Returns the BlockIndex of a context, including blocks coming from slots"""
+    return _get_cached_block_index(context)
+
+
 def get_blocks(context):
-    """Returns all blocks from a context, including those coming from slots"""
+    """Returns all blocks from a context, including those coming from slots,
+    read only (see BlockIndex)
+    """
+    return dict(get_block_index(context).items())
 
-    blocks = copy.deepcopy(getattr(context, "blocks", {}))
-    if isinstance(blocks, str):
-        blocks = json.loads(blocks)
 
-    flat = list(flatten_block_hierachy(blocks)) if blocks else []
+def _mail_fragment_cachekey(method, html, base_url):
+    if not html:
+        raise ram.DontCache
+    return (html, base_url)
 
-    return dict(flat)
+
+@ram.cache(_mail_fragment_cachekey)
+def render_mail_fragment(html, base_url):
+    """Return a mail header/footer with the relative links made absolute with
+    base_url, or None if it has no text.
+
+    The result only changes with the block content and the site url, so it is
+    cached instead of being parsed on every submission.
+    """
+    if not html:
+        return None
+    soup = BeautifulSoup(html)
+    for link in soup.find_all("a"):
+        if link.get("href", "").startswith("/"):
+            link["href"] = base_url + link["href"]
+    return soup.get_text() and soup.prettify() or None